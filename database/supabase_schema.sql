@@ -105,3 +105,137 @@ CREATE TABLE conversacion_historial (
 
 -- Create an index to accelerate the search for histories by user
 CREATE INDEX IF NOT EXISTS idx_conversacion_historial_id_usuario ON conversacion_historial (id_usuario);
+
+-- NEW TABLE: Precomputed per-entity rollups
+-- Filled at ingest time (one set of rows per source file) so that COUNT/SUM/AVG
+-- questions about a tracto, cliente, conductor, estado or day are answered with
+-- an index lookup instead of scanning every fragment.
+CREATE TABLE rollups_entidad (
+    fuente TEXT NOT NULL, -- Source file the rollup was computed from
+    dimension TEXT NOT NULL, -- 'tracto', 'cliente', 'conductor', 'estado' or 'dia'
+    clave TEXT NOT NULL, -- Normalized lookup key (e.g. 'T209', 'GOODYEAR', '2025-03-14')
+    valor TEXT, -- Value as it appears in the source
+    viajes INTEGER NOT NULL, -- Number of trips (rows)
+    kilos NUMERIC, -- Total kilos, NULL if the source has no kilos column or no valid value
+    filas_con_kilos INTEGER, -- Rows with a numeric kilos value (AVG divisor), NULL without a kilos column
+    primera_fecha DATE,
+    ultima_fecha DATE,
+    actualizado_en TIMESTAMPTZ DEFAULT NOW() NOT NULL,
+    PRIMARY KEY (dimension, clave, fuente)
+);
+
+CREATE INDEX IF NOT EXISTS idx_rollups_entidad_clave ON rollups_entidad (clave);
+CREATE INDEX IF NOT EXISTS idx_rollups_entidad_fuente ON rollups_entidad (fuente);
+
+-- Canonical identifier keys per fragment ('contenedor:TCNU5754565', 'rut:12345678-5',
+-- 'tracto:T209', 'fecha:2025-03-14'), computed at ingest by data_validators.py.
+-- Lookups by identifier use containment (claves @> ARRAY[...]) on a GIN index
+-- instead of ilike '%...%' scans over fragmento.
+ALTER TABLE documentos_embeddings ADD COLUMN IF NOT EXISTS claves TEXT[] DEFAULT '{}';
+CREATE INDEX IF NOT EXISTS idx_documentos_embeddings_claves ON documentos_embeddings USING GIN (claves);
+
+-- Source/date partitioning of fragments
+-- Each fragment records the date range of the rows it contains (computed at ingest
+-- from the first date column present, in priority order: fecha_viaje, fecha_emision,
+-- fecha; the same column feeds the 'fecha:' keys and the rollup/profile dates).
+-- Retrieval filters by fuente and by date-range overlap before computing distances
+-- or running ilike, so the work is proportional to the matching partition.
+-- Fragments ingested before this change have NULL dates and are only reached by
+-- the global fallback search until the source is re-ingested.
+ALTER TABLE documentos_embeddings ADD COLUMN IF NOT EXISTS fecha_inicio DATE;
+ALTER TABLE documentos_embeddings ADD COLUMN IF NOT EXISTS fecha_fin DATE;
+CREATE INDEX IF NOT EXISTS idx_documentos_embeddings_particion ON documentos_embeddings (fuente, fecha_inicio, fecha_fin);
+CREATE INDEX IF NOT EXISTS idx_documentos_embeddings_fechas ON documentos_embeddings (fecha_inicio, fecha_fin);
+
+-- Similarity search restricted to a partition. NULL arguments do not filter.
+-- The query is built with only the filters that are present and run with
+-- EXECUTE, so each call is planned with its actual predicates and can use the
+-- (fuente, fecha_inicio, fecha_fin) index; a static "(arg IS NULL OR ...)"
+-- predicate would get a generic plan that cannot.
+CREATE OR REPLACE FUNCTION match_documentos_particion (
+  query_embedding VECTOR(768),
+  match_threshold FLOAT,
+  match_count INT,
+  fuentes TEXT[] DEFAULT NULL,
+  fecha_desde DATE DEFAULT NULL,
+  fecha_hasta DATE DEFAULT NULL
+)
+RETURNS TABLE (
+  id BIGINT,
+  fragmento TEXT,
+  fuente TEXT,
+  similarity FLOAT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  filtros TEXT := '';
+BEGIN
+  IF fuentes IS NOT NULL THEN
+    filtros := filtros || ' AND de.fuente = ANY($4)';
+  END IF;
+  IF fecha_desde IS NOT NULL THEN
+    filtros := filtros || ' AND de.fecha_fin >= $5';
+  END IF;
+  IF fecha_hasta IS NOT NULL THEN
+    filtros := filtros || ' AND de.fecha_inicio <= $6';
+  END IF;
+
+  RETURN QUERY EXECUTE
+    'SELECT de.id, de.fragmento, de.fuente, 1 - (de.embedding <=> $1) AS similarity '
+    || 'FROM documentos_embeddings AS de '
+    || 'WHERE 1 - (de.embedding <=> $1) > $2' || filtros
+    || ' ORDER BY de.embedding <=> $1 LIMIT $3'
+  USING query_embedding, match_threshold, match_count, fuentes, fecha_desde, fecha_hasta;
+END;
+$$;
+
+-- Distinct sources, using the (fuente, ...) index as a skip scan instead of
+-- reading every fragment.
+CREATE OR REPLACE FUNCTION listar_fuentes ()
+RETURNS TABLE (fuente TEXT)
+LANGUAGE sql STABLE
+AS $$
+  WITH RECURSIVE f AS (
+    (SELECT de.fuente FROM documentos_embeddings de ORDER BY de.fuente LIMIT 1)
+    UNION ALL
+    SELECT (SELECT de.fuente FROM documentos_embeddings de WHERE de.fuente > f.fuente ORDER BY de.fuente LIMIT 1)
+    FROM f
+    WHERE f.fuente IS NOT NULL
+  )
+  SELECT f.fuente FROM f WHERE f.fuente IS NOT NULL;
+$$;
+
+-- NEW TABLE: Materialized entity profiles
+-- One row per tracto, conductor, contenedor or cliente and source file, filled at
+-- ingest. `relaciones` holds the distinct associated entities of each other type
+-- with trip counts and last-seen dates, e.g.
+--   {"conductor": {"distintos": 3, "principales": [{"clave": "LUIS ANGULO", "valor": "Luis Angulo", "viajes": 80, "ultima_fecha": "2025-03-30"}]}}
+-- so one-hop questions are answered from a single small document.
+CREATE TABLE perfiles_entidad (
+    fuente TEXT NOT NULL, -- Source file the profile was computed from
+    tipo TEXT NOT NULL, -- 'tracto', 'conductor', 'contenedor' or 'cliente'
+    clave TEXT NOT NULL, -- Normalized lookup key (e.g. 'T209', 'TCNU5754565', 'GOODYEAR')
+    valor TEXT, -- Value as it appears in the source
+    viajes INTEGER NOT NULL,
+    kilos NUMERIC,
+    primera_fecha DATE,
+    ultima_fecha DATE,
+    relaciones JSONB NOT NULL DEFAULT '{}',
+    actualizado_en TIMESTAMPTZ DEFAULT NOW() NOT NULL,
+    PRIMARY KEY (tipo, clave, fuente)
+);
+
+CREATE INDEX IF NOT EXISTS idx_perfiles_entidad_clave ON perfiles_entidad (clave);
+CREATE INDEX IF NOT EXISTS idx_perfiles_entidad_fuente ON perfiles_entidad (fuente);
+
+-- NEW TABLE: Compact conversation state
+-- One row per user, updated after every turn. Prompts receive this state
+-- (active entities plus one short line per recent turn, under a token cap)
+-- instead of the last raw messages from conversacion_historial.
+CREATE TABLE conversacion_estado (
+    id_usuario TEXT PRIMARY KEY,
+    entidades JSONB NOT NULL DEFAULT '{}', -- e.g. {"tracto": "T209", "cliente": "GOODYEAR"}
+    resumen JSONB NOT NULL DEFAULT '[]', -- Short lines, oldest first
+    actualizado_en TIMESTAMPTZ DEFAULT NOW() NOT NULL
+);
@@ -5,14 +5,28 @@ Este módulo contiene el router de FastAPI y define todas las rutas
 relacionadas con la interacción y consulta del agente.
 """
 from fastapi import APIRouter, HTTPException
+from starlette.concurrency import run_in_threadpool
+from langchain_core.documents import Document
 from src.rag_engine.retriever import SupabaseRetriever
 from src.rag_engine.generator import generate_response
 from .schemas import QueryRequest, QueryResponse
-from ..utils.helpers import documents_to_string
-from supabase import create_client
+from ..utils.helpers import documents_to_string, normalizar_consulta, to_serializable
+from ..utils.single_flight import SingleFlight
+from ..utils.gemini_client import GeminiError, cliente_gemini
+from src.rag_engine.vector_store import obtener_vector_store
+from src.rag_engine.conversacion import (
+    actualizar_estado,
+    entidades_mencionadas,
+    estado_a_texto,
+)
+from src.rag_engine.contexto_sesion import ContextoSesiones, entidades_consulta
+from src.data_processing.rollups import DIMENSION_DIA, DIMENSIONES_ROLLUP, clave_entidad
+from src.data_processing.data_validators import etiquetas_consulta
+from src.data_processing.perfiles import aspectos_perfil, claves_perfil_consulta, documentos_perfil, responde_perfil
 import os
 import re
 import json
+import time
 import logging
 
 from google.generativeai import GenerativeModel, types as genai_types
@@ -30,31 +44,99 @@ except ValueError as e:
     retriever = None
     print(f"ADVERTENCIA: No se pudo inicializar el Retriever. {e}")
 
-# Inicializar cliente de Supabase para guardar historial
-supabase_url = os.environ.get("SUPABASE_URL")
-supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-supabase = create_client(supabase_url, supabase_key)
+# Backend de almacenamiento (Supabase o Postgres directo, según VECTOR_STORE_BACKEND)
+store = obtener_vector_store()
+
+# Prioridad de dimensiones al buscar un filtro en los rollups
+ORDEN_DIMENSIONES = [*DIMENSIONES_ROLLUP, DIMENSION_DIA]
+
+# Deduplicación de trabajo idéntico en curso (ver `SingleFlight`)
+_vuelos_consultas = SingleFlight()
+_vuelos_bd = SingleFlight()
 
-# Función auxiliar RECURSIVA para convertir datos a un formato serializable
-def _to_serializable(data):
+# Documentos del último turno de cada sesión, para preguntas de seguimiento
+contexto_sesiones = ContextoSesiones()
+
+# Versión de los datos vectorizados, usada en la clave de deduplicación de consultas
+VERSION_DATOS_TTL = 30.0
+_version_cache = None
+
+def consultar_bd(operacion: str, columna_regex: str = None, filtro_fragmento: str = None, pregunta: str = None) -> any:
     """
-    Convierte de forma recursiva los datos de respuesta de Supabase, incluyendo
-    objetos anidados MapComposite, a un formato serializable por JSON.
+    Ejecuta una consulta simplificada en la base de datos y devuelve un resultado serializable.
+    Las llamadas concurrentes con los mismos argumentos comparten una sola consulta.
+    `pregunta` es la consulta original del usuario; de ella solo importa qué pide
+    (ver `aspectos_perfil`), que decide si un SELECT se responde con el perfil.
     """
-    if data is None:
+    aspectos = aspectos_perfil(pregunta)
+    clave = (operacion.upper(), columna_regex, filtro_fragmento, aspectos)
+    return _vuelos_bd.do(clave, _ejecutar_consulta_bd, operacion, columna_regex, filtro_fragmento, aspectos)
+
+def _consultar_rollups(operacion: str, columna_regex: str = None, filtro_fragmento: str = None) -> any:
+    """
+    Responde COUNT, y SUM/AVG de kilos, desde `rollups_entidad` cuando el filtro
+    corresponde a una entidad conocida. Devuelve None si no aplica.
+    """
+    if not filtro_fragmento:
+        return None
+    operacion = operacion.upper()
+    es_kilos = bool(columna_regex) and 'kilo' in columna_regex.lower()
+    if operacion != "COUNT" and not (operacion in ("SUM", "AVG") and es_kilos):
+        return None
+
+    claves = clave_entidad(filtro_fragmento)
+    filas = store.buscar_rollups(claves)
+    if not filas:
         return None
-    if isinstance(data, list):
-        return [_to_serializable(item) for item in data]
-    if hasattr(data, 'keys'): # Trata objetos dict-like como MapComposite
-        return {key: _to_serializable(value) for key, value in data.items()}
-    return data
 
-def consultar_bd(operacion: str, columna_regex: str = None, filtro_fragmento: str = None) -> any:
+    # Si el valor coincide en varias dimensiones se usa la más específica,
+    # y dentro de ella la primera forma candidata de la clave.
+    for dimension in ORDEN_DIMENSIONES:
+        for clave in claves:
+            seleccion = [f for f in filas if f['dimension'] == dimension and f['clave'] == clave]
+            if seleccion:
+                break
+        if seleccion:
+            break
+    else:
+        return None
+
+    viajes = sum(f['viajes'] for f in seleccion)
+    logging.info(f"consultar_bd respondido desde rollups: dimension={dimension}, clave={clave}")
+    if operacion == "COUNT":
+        return viajes
+    # Rollups sin columna de kilos (o anteriores a `filas_con_kilos`): se usa el cálculo sobre los fragmentos
+    if any(f.get('filas_con_kilos') is None for f in seleccion):
+        return None
+    # El promedio se divide por las filas con kilos válidos, no por todos los viajes
+    kilos = sum(float(f['kilos']) for f in seleccion if f['kilos'] is not None)
+    filas_con_kilos = sum(f['filas_con_kilos'] for f in seleccion)
+    if not filas_con_kilos:
+        return None
+    return kilos if operacion == "SUM" else kilos / filas_con_kilos
+
+def _conteo_fragmentos(total: int) -> dict:
     """
-    Ejecuta una consulta simplificada en Supabase y devuelve un resultado serializable.
+    Resultado de un COUNT sobre fragmentos. Cada fragmento agrupa varias filas,
+    así que no equivale a un número de viajes (que solo dan los rollups); la
+    unidad va en el resultado para que el modelo no la presente como tal.
     """
+    return {
+        'fragmentos': total,
+        'unidad': 'fragmentos de hasta 10 filas que mencionan el filtro; no es el número de viajes',
+    }
+
+def _ejecutar_consulta_bd(operacion: str, columna_regex: str = None, filtro_fragmento: str = None,
+                         aspectos: frozenset = frozenset()) -> any:
     logging.info(f"Ejecutando consultar_bd: operacion={operacion}, filtro_fragmento={filtro_fragmento}, regex={columna_regex}")
 
+    # Primero se intenta responder con los agregados precalculados en la ingesta
+    resultado = _consultar_rollups(operacion, columna_regex, filtro_fragmento)
+    if resultado is not None:
+        if operacion.upper() == "COUNT":
+            return {'viajes': resultado, 'unidad': 'viajes (filas del archivo)'}
+        return resultado
+
     # Construir los filtros si se proporciona el parámetro.
     # Las funciones RPC esperan un objeto JSON para los filtros.
     p_filtros = None
@@ -66,39 +148,48 @@ def consultar_bd(operacion: str, columna_regex: str = None, filtro_fragmento: st
     if operacion.upper() in ["SUM", "AVG", "MAX", "MIN"]:
         if not columna_regex or not p_filtros:
             raise ValueError("SUM/AVG/MAX/MIN requieren columna_regex y filtro_fragmento.")
-        response = supabase.rpc('agregar_columna', {
+        return store.llamar_funcion('agregar_columna', {
             'p_operacion': operacion.upper(),
             'p_columna_regex': columna_regex,
             'p_filtros': p_filtros
-        }).execute()
-        return _to_serializable(response.data)
+        })
     elif operacion.upper() == "SELECT DISTINCT":
         if not columna_regex or not p_filtros:
             raise ValueError("SELECT DISTINCT requiere columna_regex y filtro_fragmento.")
-        response = supabase.rpc('seleccionar_distintos', {
+        return store.llamar_funcion('seleccionar_distintos', {
             'p_columna_regex': columna_regex,
             'p_filtros': p_filtros
-        }).execute()
-        return _to_serializable(response.data)
+        })
 
-    # Operaciones que usan la query builder estándar de Supabase
-    query = supabase.table('documentos_embeddings')
-    
     if operacion.upper() == "COUNT":
-        query = query.select('*', count='exact')
-        if filtro_fragmento:
-            query = query.ilike('fragmento', f'%{filtro_fragmento}%')
-        response = query.execute()
-        return response.count
+        claves = etiquetas_consulta(filtro_fragmento) if filtro_fragmento else []
+        if claves:
+            # Identificador reconocido: se cuenta por clave canónica, sin ilike. Las filas
+            # ingeridas sin claves (anteriores a la columna o de columnas no mapeadas)
+            # no aparecen ahí, así que un 0 se confirma con la búsqueda por texto.
+            total = store.contar_por_claves(claves)
+            if total:
+                return _conteo_fragmentos(total)
+        return _conteo_fragmentos(store.contar_fragmentos(filtro_fragmento))
     
     if operacion.upper() == "SELECT":
-        query = query.select('fragmento')
+        perfiles = []
         if filtro_fragmento:
-            query = query.ilike('fragmento', f'%{filtro_fragmento}%')
-        
+            # Entidad con perfil materializado: un registro compacto con sus entidades
+            # asociadas. Basta solo si la pregunta pide algo que el perfil guarda;
+            # si no, va junto a los fragmentos.
+            documentos = documentos_perfil(store.buscar_perfiles(clave_entidad(filtro_fragmento)))
+            perfiles = [{'fragmento': perfil['texto']} for perfil in documentos]
+            if perfiles and responde_perfil(aspectos, {perfil['tipo'] for perfil in documentos}):
+                return perfiles
         # Se limita a 10 para no sobrecargar el contexto del LLM
-        response = query.limit(10).execute()
-        return _to_serializable(response.data)
+        claves = etiquetas_consulta(filtro_fragmento) if filtro_fragmento else []
+        if claves:
+            # Identificador reconocido: búsqueda exacta por clave canónica
+            resultado = store.buscar_por_claves(claves, limite=10)
+            if resultado:
+                return perfiles + [{'fragmento': fila['fragmento']} for fila in resultado]
+        return perfiles + store.seleccionar_fragmentos(filtro_fragmento, limite=10)
 
     raise ValueError(f"Operación no soportada: {operacion}")
 
@@ -134,18 +225,134 @@ gemini_flash_model = GenerativeModel("gemini-1.5-flash") # Modelo para refinamie
 async def query_agent(request: QueryRequest):
     """
     Recibe una consulta, decide si usar function calling o RAG, y genera una respuesta.
+
+    El pipeline hace llamadas bloqueantes a Gemini y Supabase, por lo que se
+    ejecuta en el threadpool para no bloquear el event loop (y con él el
+    webhook de WhatsApp y el resto de peticiones).
     """
     try:
-        # 1. Recuperar historial de conversación
-        historial_str = ""
-        if request.user_id:
-            # Recuperar de Supabase
-            historial_db = supabase.table("conversacion_historial").select("*").eq("id_usuario", request.user_id).order("creado_en", desc=True).limit(10).execute()
-            if historial_db.data:
-                historial_str = "\n".join([f"{msg['rol']}: {msg['contenido']}" for msg in reversed(historial_db.data)])
-
-        # 2. Enriquecer el prompt con el esquema y operaciones
-        prompt_con_esquema = f"""
+        return await run_in_threadpool(procesar_consulta, request)
+    except GeminiError as e:
+        if e.reintentable:
+            # Gemini está saturado o no responde: se indica al cliente que reintente
+            logging.error(f"Gemini no disponible en query_agent: {e}")
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+        # Error permanente (argumento inválido, permisos, clave): reintentar no sirve
+        logging.error(f"Error no recuperable de Gemini en query_agent: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        # Loggear el error de forma explícita para depuración en Render
+        logging.error(f"Error no controlado en query_agent: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def procesar_consulta(request: QueryRequest) -> QueryResponse:
+    """
+    Ejecuta de forma síncrona el pipeline completo del agente para una consulta.
+    Es compartido por el endpoint `/query` y el webhook de WhatsApp.
+    """
+    # 1. Recuperar el estado compacto de la conversación (entidades activas y resumen)
+    estado = _obtener_estado(request.user_id)
+    historial_str = estado_a_texto(estado)
+
+    # 2. Conjunto de trabajo del turno anterior de la sesión, si la consulta no trae entidades nuevas
+    clave_sesion = request.session_id or request.user_id
+    # Perfiles de las entidades de la pregunta: una sola búsqueda por turno, compartida
+    # por el contexto de la sesión y el estado de la conversación
+    filas_perfil = store.buscar_perfiles(claves_perfil_consulta(request.query)) if clave_sesion else []
+    entidades = entidades_consulta(request.query, filas_perfil) if clave_sesion else frozenset()
+    previo = contexto_sesiones.obtener(clave_sesion, entidades)
+
+    if previo is not None:
+        # Seguimiento sin entidades nuevas: Gemini sigue decidiendo si usar consultar_bd,
+        # y solo la recuperación RAG se reemplaza por los documentos del turno anterior
+        documentos_previos, entidades = previo
+        respuesta_final, relevant_docs, contexto = _responder(request.query, historial_str, documentos_previos)
+        # Un resultado escalar de consultar_bd (COUNT, SUM...) no reemplaza el conjunto de trabajo
+        contexto = contexto or documentos_previos
+    elif historial_str:
+        respuesta_final, relevant_docs, contexto = _responder(request.query, historial_str)
+    else:
+        # Sin historial la respuesta solo depende de la pregunta y de los datos,
+        # así que las consultas idénticas concurrentes comparten una ejecución.
+        clave = (normalizar_consulta(request.query), _version_datos())
+        respuesta_final, relevant_docs, contexto = _vuelos_consultas.do(clave, _responder, request.query, historial_str)
+
+    contexto_sesiones.guardar(clave_sesion, contexto, entidades)
+    _guardar_historial(request.user_id, request.query, respuesta_final)
+    _actualizar_estado(request.user_id, estado, request.query, respuesta_final, filas_perfil)
+
+    source_documents = [doc.dict() for doc in relevant_docs] if relevant_docs is not None else None
+    return QueryResponse(response=respuesta_final, source_documents=source_documents, session_id=request.session_id)
+
+def _obtener_estado(user_id: str):
+    """Recupera el estado compacto de la conversación del usuario (None si no hay)."""
+    if not user_id:
+        return None
+    return store.obtener_estado_conversacion(user_id)
+
+def _actualizar_estado(user_id: str, estado, query: str, respuesta: str, filas_perfil: list):
+    """
+    Incorpora el turno al estado de la conversación: entidades mencionadas en la
+    pregunta o al inicio de la respuesta, y una línea de resumen.
+
+    Es una lectura-modificación-escritura sin bloqueo: si llegan dos turnos del
+    mismo usuario a la vez, gana la última escritura y se pierde la línea de
+    resumen del otro. Se acepta porque el estado es solo un resumen para el
+    prompt; el historial completo queda en `conversacion_historial`.
+    """
+    if not user_id:
+        return
+    try:
+        entidades = entidades_mencionadas(filas_perfil, query, respuesta)
+        store.guardar_estado_conversacion(user_id, actualizar_estado(estado, query, respuesta, entidades))
+    except Exception as e:
+        # La respuesta ya está generada: un fallo aquí solo pierde memoria de este turno
+        logging.error(f"No se pudo actualizar el estado de conversación de {user_id}: {e}")
+
+def _guardar_historial(user_id: str, query: str, respuesta: str):
+    """Guarda el intercambio pregunta/respuesta completo en el historial del usuario."""
+    if not user_id:
+        return
+    store.guardar_historial(user_id, [
+        {"rol": "user", "contenido": query},
+        {"rol": "ai", "contenido": respuesta}
+    ])
+
+def _version_datos() -> int:
+    """
+    Devuelve una versión de los datos vectorizados (el último id insertado),
+    cacheada unos segundos para no consultar la base de datos en cada petición.
+    """
+    global _version_cache
+    ahora = time.monotonic()
+    if _version_cache is not None and ahora - _version_cache[1] < VERSION_DATOS_TTL:
+        return _version_cache[0]
+    version = store.ultima_version()
+    _version_cache = (version, ahora)
+    return version
+
+def _documentos_de_resultado(resultado) -> list:
+    """
+    Convierte los registros devueltos por `consultar_bd` (SELECT) en Documents
+    para el contexto de la sesión. Los resultados escalares no se guardan.
+    """
+    if not isinstance(resultado, list):
+        return []
+    return [
+        Document(page_content=fila['fragmento'], metadata={'source': 'consultar_bd', 'id': 0, 'similarity': None})
+        for fila in resultado if isinstance(fila, dict) and fila.get('fragmento')
+    ]
+
+def _responder(query: str, historial_str: str, documentos_sesion: list = None):
+    """
+    Genera la respuesta a una consulta. Devuelve la respuesta, los documentos
+    usados como contexto (None si se respondió mediante function calling) y el
+    conjunto de trabajo que se guarda para los seguimientos de la sesión.
+    Si se pasan `documentos_sesion` (seguimiento sin entidades nuevas), se usan
+    en lugar de `retrieve_context` cuando no hay llamada a función.
+    """
+    # 2. Enriquecer el prompt con el esquema y operaciones
+    prompt_con_esquema = f"""
 Eres un asistente de base de datos. Tu objetivo es ayudar a los usuarios a consultar una base de datos de logística.
 A continuación se describe el esquema y las operaciones disponibles:
 
@@ -162,105 +369,106 @@ A continuación se describe el esquema y las operaciones disponibles:
   - `filtro_fragmento`: El texto a buscar en la base de datos para filtrar.
 
 ## Instrucciones Clave
-1.  Analiza la pregunta del usuario y el historial. Si es una pregunta de seguimiento, usa el historial para completar los parámetros.
+1.  Analiza la pregunta del usuario y el contexto de la conversación. Si es una pregunta de seguimiento, usa las entidades activas y el resumen para completar los parámetros.
 2.  **CRÍTICO**: Si la pregunta contiene un identificador (ej. un código de tractor 'T209', un ID de contenedor), DEBES usarlo en el parámetro `filtro_fragmento`. Las consultas sin filtro no son útiles.
 3.  Usa `columna_regex` cuando necesites operar sobre un valor específico dentro del texto (ej. sumar los "Kilos").
 4.  Si la pregunta es general y no contiene un filtro claro (ej. "¿quiénes son los conductores?"), NO llames a la función. En su lugar, responde que se necesita más información.
 
 ---
-**Historial:**
+**Contexto de la conversación:**
 {historial_str if historial_str else "No hay historial previo."}
 ---
-**Pregunta:** {request.query}
+**Pregunta:** {query}
 """
-        
-        # 3. Intentar function calling con Gemini 2.5 Pro
-        response = gemini_pro_model.generate_content(prompt_con_esquema)
-        
-        # 4. Si Gemini decide llamar a una función
-        if response.candidates and response.candidates[0].content.parts and response.candidates[0].content.parts[0].function_call:
-            function_call = response.candidates[0].content.parts[0].function_call
-            if function_call.name == "consultar_bd":
-                
-                logging.basicConfig(level=logging.INFO)
-                
-                # Convertir los argumentos de Gemini a un dict de Python estándar
-                args_dict = _to_serializable(function_call.args)
-                
-                logging.info("--- INICIANDO LLAMADA A FUNCIÓN (SIMPLIFICADO) ---")
-                logging.info(f"Argumentos recibidos de Gemini: {args_dict}")
-
-                resultado_crudo = consultar_bd(**args_dict)
-
-                logging.info(f"Resultado de consultar_bd (valor): {resultado_crudo}")
-                logging.info("--- FIN DE LLAMADA A FUNCIÓN ---")
-
-                # 5. Refinamiento de respuesta con Gemini 1.5 Flash
-                prompt_refinamiento = f"""
-                Tu tarea es sintetizar una respuesta clara y concisa a partir de los datos brutos de una base de datos.
-
-                **Pregunta Original del Usuario:**
-                '{request.query}'
-
-                **Datos Brutos de la Base de Datos:**
-                '{resultado_crudo}'
-
-                **INSTRUCCIONES DETALLADAS:**
-                1.  **Analiza la Pregunta:** Entiende exactamente qué información está pidiendo el usuario (p. ej., un nombre, una cantidad, una fecha).
-                2.  **Examina los Datos Brutos:** Los datos son una lista de fragmentos de texto. Cada fragmento es un registro.
-                3.  **Sintetiza la Respuesta:**
-                    - Busca la respuesta a la pregunta dentro de CADA fragmento.
-                    - **Si todos los fragmentos relevantes apuntan a la misma respuesta** (p. ej., el mismo nombre de conductor para el mismo tractor), da esa única respuesta de forma directa. Por ejemplo: "El conductor del tracto T209 es Luis Fernando Angulo Polo."
-                    - **Si los fragmentos muestran diferentes respuestas** (p. ej., diferentes conductores para el mismo tractor en diferentes viajes), entonces indícalo. Por ejemplo: "El tracto T209 ha sido conducido por varias personas, incluyendo a Juan Pérez y a María González."
-                    - **Si los datos no contienen la respuesta**, indica que no se encontró la información.
-                4.  **Formato:**
-                    - Comienza la respuesta indicando que has consultado los registros (ej: "Tras consultar los registros...").
-                    - No devuelvas los datos brutos.
-
-                **Respuesta Pulida:**
-                """
-                respuesta_final = gemini_flash_model.generate_content(prompt_refinamiento).text.strip()
-                
-                # Guardar en historial y devolver
-                if request.user_id:
-                    supabase.table("conversacion_historial").insert([
-                        {"id_usuario": request.user_id, "rol": "user", "contenido": request.query},
-                        {"id_usuario": request.user_id, "rol": "ai", "contenido": respuesta_final}
-                    ]).execute()
-                return QueryResponse(response=respuesta_final)
-        
-        # 6. Si no hay llamada a función, decidir entre RAG o conocimiento general
-        relevant_docs = retriever.retrieve_context(request.query)
-        
-        if not relevant_docs:
-            # No se encontraron documentos, es una pregunta de conocimiento general.
-            # Se usa el modelo Flash para una respuesta conversacional, instruyéndolo
-            # a ignorar el historial si el tema cambia.
-            prompt_general = f"""
-            Responde la pregunta del usuario de forma directa y conversacional. El historial de la conversación es sobre logística, pero la pregunta actual podría no estarlo. Ignora el tema anterior si no es relevante para la pregunta actual.
+    
+    # 3. Intentar function calling con Gemini 2.5 Pro
+    response = cliente_gemini.generate_content(gemini_pro_model, prompt_con_esquema)
+    
+    # 4. Si Gemini decide llamar a una función
+    if response.candidates and response.candidates[0].content.parts and response.candidates[0].content.parts[0].function_call:
+        function_call = response.candidates[0].content.parts[0].function_call
+        if function_call.name == "consultar_bd":
             
-            Historial:
-            {historial_str if historial_str else "No hay historial previo."}
+            logging.basicConfig(level=logging.INFO)
             
-            Pregunta: '{request.query}'
+            # Convertir los argumentos de Gemini a un dict de Python estándar
+            args_dict = to_serializable(function_call.args)
             
-            Respuesta:
+            logging.info("--- INICIANDO LLAMADA A FUNCIÓN (SIMPLIFICADO) ---")
+            logging.info(f"Argumentos recibidos de Gemini: {args_dict}")
+
+            resultado_crudo = consultar_bd(**args_dict, pregunta=query)
+
+            logging.info(f"Resultado de consultar_bd (valor): {resultado_crudo}")
+            logging.info("--- FIN DE LLAMADA A FUNCIÓN ---")
+
+            # 5. Refinamiento de respuesta con Gemini 1.5 Flash
+            prompt_refinamiento = f"""
+            Tu tarea es sintetizar una respuesta clara y concisa a partir de los datos brutos de una base de datos.
+
+            **Pregunta Original del Usuario:**
+            '{query}'
+
+            **Datos Brutos de la Base de Datos:**
+            '{resultado_crudo}'
+
+            **INSTRUCCIONES DETALLADAS:**
+            1.  **Analiza la Pregunta:** Entiende exactamente qué información está pidiendo el usuario (p. ej., un nombre, una cantidad, una fecha).
+            2.  **Examina los Datos Brutos:** Los datos son una lista de fragmentos de texto. Cada fragmento es un registro.
+            3.  **Sintetiza la Respuesta:**
+                - Busca la respuesta a la pregunta dentro de CADA fragmento.
+                - **Si todos los fragmentos relevantes apuntan a la misma respuesta** (p. ej., el mismo nombre de conductor para el mismo tractor), da esa única respuesta de forma directa. Por ejemplo: "El conductor del tracto T209 es Luis Fernando Angulo Polo."
+                - **Si los fragmentos muestran diferentes respuestas** (p. ej., diferentes conductores para el mismo tractor en diferentes viajes), entonces indícalo. Por ejemplo: "El tracto T209 ha sido conducido por varias personas, incluyendo a Juan Pérez y a María González."
+                - **Si los datos no contienen la respuesta**, indica que no se encontró la información.
+            4.  **Formato:**
+                - Comienza la respuesta indicando que has consultado los registros (ej: "Tras consultar los registros...").
+                - No devuelvas los datos brutos.
+
+            **Respuesta Pulida:**
             """
-            respuesta_final = gemini_flash_model.generate_content(prompt_general).text.strip()
-        else:
-            # Se encontraron documentos, usar el flujo RAG normal.
-            context_str = documents_to_string(relevant_docs)
-            respuesta_final = generate_response(request.query, context_str, historial_str)
+            respuesta_final = cliente_gemini.generate_content(gemini_flash_model, prompt_refinamiento).text.strip()
+            return respuesta_final, None, _documentos_de_resultado(resultado_crudo)
+    
+    # 6. Si no hay llamada a función, decidir entre RAG o conocimiento general
+    if documentos_sesion:
+        logging.info(f"Reutilizando {len(documentos_sesion)} documentos del turno anterior de la sesión")
+        relevant_docs = documentos_sesion
+    else:
+        relevant_docs = retriever.retrieve_context(query)
+    
+    if not relevant_docs:
+        # No se encontraron documentos, es una pregunta de conocimiento general.
+        # Se usa el modelo Flash para una respuesta conversacional, instruyéndolo
+        # a ignorar el historial si el tema cambia.
+        prompt_general = f"""
+        Responde la pregunta del usuario de forma directa y conversacional. El historial de la conversación es sobre logística, pero la pregunta actual podría no estarlo. Ignora el tema anterior si no es relevante para la pregunta actual.
         
-        if request.user_id:
-            supabase.table("conversacion_historial").insert([
-                {"id_usuario": request.user_id, "rol": "user", "contenido": request.query},
-                {"id_usuario": request.user_id, "rol": "ai", "contenido": respuesta_final}
-            ]).execute()
-            
-        return QueryResponse(response=respuesta_final, source_documents=[doc.dict() for doc in relevant_docs])
+        Contexto de la conversación:
+        {historial_str if historial_str else "No hay historial previo."}
+        
+        Pregunta: '{query}'
+        
+        Respuesta:
+        """
+        respuesta_final = cliente_gemini.generate_content(gemini_flash_model, prompt_general).text.strip()
+    else:
+        # Se encontraron documentos, usar el flujo RAG normal.
+        context_str = documents_to_string(relevant_docs)
+        respuesta_final = generate_response(query, context_str, historial_str)
 
-    except Exception as e:
-        # Loggear el error de forma explícita para depuración en Render
-        logging.error(f"Error no controlado en query_agent: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+    return respuesta_final, relevant_docs, relevant_docs
+
+@router.get("/gemini/estado", tags=["RAG"])
+async def estado_gemini():
+    """
+    Devuelve los contadores y límites de concurrencia de cada modelo de Gemini.
+    """
+    return cliente_gemini.estadisticas()
+
+@router.get("/sesiones/estado", tags=["RAG"])
+async def estado_sesiones():
+    """
+    Devuelve cuántas preguntas de seguimiento reutilizaron el contexto de la
+    sesión y cuántas requirieron una recuperación nueva.
+    """
+    return contexto_sesiones.estadisticas
@@ -6,6 +6,7 @@ y también incluye los routers de los endpoints definidos en otros módulos.
 """
 from fastapi import FastAPI, Response
 from . import endpoints
+from src.integrations import whatsapp_handler
 
 # Inicializa la instancia de la aplicación FastAPI
 app = FastAPI(
@@ -25,6 +26,22 @@ app = FastAPI(
 # Incluir el router de los endpoints de la API
 # Todas las rutas definidas en `endpoints.router` tendrán el prefijo `/api`
 app.include_router(endpoints.router, prefix="/api", tags=["Agente RAG"])
+# Webhook nativo de WhatsApp (`/api/whatsapp/webhook`)
+app.include_router(whatsapp_handler.router, prefix="/api")
+
+@app.on_event("startup")
+async def iniciar_cola_whatsapp():
+    """
+    Lanza el pool de workers que procesa los mensajes del webhook de WhatsApp.
+    """
+    whatsapp_handler.cola_whatsapp.iniciar()
+
+@app.on_event("shutdown")
+async def detener_cola_whatsapp():
+    """
+    Procesa los mensajes pendientes y detiene los workers de WhatsApp.
+    """
+    await whatsapp_handler.cola_whatsapp.detener()
 
 @app.head("/", tags=["Root"])
 async def head_root():
@@ -0,0 +1,324 @@
+"""
+Normalización y validación vectorizada de identificadores.
+
+Los identificadores llegan con formatos distintos según quién los digitó
+(`TCNU 5754568` vs `TCNU5754568`, `12.345.678-5` vs `123456785`). Este módulo
+los lleva a una forma canónica con operaciones de pandas/numpy sobre columnas
+completas:
+- Contenedores: `ABCU1234567`, validando el dígito verificador ISO 6346.
+- RUT: `12345678-5`, validando el dígito verificador módulo 11.
+- Tractos: `T209`.
+- Fechas: `YYYY-MM-DD`.
+
+Las mismas funciones se aplican en la ingesta (para guardar las claves de cada
+fragmento) y sobre las consultas, de modo que la búsqueda por identificador
+sea una igualdad indexada en lugar de un `ilike '%...%'`.
+"""
+import calendar
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Columnas (normalizadas) con la fecha de un viaje, en orden de prioridad. Las
+# claves `fecha:`, los límites fecha_inicio/fecha_fin y las fechas de rollups y
+# perfiles usan la misma columna: la primera de esta lista presente en el archivo.
+COLUMNAS_FECHA = ['fecha_viaje', 'fecha_emision', 'fecha']
+
+# Tipos de clave canónica y columnas (normalizadas) de las que se obtienen
+COLUMNAS_CLAVE = {
+    'contenedor': ['contenedor', 'numero_contenedor'],
+    'rut': ['rut', 'rut_conductor', 'rut_cliente'],
+    'tracto': ['tracto'],
+    'fecha': COLUMNAS_FECHA,
+}
+
+# Valores de las letras en ISO 6346 (se omiten los múltiplos de 11)
+_VALORES_ISO6346 = {}
+_valor = 10
+for _letra in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
+    if _valor % 11 == 0:
+        _valor += 1
+    _VALORES_ISO6346[_letra] = _valor
+    _valor += 1
+
+_TABLA_ISO6346 = np.zeros(256, dtype=np.int64)
+for _letra, _v in _VALORES_ISO6346.items():
+    _TABLA_ISO6346[ord(_letra)] = _v
+for _digito in '0123456789':
+    _TABLA_ISO6346[ord(_digito)] = int(_digito)
+_PESOS_ISO6346 = 2 ** np.arange(10, dtype=np.int64)
+
+# Pesos del RUT para el cuerpo rellenado a 8 dígitos (de izquierda a derecha)
+_PESOS_RUT = np.array([3, 2, 7, 6, 5, 4, 3, 2], dtype=np.int64)
+
+# Patrones para encontrar identificadores dentro de una consulta en texto libre
+_patron_contenedor_texto = re.compile(r'\b[A-Z]{4}\s?-?\s?\d{6}(?:\s?-?\s?\d)?\b')
+_patron_rut_texto = re.compile(r'\b\d{1,2}\.?\d{3}\.?\d{3}\s?-?\s?[\dK]\b')
+_patron_tracto_texto = re.compile(r'\bT\s?-?\s?\d{2,4}\b')
+_patron_fecha_texto = re.compile(r'\b\d{4}-\d{2}-\d{2}\b|\b\d{1,2}[/-]\d{1,2}[/-]\d{4}\b')
+_patron_mes_iso_texto = re.compile(r'\b(\d{4})-(\d{2})\b(?!-\d)')
+_MESES = {
+    'ENERO': 1, 'FEBRERO': 2, 'MARZO': 3, 'ABRIL': 4, 'MAYO': 5, 'JUNIO': 6, 'JULIO': 7,
+    'AGOSTO': 8, 'SEPTIEMBRE': 9, 'SETIEMBRE': 9, 'OCTUBRE': 10, 'NOVIEMBRE': 11, 'DICIEMBRE': 12,
+}
+_patron_mes_texto = re.compile(r'\b(' + '|'.join(_MESES) + r')\s+(?:DE(?:L)?\s+)?(\d{4})\b')
+
+
+def normalizar_nombre_columna(nombre: str) -> str:
+    """'Fecha Emisión' -> 'fecha_emision'."""
+    texto = unicodedata.normalize('NFKD', str(nombre)).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '_', texto.lower()).strip('_')
+
+
+def buscar_columna(df: pd.DataFrame, candidatos: List[str]) -> Optional[str]:
+    """Primera columna del DataFrame cuyo nombre normalizado está en `candidatos`."""
+    normalizadas = {normalizar_nombre_columna(c): c for c in df.columns}
+    for candidato in candidatos:
+        if candidato in normalizadas:
+            return normalizadas[candidato]
+    return None
+
+
+def _a_texto(serie: pd.Series) -> pd.Series:
+    return serie.astype('string').str.upper().str.strip()
+
+
+def _es_numero(serie: pd.Series) -> pd.Series:
+    """Máscara de los valores numéricos (no texto) de una columna, p. ej. celdas numéricas de Excel."""
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.notna()
+    return serie.map(lambda v: isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool) and not pd.isna(v))
+
+
+def _enteros_a_texto(serie: pd.Series) -> pd.Series:
+    """
+    Números enteros como texto sin decimales. Una columna entera con vacíos llega
+    como float ('12345678.0'); al quitar el punto quedaría un dígito de más.
+    """
+    numeros = _es_numero(serie)
+    if not numeros.any():
+        return serie
+    valores = pd.to_numeric(serie[numeros], errors='coerce')
+    enteros = valores[valores % 1 == 0]
+    resultado = serie.astype(object).copy()
+    resultado[numeros] = pd.NA
+    resultado[enteros.index] = enteros.astype('int64').astype(str)
+    return resultado
+
+
+def canonizar_contenedores(serie: pd.Series) -> pd.Series:
+    """
+    Devuelve la forma canónica `ABCU1234567` de cada contenedor, o NA si el
+    valor no tiene forma de contenedor o su dígito verificador no es válido.
+    Si el valor viene sin dígito verificador, este se calcula.
+    """
+    limpio = _a_texto(serie).str.replace(r'[^A-Z0-9]', '', regex=True)
+    resultado = pd.Series(pd.NA, index=serie.index, dtype='string')
+
+    formato = limpio.str.fullmatch(r'[A-Z]{4}\d{6,7}').fillna(False).astype(bool)
+    if not formato.any():
+        return resultado
+    candidatos = limpio[formato]
+
+    base = candidatos.str.slice(0, 10)
+    codigos = np.frombuffer(''.join(base.tolist()).encode('ascii'), dtype=np.uint8).reshape(-1, 10)
+    digito = (_TABLA_ISO6346[codigos] @ _PESOS_ISO6346) % 11 % 10
+
+    con_digito = candidatos.str.len() == 11
+    declarado = pd.to_numeric(candidatos.str.slice(10, 11), errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    valido = ~con_digito.to_numpy(dtype=bool) | (declarado == digito)
+
+    canonico = base + pd.Series(digito, index=base.index).astype(str)
+    resultado[canonico.index[valido]] = canonico[valido]
+    return resultado
+
+
+def _digito_rut(cuerpos: pd.Series) -> np.ndarray:
+    """Dígito verificador módulo 11 de cada cuerpo de RUT (hasta 8 dígitos)."""
+    relleno = cuerpos.str.zfill(8)
+    digitos = np.frombuffer(''.join(relleno.tolist()).encode('ascii'), dtype=np.uint8).reshape(-1, 8) - ord('0')
+    resto = 11 - (digitos.astype(np.int64) @ _PESOS_RUT) % 11
+    return np.where(resto == 11, '0', np.where(resto == 10, 'K', resto.astype(str)))
+
+
+def canonizar_ruts(serie: pd.Series, cuerpo_sin_dv: bool = True) -> pd.Series:
+    """
+    Devuelve la forma canónica `12345678-5` de cada RUT, o NA si no es válido.
+    Acepta puntos y espacios. Sin guion, el último carácter se toma como dígito
+    verificador si es consistente; si no, y `cuerpo_sin_dv` lo permite, el
+    valor completo se toma como cuerpo.
+    """
+    texto = _a_texto(_enteros_a_texto(serie)).str.replace(r'[.\s]', '', regex=True)
+    resultado = pd.Series(pd.NA, index=serie.index, dtype='string')
+
+    # Interpretación 1: el último carácter es el dígito verificador
+    partes = texto.str.extract(r'^(\d{6,8})-?([\dK])$').dropna()
+    if not partes.empty:
+        valido = (_digito_rut(partes[0]) == partes[1].to_numpy())
+        canonico = partes[0].str.lstrip('0') + '-' + partes[1]
+        resultado[partes.index[valido]] = canonico[valido]
+
+    # Interpretación 2: sin guion ni dígito verificador válido, el valor es solo el cuerpo
+    sin_dv = resultado.isna() & texto.str.fullmatch(r'\d{7,8}').fillna(False).astype(bool)
+    if cuerpo_sin_dv and sin_dv.any():
+        cuerpos = texto[sin_dv]
+        resultado[cuerpos.index] = cuerpos.str.lstrip('0') + '-' + pd.Series(_digito_rut(cuerpos), index=cuerpos.index)
+    return resultado
+
+
+def canonizar_ruts_consulta(serie: pd.Series) -> pd.Series:
+    """
+    Canoniza RUTs escritos en una consulta. Un número suelto ('numero
+    12345678') solo se toma como RUT si su último dígito valida como dígito
+    verificador; escrito con guion o puntos se acepta también como cuerpo.
+    """
+    explicito = _a_texto(serie).str.contains(r'[-.]', regex=True).fillna(False).astype(bool)
+    resultado = canonizar_ruts(serie, cuerpo_sin_dv=False)
+    if explicito.any():
+        resultado[explicito] = canonizar_ruts(serie[explicito])
+    return resultado
+
+
+def canonizar_tractos(serie: pd.Series) -> pd.Series:
+    """'t 209', 'T-209 (ABCD12)' -> 'T209'. NA si no hay código de tracto."""
+    digitos = _a_texto(serie).str.extract(r'\bT\s?-?\s?(\d{2,4})\b', expand=False)
+    return ('T' + digitos).astype('string')
+
+
+def parsear_fechas(serie: pd.Series) -> pd.Series:
+    """
+    Convierte una columna a fechas. Primero se intenta ISO 8601 (lo que entrega
+    el TMS y `_format_row_to_text`) y luego el formato local día/mes/año. Los
+    valores numéricos son números de serie de Excel (días desde 1899-12-30), no
+    nanosegundos desde 1970.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    numeros = _es_numero(serie)
+    fechas = pd.to_datetime(serie.where(~numeros), errors='coerce', format='ISO8601')
+    faltantes = fechas.isna() & serie.notna() & ~numeros
+    if faltantes.any():
+        fechas[faltantes] = pd.to_datetime(serie[faltantes], errors='coerce', dayfirst=True)
+    if numeros.any():
+        seriales = pd.to_numeric(serie[numeros], errors='coerce')
+        fechas[numeros] = pd.to_datetime(seriales, unit='D', origin='1899-12-30', errors='coerce')
+    return fechas
+
+
+def canonizar_fechas(serie: pd.Series) -> pd.Series:
+    """Devuelve cada fecha como 'YYYY-MM-DD' (NA si no se puede interpretar)."""
+    return parsear_fechas(serie).dt.strftime('%Y-%m-%d').astype('string')
+
+
+CANONIZADORES = {
+    'contenedor': canonizar_contenedores,
+    'rut': canonizar_ruts,
+    'tracto': canonizar_tractos,
+    'fecha': canonizar_fechas,
+}
+
+
+def normalizar_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Calcula las claves canónicas de un DataFrame de ingesta. Devuelve un
+    DataFrame con el mismo índice y una columna `clave_<tipo>` por cada tipo de
+    identificador presente (p. ej. `clave_contenedor`, `clave_rut`).
+    """
+    claves = pd.DataFrame(index=df.index)
+    for tipo, candidatos in COLUMNAS_CLAVE.items():
+        if tipo == 'fecha':
+            # Una sola columna de fecha, elegida por prioridad y no por su posición
+            columna = buscar_columna(df, candidatos)
+            columnas = [columna] if columna is not None else []
+        else:
+            columnas = [
+                columna for columna in df.columns
+                if normalizar_nombre_columna(columna) in candidatos
+            ]
+        for i, columna in enumerate(columnas):
+            nombre = f'clave_{tipo}' if i == 0 else f'clave_{tipo}_{i}'
+            claves[nombre] = CANONIZADORES[tipo](df[columna])
+    return claves
+
+
+def _tipo_de_columna(columna: str) -> str:
+    """'clave_rut_1' -> 'rut'."""
+    return columna[len('clave_'):].rstrip('0123456789').rstrip('_')
+
+
+def claves_por_fila(claves: pd.DataFrame) -> List[List[str]]:
+    """Convierte las columnas de claves en listas `tipo:valor` por fila (sin NA)."""
+    if not len(claves.columns):
+        return [[] for _ in range(len(claves))]
+    etiquetadas = [
+        (_tipo_de_columna(columna) + ':' + claves[columna]).astype(object).where(claves[columna].notna(), None)
+        for columna in claves.columns
+    ]
+    return [[c for c in fila if c is not None] for fila in zip(*etiquetadas)]
+
+
+def claves_consulta(texto: str) -> Dict[str, List[str]]:
+    """
+    Encuentra identificadores en una consulta de texto libre y los normaliza con
+    los mismos canonizadores que la ingesta. Devuelve {tipo: [claves]}.
+    """
+    texto = texto.upper()
+    encontrados = {
+        'contenedor': _patron_contenedor_texto.findall(texto),
+        'rut': _patron_rut_texto.findall(texto),
+        'tracto': _patron_tracto_texto.findall(texto),
+        'fecha': _patron_fecha_texto.findall(texto),
+    }
+    canonizadores = {**CANONIZADORES, 'rut': canonizar_ruts_consulta}
+    resultado = {}
+    for tipo, valores in encontrados.items():
+        if not valores:
+            continue
+        canonicos = canonizadores[tipo](pd.Series(valores, dtype='string')).dropna().unique().tolist()
+        if canonicos:
+            resultado[tipo] = canonicos
+    return resultado
+
+
+def rangos_fecha_por_bloque(claves: pd.DataFrame, tamano_bloque: int) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    (primera, última) fecha canónica de cada bloque de `tamano_bloque` filas
+    consecutivas, a partir de la columna `clave_fecha`. (None, None) si el
+    bloque no tiene fechas.
+    """
+    bloques = -(-len(claves) // tamano_bloque)
+    if 'clave_fecha' not in claves.columns:
+        return [(None, None)] * bloques
+    # 'YYYY-MM-DD' ordena igual como texto que como fecha
+    fechas = claves['clave_fecha'].reset_index(drop=True)
+    rangos = fechas.groupby(fechas.index // tamano_bloque).agg(['min', 'max']).reindex(range(bloques))
+    return [
+        (None if pd.isna(inicio) else inicio, None if pd.isna(fin) else fin)
+        for inicio, fin in zip(rangos['min'], rangos['max'])
+    ]
+
+
+def rango_fechas_consulta(texto: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Rango de fechas `YYYY-MM-DD` mencionado en una consulta: fechas exactas,
+    meses ('2025-03', 'marzo de 2025') o ambos. (None, None) si no menciona fechas.
+    """
+    texto_mayus = unicodedata.normalize('NFKD', texto.upper()).encode('ascii', 'ignore').decode()
+    limites = list(claves_consulta(texto).get('fecha', []))
+    meses = [(int(anio), int(mes)) for anio, mes in _patron_mes_iso_texto.findall(texto_mayus)]
+    meses += [(int(anio), _MESES[nombre]) for nombre, anio in _patron_mes_texto.findall(texto_mayus)]
+    for anio, mes in meses:
+        if 1 <= mes <= 12:
+            limites.append(f"{anio:04d}-{mes:02d}-01")
+            limites.append(f"{anio:04d}-{mes:02d}-{calendar.monthrange(anio, mes)[1]:02d}")
+    if not limites:
+        return None, None
+    return min(limites), max(limites)
+
+
+def etiquetas_consulta(texto: str) -> List[str]:
+    """Claves de una consulta en formato `tipo:valor`, como se guardan en `claves`."""
+    return [f"{tipo}:{clave}" for tipo, claves in claves_consulta(texto).items() for clave in claves]
@@ -0,0 +1,176 @@
+"""
+Procesadores de documentos para la ingesta.
+
+Cada procesador lee un formato de archivo y lo entrega como una secuencia de
+DataFrames (lotes) con un número fijo de filas, que alimentan el mismo
+pipeline de chunking y embeddings de `ExcelVectorizer`:
+- Excel (`.xlsx`, `.xls`): `pd.read_excel`.
+- CSV (`.csv`, `.txt`): `pd.read_csv` por bloques, sin cargar el archivo completo.
+- Parquet (`.parquet`, `.pq`): archivo mapeado en memoria y leído por record batches.
+- Arrow IPC (`.arrow`, `.feather`, `.ipc`): archivo mapeado en memoria; los
+  record batches referencian directamente el mapeo, sin copiar los buffers.
+
+`detectar_procesador` elige el procesador por extensión y, si no la reconoce,
+por los bytes iniciales del archivo.
+"""
+import csv
+import logging
+import os
+from typing import Iterator, List, Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def _importar_pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError as e:
+        raise ImportError("Se requiere 'pyarrow' para leer archivos Parquet o Arrow (pip install pyarrow).") from e
+
+
+class DocumentProcessor:
+    """
+    Lector base. Las subclases implementan `_leer`, que puede entregar lotes de
+    cualquier tamaño; `iterar_lotes` los reagrupa en lotes de `filas_por_lote`.
+    """
+    nombre = "base"
+    extensiones: tuple = ()
+
+    def _leer(self, file_path: str, filas_por_lote: int) -> Iterator[pd.DataFrame]:
+        raise NotImplementedError
+
+    def iterar_lotes(self, file_path: str, filas_por_lote: int) -> Iterator[pd.DataFrame]:
+        """
+        Entrega el archivo en DataFrames de exactamente `filas_por_lote` filas
+        (salvo el último), con índice desde 0 en cada lote.
+        """
+        pendientes: List[pd.DataFrame] = []
+        acumuladas = 0
+        for lote in self._leer(file_path, filas_por_lote):
+            if lote.empty:
+                continue
+            if not pendientes and len(lote) == filas_por_lote:
+                yield lote.reset_index(drop=True)
+                continue
+            pendientes.append(lote)
+            acumuladas += len(lote)
+            while acumuladas >= filas_por_lote:
+                combinado = pd.concat(pendientes, ignore_index=True)
+                yield combinado.iloc[:filas_por_lote].reset_index(drop=True)
+                resto = combinado.iloc[filas_por_lote:]
+                pendientes = [resto] if len(resto) else []
+                acumuladas = len(resto)
+        if pendientes:
+            yield pd.concat(pendientes, ignore_index=True)
+
+
+class ExcelProcessor(DocumentProcessor):
+    nombre = "excel"
+    extensiones = (".xlsx", ".xlsm", ".xls")
+
+    def _leer(self, file_path: str, filas_por_lote: int) -> Iterator[pd.DataFrame]:
+        # openpyxl no permite leer por bloques de forma eficiente: se carga completo
+        df = pd.read_excel(file_path)
+        logger.info(f"Archivo Excel cargado: {len(df)} filas, {len(df.columns)} columnas")
+        for inicio in range(0, len(df), filas_por_lote):
+            yield df.iloc[inicio:inicio + filas_por_lote]
+
+
+class CsvProcessor(DocumentProcessor):
+    nombre = "csv"
+    extensiones = (".csv", ".tsv", ".txt")
+
+    def __init__(self, encoding: Optional[str] = None):
+        self.encoding = encoding
+
+    def _detectar_formato(self, file_path: str):
+        """Detecta codificación (UTF-8 o Latin-1, típico de exportaciones Excel) y separador."""
+        with open(file_path, 'rb') as f:
+            muestra = f.read(64 * 1024)
+        encoding = self.encoding
+        if encoding is None:
+            try:
+                muestra.decode('utf-8-sig')
+                encoding = 'utf-8-sig'
+            except UnicodeDecodeError:
+                encoding = 'latin-1'
+        try:
+            separador = csv.Sniffer().sniff(muestra.decode(encoding, errors='ignore'), delimiters=",;\t|").delimiter
+        except csv.Error:
+            separador = ','
+        return encoding, separador
+
+    def _leer(self, file_path: str, filas_por_lote: int) -> Iterator[pd.DataFrame]:
+        encoding, separador = self._detectar_formato(file_path)
+        logger.info(f"Leyendo CSV por bloques de {filas_por_lote} filas (separador '{separador}', {encoding})")
+        with pd.read_csv(file_path, sep=separador, encoding=encoding, chunksize=filas_por_lote, low_memory=False) as lector:
+            for lote in lector:
+                yield lote
+
+
+class ParquetProcessor(DocumentProcessor):
+    nombre = "parquet"
+    extensiones = (".parquet", ".pq")
+
+    def _leer(self, file_path: str, filas_por_lote: int) -> Iterator[pd.DataFrame]:
+        _importar_pyarrow()
+        import pyarrow.parquet as pq
+
+        archivo = pq.ParquetFile(file_path, memory_map=True)
+        logger.info(f"Archivo Parquet: {archivo.metadata.num_rows} filas en {archivo.num_row_groups} row groups")
+        for batch in archivo.iter_batches(batch_size=filas_por_lote):
+            yield batch.to_pandas()
+
+
+class ArrowIpcProcessor(DocumentProcessor):
+    nombre = "arrow"
+    extensiones = (".arrow", ".feather", ".ipc")
+
+    def _leer(self, file_path: str, filas_por_lote: int) -> Iterator[pd.DataFrame]:
+        pa = _importar_pyarrow()
+        import pyarrow.ipc as ipc
+
+        # Los record batches leídos de un memory map apuntan al archivo mapeado:
+        # no se copian datos hasta la conversión a pandas de cada lote.
+        with pa.memory_map(file_path, 'r') as fuente:
+            try:
+                lector = ipc.open_file(fuente)
+                batches = (lector.get_batch(i) for i in range(lector.num_record_batches))
+            except pa.ArrowInvalid:
+                fuente.seek(0)
+                batches = iter(ipc.open_stream(fuente))
+            for batch in batches:
+                for inicio in range(0, batch.num_rows, filas_por_lote):
+                    # slice() es una vista sobre el mismo buffer, sin copia
+                    yield batch.slice(inicio, filas_por_lote).to_pandas()
+
+
+PROCESADORES = [ExcelProcessor, CsvProcessor, ParquetProcessor, ArrowIpcProcessor]
+
+# Firmas de los primeros bytes de cada formato
+_FIRMAS = [
+    (b"PAR1", ParquetProcessor),
+    (b"ARROW1", ArrowIpcProcessor),
+    (b"\xff\xff\xff\xff", ArrowIpcProcessor),  # Arrow IPC en formato stream
+    (b"PK\x03\x04", ExcelProcessor),  # .xlsx (zip)
+    (b"\xd0\xcf\x11\xe0", ExcelProcessor),  # .xls (OLE2)
+]
+
+
+def detectar_procesador(file_path: str) -> DocumentProcessor:
+    """Devuelve el procesador adecuado según la extensión o el contenido del archivo."""
+    extension = os.path.splitext(file_path)[1].lower()
+    for clase in PROCESADORES:
+        if extension in clase.extensiones:
+            return clase()
+
+    with open(file_path, 'rb') as f:
+        cabecera = f.read(8)
+    for firma, clase in _FIRMAS:
+        if cabecera.startswith(firma):
+            return clase()
+    # Sin firma binaria conocida se asume texto delimitado
+    return CsvProcessor()
@@ -1,12 +1,17 @@
 import os
+import sys
 import pandas as pd
 import tiktoken
 import google.generativeai as genai
-from supabase import create_client, Client
 from dotenv import load_dotenv
-import time
 from typing import List, Dict, Optional
 import logging
+from src.utils.gemini_client import GeminiError, PRIORIDAD_INGESTA, cliente_gemini
+from src.rag_engine.vector_store import VectorStore, crear_vector_store
+from src.data_processing.rollups import AcumuladorRollups
+from src.data_processing.perfiles import AcumuladorPerfiles
+from src.data_processing.data_validators import claves_por_fila, normalizar_dataframe, rangos_fecha_por_bloque
+from src.data_processing.document_processors import detectar_procesador
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,16 +21,16 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 class ExcelVectorizer:
-    def __init__(self, chunk_size: int = 10, tokens_per_chunk: int = 500):
+    def __init__(self, chunk_size: int = 10, tokens_per_chunk: int = 500, insert_batch_size: int = 100):
         # Configuración de clientes
-        self.supabase_url = os.getenv("SUPABASE_URL")
-        self.supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
         self.google_api_key = os.getenv("GOOGLE_API_KEY")
         
-        if not all([self.supabase_url, self.supabase_key, self.google_api_key]):
-            raise ValueError("Las variables de entorno de Supabase y Google deben estar configuradas.")
+        if not self.google_api_key:
+            raise ValueError("La variable de entorno GOOGLE_API_KEY debe estar configurada.")
 
-        self.supabase: Client = create_client(self.supabase_url, self.supabase_key)
+        # Supabase (PostgREST) o Postgres directo con COPY, según VECTOR_STORE_BACKEND
+        self.store: VectorStore = crear_vector_store()
+        self.insert_batch_size = insert_batch_size
         genai.configure(api_key=self.google_api_key)
         
         # Configuración de embedding y chunking
@@ -35,16 +40,6 @@ class ExcelVectorizer:
         # Usaremos tiktoken para estimar, aunque no sea 100% preciso para Gemini, es una buena aproximación.
         self.encoding = tiktoken.encoding_for_model("gpt-4")
 
-    def _read_excel(self, file_path: str) -> Optional[pd.DataFrame]:
-        """Lee el archivo Excel."""
-        try:
-            df = pd.read_excel(file_path)
-            logger.info(f"Archivo Excel cargado: {len(df)} filas, {len(df.columns)} columnas")
-            return df
-        except Exception as e:
-            logger.error(f"Error al leer Excel: {e}")
-            return None
-
     def _format_row_to_text(self, row: pd.Series) -> str:
         """Convierte una fila del DataFrame a texto estructurado."""
         texto_fila = []
@@ -58,12 +53,22 @@ class ExcelVectorizer:
             texto_fila.append(f"{col}: {valor}")
         return " | ".join(texto_fila)
 
-    def _create_chunks(self, df: pd.DataFrame) -> List[Dict]:
-        """Divide el DataFrame en chunks de texto."""
+    def _create_chunks(self, df: pd.DataFrame, offset: int = 0) -> List[Dict]:
+        """
+        Divide el DataFrame en chunks de texto. `offset` es la posición de la
+        primera fila del DataFrame dentro del archivo cuando se procesa por lotes.
+        """
         chunks = []
+        # Claves canónicas (contenedor, RUT, tracto, fecha) de cada fila, para búsqueda exacta
+        keys_df = normalizar_dataframe(df)
+        row_keys = claves_por_fila(keys_df)
+        # Rango de fechas de cada chunk, para buscar solo en la partición consultada
+        date_ranges = rangos_fecha_por_bloque(keys_df, self.chunk_size)
         for i in range(0, len(df), self.chunk_size):
             chunk_df = df.iloc[i:i + self.chunk_size]
             texto_chunk = "\n".join([self._format_row_to_text(row) for _, row in chunk_df.iterrows()])
+            chunk_keys = sorted({clave for claves in row_keys[i:i + self.chunk_size] for clave in claves})
+            fecha_inicio, fecha_fin = date_ranges[i // self.chunk_size]
             
             tokens = self.encoding.encode(texto_chunk)
             if len(tokens) > self.tokens_per_chunk:
@@ -71,14 +76,20 @@ class ExcelVectorizer:
                 for j, sub_chunk_text in enumerate(sub_chunks):
                     chunks.append({
                         'text': sub_chunk_text,
-                        'chunk_id': f"chunk_{i}_{j}",
-                        'metadata': {'filas_inicio': i, 'filas_fin': min(i + self.chunk_size, len(df))}
+                        'chunk_id': f"chunk_{offset + i}_{j}",
+                        'claves': chunk_keys,
+                        'fecha_inicio': fecha_inicio,
+                        'fecha_fin': fecha_fin,
+                        'metadata': {'filas_inicio': offset + i, 'filas_fin': offset + min(i + self.chunk_size, len(df))}
                     })
             else:
                 chunks.append({
                     'text': texto_chunk,
-                    'chunk_id': f"chunk_{i}",
-                    'metadata': {'filas_inicio': i, 'filas_fin': min(i + self.chunk_size, len(df))}
+                    'chunk_id': f"chunk_{offset + i}",
+                    'claves': chunk_keys,
+                    'fecha_inicio': fecha_inicio,
+                    'fecha_fin': fecha_fin,
+                    'metadata': {'filas_inicio': offset + i, 'filas_fin': offset + min(i + self.chunk_size, len(df))}
                 })
         return chunks
 
@@ -94,73 +105,128 @@ class ExcelVectorizer:
     def _create_embedding(self, text: str) -> Optional[List[float]]:
         """Crea embedding para un texto usando Google Gemini."""
         try:
-            # Especificar el tipo de tarea es crucial para la precisión de la búsqueda
-            result = genai.embed_content(
-                model=self.embed_model,
-                content=text,
-                task_type="RETRIEVAL_DOCUMENT"
+            # Especificar el tipo de tarea es crucial para la precisión de la búsqueda.
+            # La ingesta usa prioridad baja para no competir con el tráfico de la API.
+            return cliente_gemini.embed_content(
+                self.embed_model,
+                text,
+                task_type="RETRIEVAL_DOCUMENT",
+                prioridad=PRIORIDAD_INGESTA
             )
-            return result['embedding']
-        except Exception as e:
+        except GeminiError as e:
             logger.error(f"Error al crear embedding con Google: {e}")
             return None
 
-    def _insert_into_supabase(self, chunk_data: Dict, embedding: List[float], file_name: str):
-        """Inserta el chunk y su embedding en Supabase."""
+    def _build_row(self, chunk_data: Dict, embedding: List[float], file_name: str) -> Dict:
+        """Arma la fila a insertar para un chunk y su embedding."""
+        return {
+            "fuente": file_name,
+            "chunk_id": chunk_data['chunk_id'],
+            "fragmento": chunk_data['text'],
+            "claves": chunk_data.get('claves', []),
+            "fecha_inicio": chunk_data.get('fecha_inicio'),
+            "fecha_fin": chunk_data.get('fecha_fin'),
+            "embedding": embedding,
+            "metadata": {**chunk_data['metadata'], "tipo_datos": "operacional"}
+        }
+
+    def _insert_batch(self, rows: List[Dict]) -> int:
+        """Inserta un lote de chunks en una sola operación. Devuelve cuántos se insertaron."""
         try:
-            data_to_insert = {
-                "fuente": file_name,
-                "chunk_id": chunk_data['chunk_id'],
-                "fragmento": chunk_data['text'],
-                "embedding": embedding,
-                "metadata": {**chunk_data['metadata'], "tipo_datos": "operacional"}
-            }
-            self.supabase.table("documentos_embeddings").insert(data_to_insert).execute()
-            return True
+            return self.store.insertar_fragmentos(rows)
         except Exception as e:
-            logger.error(f"Error al insertar en Supabase: {e}")
-            return False
-
-    def process_file(self, file_path: str):
-        """Procesa un archivo Excel completo y genera embeddings."""
-        df = self._read_excel(file_path)
-        if df is None:
-            logger.error("No se pudo cargar el archivo Excel, deteniendo proceso.")
+            logger.error(f"Error al insertar lote de {len(rows)} chunks: {e}")
+            return 0
+
+    def _store_rollups(self, acumulador: AcumuladorRollups, file_name: str):
+        """Guarda los rollups por entidad del archivo (reemplaza los anteriores)."""
+        rows = acumulador.filas(file_name)
+        try:
+            self.store.reemplazar_rollups(file_name, rows)
+            logger.info(f"Rollups por entidad actualizados: {len(rows)} filas.")
+        except Exception as e:
+            logger.error(f"Error al guardar rollups: {e}")
+
+    def _store_profiles(self, acumulador: AcumuladorPerfiles, file_name: str):
+        """Guarda los perfiles por entidad del archivo (reemplaza los anteriores)."""
+        rows = acumulador.filas(file_name)
+        try:
+            self.store.reemplazar_perfiles(file_name, rows)
+            logger.info(f"Perfiles por entidad actualizados: {len(rows)} filas.")
+        except Exception as e:
+            logger.error(f"Error al guardar perfiles: {e}")
+
+    def process_file(self, file_path: str, rows_per_batch: int = 1000):
+        """
+        Procesa un archivo completo (Excel, CSV, Parquet o Arrow) y genera embeddings.
+        El archivo se lee por lotes de `rows_per_batch` filas con el procesador
+        que corresponda a su formato (ver `document_processors`).
+        """
+        try:
+            processor = detectar_procesador(file_path)
+        except OSError as e:
+            logger.error(f"No se pudo abrir el archivo, deteniendo proceso: {e}")
             return
 
-        logger.info(f"Creando chunks de {self.chunk_size} filas cada uno...")
-        chunks = self._create_chunks(df)
-        logger.info(f"Se crearon {len(chunks)} chunks para procesar.")
+        # Lotes múltiplos del tamaño de chunk, para que ningún chunk cruce dos lotes
+        rows_per_batch = max(self.chunk_size, rows_per_batch // self.chunk_size * self.chunk_size)
+        logger.info(f"Procesando '{file_path}' con el procesador '{processor.nombre}' en lotes de {rows_per_batch} filas (chunks de {self.chunk_size} filas)...")
 
         file_name = os.path.basename(file_path)
-        successful_inserts, failed_inserts = 0, 0
-
-        for i, chunk in enumerate(chunks):
-            if i > 0 and i % 10 == 0:
-                logger.info(f"Pausa para evitar rate limiting... ({i}/{len(chunks)})")
-                time.sleep(2)
-
-            embedding = self._create_embedding(chunk['text'])
-            if not embedding:
-                logger.warning(f"No se pudo crear embedding para chunk {chunk['chunk_id']}")
-                failed_inserts += 1
-                continue
-
-            if self._insert_into_supabase(chunk, embedding, file_name):
-                successful_inserts += 1
-                logger.info(f"[{i+1}/{len(chunks)}] Chunk {chunk['chunk_id']} procesado exitosamente.")
-            else:
-                failed_inserts += 1
-                logger.warning(f"Error al insertar chunk {chunk['chunk_id']}")
+        rollups = AcumuladorRollups()
+        profiles = AcumuladorPerfiles()
+        total_chunks, successful_inserts, failed_inserts = 0, 0, 0
+        pending_rows: List[Dict] = []
+
+        def flush():
+            nonlocal successful_inserts, failed_inserts
+            inserted = self._insert_batch(pending_rows)
+            successful_inserts += inserted
+            failed_inserts += len(pending_rows) - inserted
+            pending_rows.clear()
+
+        offset = 0
+        try:
+            for df in processor.iterar_lotes(file_path, rows_per_batch):
+                rollups.agregar(df)
+                profiles.agregar(df)
+                chunks = self._create_chunks(df, offset)
+                total_chunks += len(chunks)
+
+                # El ritmo de llamadas a Gemini lo regula `cliente_gemini` (límite adaptativo y backoff)
+                for chunk in chunks:
+                    embedding = self._create_embedding(chunk['text'])
+                    if not embedding:
+                        logger.warning(f"No se pudo crear embedding para chunk {chunk['chunk_id']}")
+                        failed_inserts += 1
+                        continue
+
+                    pending_rows.append(self._build_row(chunk, embedding, file_name))
+                    if len(pending_rows) >= self.insert_batch_size:
+                        flush()
+
+                offset += len(df)
+                logger.info(f"{offset} filas leídas, {successful_inserts} chunks insertados hasta ahora.")
+        except Exception as e:
+            logger.error(f"Error al leer el archivo, deteniendo proceso: {e}")
+            return
+        finally:
+            if pending_rows:
+                flush()
+
+        # Los rollups y perfiles solo se reemplazan si el archivo se leyó completo
+        self._store_rollups(rollups, file_name)
+        self._store_profiles(profiles, file_name)
 
-        logger.info(f"\nProcesamiento completado:\n- Total chunks: {len(chunks)}\n- Exitosos: {successful_inserts}\n- Fallidos: {failed_inserts}")
+        logger.info(f"\nProcesamiento completado:\n- Filas: {offset}\n- Total chunks: {total_chunks}\n- Exitosos: {successful_inserts}\n- Fallidos: {failed_inserts}")
 
 
 def main():
     """Función principal para ejecutar el proceso de vectorización."""
-    logger.info("Iniciando proceso de ingesta de datos de Excel...")
+    logger.info("Iniciando proceso de ingesta de datos...")
     
-    file_to_process = "data/BD_Contenedores_Completo_2025.xlsx"
+    # Se puede indicar otro archivo (CSV, Parquet, Arrow) como argumento
+    file_to_process = sys.argv[1] if len(sys.argv) > 1 else "data/BD_Contenedores_Completo_2025.xlsx"
     if not os.path.exists(file_to_process):
         logger.error(f"Archivo no encontrado: {file_to_process}")
         return
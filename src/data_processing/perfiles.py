@@ -0,0 +1,304 @@
+"""
+Perfiles materializados por entidad (tracto, conductor, contenedor, cliente).
+
+Durante la ingesta se calcula, para cada entidad, el número de viajes, kilos,
+primera/última fecha y las entidades asociadas distintas (p. ej. los
+conductores de un tracto) con su número de viajes y la última vez que se
+vieron juntas. Una pregunta de un salto como "¿quién es el conductor del
+T209?" se responde entonces con un único documento pequeño en lugar de
+reconciliar varios fragmentos de 10 filas.
+
+El perfil solo basta para preguntas por entidades asociadas, conteos o la
+última vez que se vio la entidad (`responde_perfil`); para el resto (RUT,
+destino, estado, HR...) se agrega a los fragmentos en lugar de reemplazarlos.
+
+Igual que los rollups, los perfiles se guardan por fuente: al ingerir un
+archivo solo se reemplazan los suyos, y al consultar se combinan las filas de
+todas las fuentes.
+"""
+import re
+import unicodedata
+from typing import Dict, FrozenSet, Iterable, List
+
+import pandas as pd
+
+from src.data_processing.data_validators import (
+    buscar_columna,
+    canonizar_contenedores,
+    claves_consulta,
+    parsear_fechas,
+    rango_fechas_consulta,
+)
+from src.data_processing.rollups import COLUMNAS_FECHA, COLUMNAS_KILOS, claves_entidad
+
+# Tipos de entidad con perfil y nombres de columna (normalizados) que pueden contenerlos
+TIPOS_PERFIL = {
+    'tracto': ['tracto'],
+    'conductor': ['conductor', 'nombre_conductor'],
+    'contenedor': ['contenedor', 'numero_contenedor'],
+    'cliente': ['cliente'],
+}
+
+NOMBRES_PLURAL = {
+    'tracto': 'Tractos',
+    'conductor': 'Conductores',
+    'contenedor': 'Contenedores',
+    'cliente': 'Clientes',
+}
+
+# Entidades asociadas que se guardan por tipo (las más recientes) y que se muestran
+MAX_RELACIONADOS = 20
+MAX_RELACIONADOS_DOCUMENTO = 10
+
+# Longitud máxima (en palabras) de un nombre de cliente o conductor en una consulta
+MAX_PALABRAS_NOMBRE = 4
+
+# Lo que una pregunta puede pedir y un perfil guarda (sobre el texto sin tildes y en mayúsculas)
+_PATRONES_RELACION = {
+    'tracto': re.compile(r'\b(TRACTOS?|CAMION(ES)?)\b'),
+    'conductor': re.compile(r'\b(CONDUCTOR(ES)?|CHOFER(ES)?|QUIEN(ES)?|CONDUC\w*)\b'),
+    'contenedor': re.compile(r'\bCONTENEDOR(ES)?\b'),
+    'cliente': re.compile(r'\bCLIENTES?\b'),
+}
+_PATRON_CONTEO = re.compile(r'\b(CUANT[OA]S?|CANTIDAD|NUMERO DE|TOTAL)\b')
+_PATRON_ULTIMA_VEZ = re.compile(r'\b(ULTIM[OA]S?|CUANDO|PRIMER[OA]?|RECIENTES?)\b')
+# Campos de las filas que el perfil no guarda
+_PATRON_OTROS_CAMPOS = re.compile(
+    r'\b(RUT|DESTINOS?|ORIGEN(ES)?|ESTADOS?|HR|GUIAS?|TRAILER|MODALIDAD|FAENA|ETA|SELLOS?|PATENTES?|TIPO|AREA)\b'
+)
+
+
+def claves_perfil(serie: pd.Series, tipo: str) -> pd.Series:
+    """Claves de búsqueda de una columna; los contenedores van en forma ISO 6346."""
+    claves = claves_entidad(serie, tipo)
+    if tipo == 'contenedor':
+        claves = canonizar_contenedores(claves).fillna(claves).astype(str)
+    return claves
+
+
+def claves_perfil_consulta(texto: str) -> List[str]:
+    """
+    Claves candidatas de perfil en una consulta: tractos y contenedores
+    canónicos, y grupos de 1 a `MAX_PALABRAS_NOMBRE` palabras consecutivas
+    para nombres de clientes y conductores.
+    """
+    encontrados = claves_consulta(texto)
+    candidatas = encontrados.get('tracto', []) + encontrados.get('contenedor', [])
+    palabras = re.findall(r"[A-ZÁÉÍÓÚÑÜ0-9&.'-]+", texto.upper())
+    for n in range(1, MAX_PALABRAS_NOMBRE + 1):
+        for i in range(len(palabras) - n + 1):
+            grupo = " ".join(palabras[i:i + n])
+            if n > 1 or len(grupo) >= 3:
+                candidatas.append(grupo)
+    return list(dict.fromkeys(candidatas))
+
+
+def aspectos_perfil(texto: str) -> FrozenSet[str]:
+    """
+    Lo que pide una pregunta en términos de un perfil: `relacion:<tipo>`
+    (entidades asociadas), `conteo`, `ultima_vez`, `otros_campos` si pide un
+    dato de las filas que el perfil no guarda y `rango_fechas` si se acota a
+    fechas (el perfil acumula todo el historial).
+    """
+    texto = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode().upper()
+    aspectos = {f'relacion:{tipo}' for tipo, patron in _PATRONES_RELACION.items() if patron.search(texto)}
+    if _PATRON_CONTEO.search(texto):
+        aspectos.add('conteo')
+    if _PATRON_ULTIMA_VEZ.search(texto):
+        aspectos.add('ultima_vez')
+    if _PATRON_OTROS_CAMPOS.search(texto):
+        aspectos.add('otros_campos')
+    if texto and rango_fechas_consulta(texto)[0]:
+        aspectos.add('rango_fechas')
+    return frozenset(aspectos)
+
+
+def responde_perfil(aspectos: FrozenSet[str], tipos: Iterable[str]) -> bool:
+    """
+    True si los perfiles encontrados (de `tipos`) bastan para responder: la
+    pregunta pide entidades de otro tipo, un conteo o la última vez, sin rango
+    de fechas y sin campos que el perfil no guarda.
+    """
+    if 'otros_campos' in aspectos or 'rango_fechas' in aspectos:
+        return False
+    relaciones = {a.split(':', 1)[1] for a in aspectos if a.startswith('relacion:')} - set(tipos)
+    return bool(relaciones) or 'conteo' in aspectos or 'ultima_vez' in aspectos
+
+
+class AcumuladorPerfiles:
+    """
+    Acumula perfiles a partir de uno o varios DataFrames (lotes de un mismo
+    archivo) y los combina al final en filas para `perfiles_entidad`.
+    """
+    def __init__(self):
+        self._entidades: List[pd.DataFrame] = []
+        self._relaciones: List[pd.DataFrame] = []
+        self._con_kilos = False
+
+    def agregar(self, df: pd.DataFrame) -> None:
+        columnas = {
+            tipo: columna for tipo, candidatos in TIPOS_PERFIL.items()
+            if (columna := buscar_columna(df, candidatos)) is not None
+        }
+        if df.empty or not columnas:
+            return
+        columna_fecha = buscar_columna(df, COLUMNAS_FECHA)
+        columna_kilos = buscar_columna(df, COLUMNAS_KILOS)
+
+        base = pd.DataFrame(index=df.index)
+        base['fecha'] = parsear_fechas(df[columna_fecha]) if columna_fecha is not None else pd.NaT
+        if columna_kilos is not None:
+            self._con_kilos = True
+            base['kilos'] = pd.to_numeric(df[columna_kilos], errors='coerce')
+        else:
+            base['kilos'] = float('nan')
+        for tipo, columna in columnas.items():
+            base[f'clave_{tipo}'] = claves_perfil(df[columna], tipo)
+            base[f'valor_{tipo}'] = df[columna].astype(str).str.strip()
+
+        for tipo in columnas:
+            clave = f'clave_{tipo}'
+            filas = base[base[clave] != '']
+            if filas.empty:
+                continue
+            self._entidades.append(
+                filas.groupby(clave).agg(
+                    valor=(f'valor_{tipo}', 'first'),
+                    viajes=('fecha', 'size'),
+                    kilos=('kilos', 'sum'),
+                    primera_fecha=('fecha', 'min'),
+                    ultima_fecha=('fecha', 'max'),
+                ).rename_axis('clave').reset_index().assign(tipo=tipo)
+            )
+            for otro in columnas:
+                if otro == tipo:
+                    continue
+                pares = filas[filas[f'clave_{otro}'] != '']
+                if pares.empty:
+                    continue
+                self._relaciones.append(
+                    pares.groupby([clave, f'clave_{otro}']).agg(
+                        valor=(f'valor_{otro}', 'first'),
+                        viajes=('fecha', 'size'),
+                        ultima_fecha=('fecha', 'max'),
+                    ).rename_axis(['clave', 'clave_relacionada']).reset_index()
+                    .assign(tipo=tipo, tipo_relacionado=otro)
+                )
+
+    def filas(self, fuente: str) -> List[Dict]:
+        """Combina los parciales y devuelve las filas a guardar para `fuente`."""
+        if not self._entidades:
+            return []
+        entidades = pd.concat(self._entidades).groupby(['tipo', 'clave']).agg(
+            valor=('valor', 'first'),
+            viajes=('viajes', 'sum'),
+            kilos=('kilos', 'sum'),
+            primera_fecha=('primera_fecha', 'min'),
+            ultima_fecha=('ultima_fecha', 'max'),
+        ).reset_index()
+
+        def _fecha(valor):
+            return None if pd.isna(valor) else valor.strftime('%Y-%m-%d')
+
+        relaciones: Dict[tuple, Dict] = {}
+        if self._relaciones:
+            pares = pd.concat(self._relaciones).groupby(['tipo', 'clave', 'tipo_relacionado', 'clave_relacionada']).agg(
+                valor=('valor', 'first'),
+                viajes=('viajes', 'sum'),
+                ultima_fecha=('ultima_fecha', 'max'),
+            ).reset_index()
+            grupo = ['tipo', 'clave', 'tipo_relacionado']
+            distintos = pares.groupby(grupo).size()
+            # Se guardan las asociaciones más recientes (y, a igual fecha, las más frecuentes)
+            principales = (
+                pares.sort_values(['ultima_fecha', 'viajes'], ascending=False, na_position='last')
+                .groupby(grupo).head(MAX_RELACIONADOS)
+            )
+            for fila in principales.itertuples(index=False):
+                perfil = relaciones.setdefault((fila.tipo, fila.clave), {})
+                relacion = perfil.setdefault(fila.tipo_relacionado, {
+                    'distintos': int(distintos[(fila.tipo, fila.clave, fila.tipo_relacionado)]),
+                    'principales': [],
+                })
+                relacion['principales'].append({
+                    'clave': fila.clave_relacionada,
+                    'valor': fila.valor,
+                    'viajes': int(fila.viajes),
+                    'ultima_fecha': _fecha(fila.ultima_fecha),
+                })
+
+        return [
+            {
+                'fuente': fuente,
+                'tipo': fila.tipo,
+                'clave': fila.clave,
+                'valor': fila.valor,
+                'viajes': int(fila.viajes),
+                'kilos': float(fila.kilos) if self._con_kilos else None,
+                'primera_fecha': _fecha(fila.primera_fecha),
+                'ultima_fecha': _fecha(fila.ultima_fecha),
+                'relaciones': relaciones.get((fila.tipo, fila.clave), {}),
+            }
+            for fila in entidades.itertuples(index=False)
+        ]
+
+
+def _texto_fecha(valor) -> str:
+    return str(valor)[:10] if valor else "sin fecha"
+
+
+def documentos_perfil(filas: List[Dict]) -> List[Dict]:
+    """
+    Combina las filas de `perfiles_entidad` de todas las fuentes y devuelve un
+    documento de texto por entidad: `{'tipo', 'clave', 'fuentes', 'texto'}`.
+    """
+    perfiles: Dict[tuple, Dict] = {}
+    for fila in filas:
+        perfil = perfiles.setdefault((fila['tipo'], fila['clave']), {
+            'valor': fila['valor'], 'viajes': 0, 'kilos': None, 'fechas': [],
+            'fuentes': [], 'relaciones': {},
+        })
+        perfil['viajes'] += fila['viajes']
+        if fila.get('kilos') is not None:
+            perfil['kilos'] = (perfil['kilos'] or 0) + float(fila['kilos'])
+        perfil['fechas'] += [str(f)[:10] for f in (fila.get('primera_fecha'), fila.get('ultima_fecha')) if f]
+        perfil['fuentes'].append(fila['fuente'])
+        for tipo, relacion in (fila.get('relaciones') or {}).items():
+            combinada = perfil['relaciones'].setdefault(tipo, {'distintos': 0, 'principales': {}})
+            combinada['distintos'] = max(combinada['distintos'], relacion['distintos'])
+            for asociada in relacion['principales']:
+                previa = combinada['principales'].get(asociada['clave'])
+                if previa is None:
+                    combinada['principales'][asociada['clave']] = dict(asociada)
+                else:
+                    previa['viajes'] += asociada['viajes']
+                    previa['ultima_fecha'] = max(filter(None, [previa['ultima_fecha'], asociada['ultima_fecha']]), default=None)
+
+    documentos = []
+    for (tipo, clave), perfil in perfiles.items():
+        lineas = [f"Perfil de {tipo} {perfil['valor']}: {perfil['viajes']} viajes"]
+        if perfil['kilos'] is not None:
+            lineas[0] += f", {perfil['kilos']:.0f} kilos"
+        if perfil['fechas']:
+            lineas[0] += f", entre {min(perfil['fechas'])} y {max(perfil['fechas'])}"
+        lineas[0] += "."
+        for tipo_relacionado, relacion in perfil['relaciones'].items():
+            asociadas = sorted(
+                relacion['principales'].values(),
+                key=lambda a: (a['ultima_fecha'] or '', a['viajes']),
+                reverse=True,
+            )
+            distintos = max(relacion['distintos'], len(asociadas))
+            mostradas = asociadas[:MAX_RELACIONADOS_DOCUMENTO]
+            encabezado = f"- {NOMBRES_PLURAL[tipo_relacionado]} ({distintos} distintos"
+            encabezado += f", {len(mostradas)} más recientes): " if distintos > len(mostradas) else "): "
+            lineas.append(encabezado + "; ".join(
+                f"{a['valor']} ({a['viajes']} viajes, último {_texto_fecha(a['ultima_fecha'])})" for a in mostradas
+            ))
+        documentos.append({
+            'tipo': tipo,
+            'clave': clave,
+            'fuentes': perfil['fuentes'],
+            'texto': "\n".join(lineas),
+        })
+    return documentos
@@ -0,0 +1,158 @@
+"""
+Cálculo de rollups (agregados precalculados) por entidad durante la ingesta.
+
+Para cada tracto, cliente, conductor, estado y día se guarda el número de
+viajes, el total de kilos, cuántas filas tenían kilos válidos (el divisor del
+promedio) y la primera/última fecha. Así `consultar_bd` puede
+responder COUNT/SUM/AVG con una búsqueda por clave en `rollups_entidad` en
+lugar de recorrer todos los fragmentos con `ilike`.
+"""
+import re
+from typing import Dict, List
+
+import pandas as pd
+
+from src.data_processing.data_validators import (
+    COLUMNAS_FECHA,
+    buscar_columna,
+    canonizar_contenedores,
+    canonizar_ruts_consulta,
+    canonizar_tractos,
+    parsear_fechas,
+)
+
+# Dimensiones agregadas y nombres de columna (normalizados) que pueden contenerlas
+DIMENSIONES_ROLLUP = {
+    'tracto': ['tracto'],
+    'cliente': ['cliente'],
+    'conductor': ['conductor', 'nombre_conductor'],
+    'estado': ['estado'],
+}
+COLUMNAS_KILOS = ['kilos', 'peso', 'peso_kg', 'kg']
+
+# Dimensión por día, derivada de la columna de fecha
+DIMENSION_DIA = 'dia'
+
+def resolver_columnas(df: pd.DataFrame) -> Dict[str, str]:
+    """Devuelve {dimensión: columna del DataFrame} para las dimensiones presentes."""
+    columnas = {}
+    for dimension, candidatos in DIMENSIONES_ROLLUP.items():
+        columna = buscar_columna(df, candidatos)
+        if columna is not None:
+            columnas[dimension] = columna
+    return columnas
+
+
+def claves_entidad(serie: pd.Series, dimension: str) -> pd.Series:
+    """Normaliza (vectorizado) los valores de una columna a claves de búsqueda."""
+    claves = (
+        serie.fillna('').astype(str).str.upper().str.strip()
+        .str.replace(r'\s+', ' ', regex=True)
+    )
+    if dimension == 'tracto':
+        # 'T209 (ABCD12)' -> 'T209', con el mismo canonizador que las consultas
+        claves = canonizar_tractos(claves).fillna(claves).astype(str)
+    return claves
+
+
+def clave_entidad(valor: str) -> List[str]:
+    """
+    Claves candidatas para un valor escrito en una consulta. La dimensión es
+    desconocida, así que se devuelven todas las formas posibles.
+    """
+    clave = re.sub(r'\s+', ' ', str(valor).upper().strip())
+    candidatas = [clave]
+    serie = pd.Series([clave], dtype='string')
+    for canonizador in (canonizar_tractos, canonizar_contenedores, canonizar_ruts_consulta):
+        canonica = canonizador(serie).iloc[0]
+        if not pd.isna(canonica) and canonica not in candidatas:
+            candidatas.append(canonica)
+    return candidatas
+
+
+class AcumuladorRollups:
+    """
+    Acumula rollups a partir de uno o varios DataFrames (p. ej. lotes de un
+    mismo archivo) y los combina al final en filas para `rollups_entidad`.
+    """
+    def __init__(self):
+        self._parciales: List[pd.DataFrame] = []
+        self._con_kilos = False
+
+    def agregar(self, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        columna_fecha = buscar_columna(df, COLUMNAS_FECHA)
+        columna_kilos = buscar_columna(df, COLUMNAS_KILOS)
+
+        if columna_fecha is not None:
+            fechas = parsear_fechas(df[columna_fecha])
+        else:
+            fechas = pd.Series(pd.NaT, index=df.index)
+        if columna_kilos is not None:
+            self._con_kilos = True
+            kilos = pd.to_numeric(df[columna_kilos], errors='coerce')
+        else:
+            kilos = pd.Series(float('nan'), index=df.index)
+
+        dimensiones = {
+            dimension: (claves_entidad(df[columna], dimension), df[columna].astype(str).str.strip())
+            for dimension, columna in resolver_columnas(df).items()
+        }
+        if columna_fecha is not None:
+            dias = fechas.dt.strftime('%Y-%m-%d').fillna('')
+            dimensiones[DIMENSION_DIA] = (dias, dias)
+
+        for dimension, (claves, valores) in dimensiones.items():
+            base = pd.DataFrame({
+                'dimension': dimension,
+                'clave': claves,
+                'valor': valores,
+                'kilos': kilos,
+                'fecha': fechas,
+            })
+            base = base[base['clave'] != '']
+            if base.empty:
+                continue
+            self._parciales.append(
+                base.groupby(['dimension', 'clave']).agg(
+                    valor=('valor', 'first'),
+                    viajes=('clave', 'size'),
+                    kilos=('kilos', 'sum'),
+                    filas_con_kilos=('kilos', 'count'),
+                    primera_fecha=('fecha', 'min'),
+                    ultima_fecha=('fecha', 'max'),
+                )
+            )
+
+    def filas(self, fuente: str) -> List[Dict]:
+        """Combina los parciales y devuelve las filas a guardar para `fuente`."""
+        if not self._parciales:
+            return []
+        total = pd.concat(self._parciales).groupby(level=['dimension', 'clave']).agg(
+            valor=('valor', 'first'),
+            viajes=('viajes', 'sum'),
+            kilos=('kilos', 'sum'),
+            filas_con_kilos=('filas_con_kilos', 'sum'),
+            primera_fecha=('primera_fecha', 'min'),
+            ultima_fecha=('ultima_fecha', 'max'),
+        ).reset_index()
+
+        def _fecha(valor):
+            return None if pd.isna(valor) else valor.strftime('%Y-%m-%d')
+
+        return [
+            {
+                'fuente': fuente,
+                'dimension': fila.dimension,
+                'clave': fila.clave,
+                'valor': fila.valor,
+                'viajes': int(fila.viajes),
+                # Sin ninguna fila con kilos válidos el total es NULL, no 0
+                'kilos': float(fila.kilos) if self._con_kilos and fila.filas_con_kilos else None,
+                'filas_con_kilos': int(fila.filas_con_kilos) if self._con_kilos else None,
+                'primera_fecha': _fecha(fila.primera_fecha),
+                'ultima_fecha': _fecha(fila.ultima_fecha),
+            }
+            for fila in total.itertuples(index=False)
+        ]
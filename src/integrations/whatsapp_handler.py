@@ -0,0 +1,356 @@
+"""
+Manejador nativo del webhook de WhatsApp Cloud API.
+
+El webhook responde de inmediato a Meta y deja el trabajo en una cola asyncio
+acotada, consumida por un pool de workers que consultan al agente RAG y envían
+la respuesta. Los mensajes que un mismo remitente envía en ráfaga (p. ej. una
+pregunta seguida de una corrección rápida) se agrupan en una sola consulta.
+Cuando la cola está llena, el webhook responde 503 para que Meta reintente
+la entrega más tarde.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+
+from src.utils import config
+
+logger = logging.getLogger(__name__)
+
+# Firma de la función que procesa una consulta: (remitente, texto) -> respuesta
+Procesador = Callable[[str, str], Awaitable[str]]
+
+MENSAJE_ERROR = "Lo siento, no pude procesar tu consulta en este momento. Por favor, inténtalo de nuevo."
+
+
+class WhatsAppSender:
+    """
+    Interfaz mínima para enviar mensajes de texto a un usuario de WhatsApp.
+    """
+    async def enviar(self, destinatario: str, texto: str) -> None:
+        raise NotImplementedError
+
+    async def cerrar(self) -> None:
+        """Libera los recursos del sender, si los tiene."""
+        return None
+
+
+class CloudApiSender(WhatsAppSender):
+    """
+    Envía mensajes a través de la Graph API de WhatsApp Cloud.
+    """
+    def __init__(self, token: str, phone_number_id: str, api_version: str = "v18.0"):
+        self.url = f"https://graph.facebook.com/{api_version}/{phone_number_id}/messages"
+        self.client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=10.0,
+        )
+
+    async def enviar(self, destinatario: str, texto: str) -> None:
+        payload = {
+            "messaging_product": "whatsapp",
+            "to": destinatario,
+            "type": "text",
+            "text": {"body": texto},
+        }
+        response = await self.client.post(self.url, json=payload)
+        response.raise_for_status()
+
+    async def cerrar(self) -> None:
+        await self.client.aclose()
+
+
+class RegistroSender(WhatsAppSender):
+    """
+    Sender local que no contacta a Meta: guarda los mensajes en memoria y los
+    registra en el log. Se usa en desarrollo y en pruebas cuando no hay
+    credenciales de WhatsApp configuradas.
+    """
+    def __init__(self):
+        self.enviados: List[Dict[str, str]] = []
+
+    async def enviar(self, destinatario: str, texto: str) -> None:
+        self.enviados.append({"destinatario": destinatario, "texto": texto})
+        logger.info(f"[WHATSAPP-LOCAL] -> {destinatario}: {texto}")
+
+
+class _Rafaga:
+    """Mensajes de un remitente que esperan a ser agrupados en una consulta."""
+    def __init__(self):
+        self.textos: List[str] = []
+        self.inicio = time.monotonic()
+        self.timer: Optional[asyncio.Task] = None
+
+
+class ColaWhatsApp:
+    """
+    Cola acotada de consultas de WhatsApp con agrupación por remitente.
+
+    Cada mensaje entrante abre (o extiende) una ráfaga para su remitente. La
+    ráfaga se encola cuando el remitente deja de escribir durante
+    `ventana_debounce` segundos, o cuando alcanza `espera_maxima`. Las ráfagas
+    abiertas reservan un cupo en la cola, de modo que `recibir` rechaza
+    mensajes nuevos en cuanto la capacidad total está comprometida.
+    """
+    def __init__(
+        self,
+        procesar: Procesador,
+        sender: WhatsAppSender,
+        max_cola: int = 100,
+        num_workers: int = 4,
+        ventana_debounce: float = 2.0,
+        espera_maxima: float = 8.0,
+    ):
+        self.procesar = procesar
+        self.sender = sender
+        self.max_cola = max_cola
+        self.num_workers = num_workers
+        self.ventana_debounce = ventana_debounce
+        self.espera_maxima = espera_maxima
+
+        self._cola: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._rafagas: Dict[str, _Rafaga] = {}
+        # Serializa las consultas de un mismo remitente para responder en orden.
+        # Cada entrada guarda el lock y cuántos workers lo están usando.
+        self._locks: Dict[str, list] = {}
+        self.estadisticas = {
+            "recibidos": 0,
+            "agrupados": 0,
+            "rechazados": 0,
+            "procesados": 0,
+            "errores": 0,
+        }
+
+    @property
+    def en_cola(self) -> int:
+        return self._cola.qsize() if self._cola else 0
+
+    def iniciar(self) -> None:
+        """Crea la cola y lanza el pool de workers en el event loop actual."""
+        if self._workers:
+            return
+        self._cola = asyncio.Queue(maxsize=self.max_cola)
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.num_workers)
+        ]
+        logger.info(f"Cola de WhatsApp iniciada con {self.num_workers} workers (máx. {self.max_cola}).")
+
+    async def detener(self) -> None:
+        """Encola las ráfagas pendientes, espera a que se procesen y detiene los workers."""
+        if not self._workers:
+            return
+        for remitente in list(self._rafagas):
+            self._vaciar(remitente)
+        await self._cola.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self.sender.cerrar()
+
+    def recibir(self, remitente: str, texto: str) -> bool:
+        """
+        Registra un mensaje entrante. Devuelve False si la cola está llena y el
+        mensaje debe ser reintentado más tarde.
+        """
+        if self._cola is None:
+            raise RuntimeError("La cola de WhatsApp no ha sido iniciada.")
+
+        rafaga = self._rafagas.get(remitente)
+        if rafaga is not None:
+            # El remitente sigue escribiendo: se agrupa con la ráfaga abierta
+            rafaga.textos.append(texto)
+            self.estadisticas["recibidos"] += 1
+            self.estadisticas["agrupados"] += 1
+            if time.monotonic() - rafaga.inicio >= self.espera_maxima:
+                self._vaciar(remitente)
+            else:
+                self._programar(remitente, rafaga)
+            return True
+
+        if self._cola.qsize() + len(self._rafagas) >= self.max_cola:
+            self.estadisticas["rechazados"] += 1
+            return False
+
+        rafaga = _Rafaga()
+        rafaga.textos.append(texto)
+        self._rafagas[remitente] = rafaga
+        self.estadisticas["recibidos"] += 1
+        self._programar(remitente, rafaga)
+        return True
+
+    def _programar(self, remitente: str, rafaga: _Rafaga) -> None:
+        """(Re)inicia el temporizador de debounce de una ráfaga."""
+        if rafaga.timer is not None:
+            rafaga.timer.cancel()
+        restante = self.espera_maxima - (time.monotonic() - rafaga.inicio)
+        espera = max(0.0, min(self.ventana_debounce, restante))
+        rafaga.timer = asyncio.create_task(self._vaciar_tras(remitente, espera))
+
+    async def _vaciar_tras(self, remitente: str, espera: float) -> None:
+        await asyncio.sleep(espera)
+        self._vaciar(remitente)
+
+    def _vaciar(self, remitente: str) -> None:
+        """Cierra la ráfaga de un remitente y la pasa a la cola como una sola consulta."""
+        rafaga = self._rafagas.pop(remitente, None)
+        if rafaga is None:
+            return
+        if rafaga.timer is not None and rafaga.timer is not asyncio.current_task():
+            rafaga.timer.cancel()
+        consulta = "\n".join(t.strip() for t in rafaga.textos if t.strip())
+        # El cupo ya estaba reservado por la ráfaga, así que no puede fallar
+        self._cola.put_nowait((remitente, consulta))
+
+    async def _worker(self, indice: int) -> None:
+        while True:
+            remitente, consulta = await self._cola.get()
+            entrada = self._locks.setdefault(remitente, [asyncio.Lock(), 0])
+            entrada[1] += 1
+            try:
+                async with entrada[0]:
+                    await self._atender(remitente, consulta)
+            finally:
+                entrada[1] -= 1
+                if entrada[1] == 0:
+                    del self._locks[remitente]
+                self._cola.task_done()
+
+    async def _atender(self, remitente: str, consulta: str) -> None:
+        try:
+            respuesta = await self.procesar(remitente, consulta)
+            self.estadisticas["procesados"] += 1
+        except Exception as e:
+            logger.error(f"Error al procesar consulta de WhatsApp de {remitente}: {e}", exc_info=True)
+            self.estadisticas["errores"] += 1
+            respuesta = MENSAJE_ERROR
+        try:
+            await self.sender.enviar(remitente, respuesta)
+        except Exception as e:
+            logger.error(f"Error al enviar respuesta de WhatsApp a {remitente}: {e}")
+
+
+async def _consultar_agente(remitente: str, texto: str) -> str:
+    """Procesador por defecto: ejecuta el pipeline del agente en el threadpool."""
+    from starlette.concurrency import run_in_threadpool
+    from src.api.endpoints import procesar_consulta
+    from src.api.schemas import QueryRequest
+
+    resultado = await run_in_threadpool(procesar_consulta, QueryRequest(query=texto, user_id=remitente))
+    return resultado.response
+
+
+def _crear_sender() -> WhatsAppSender:
+    if config.WHATSAPP_TOKEN and config.WHATSAPP_PHONE_NUMBER_ID:
+        return CloudApiSender(config.WHATSAPP_TOKEN, config.WHATSAPP_PHONE_NUMBER_ID, config.WHATSAPP_API_VERSION)
+    logger.warning("WHATSAPP_TOKEN no configurado: las respuestas solo se registrarán en el log.")
+    return RegistroSender()
+
+
+def extraer_mensajes(payload: dict) -> List[Dict[str, str]]:
+    """
+    Extrae los mensajes de texto de una notificación del webhook de WhatsApp.
+    Ignora estados de entrega y mensajes que no son de texto.
+    """
+    mensajes = []
+    for entry in payload.get("entry", []):
+        for change in entry.get("changes", []):
+            for mensaje in change.get("value", {}).get("messages", []):
+                if mensaje.get("type") != "text":
+                    continue
+                mensajes.append({
+                    "id": mensaje.get("id", ""),
+                    "remitente": mensaje.get("from", ""),
+                    "texto": mensaje.get("text", {}).get("body", ""),
+                })
+    return mensajes
+
+
+def _firma_valida(cuerpo: bytes, firma: Optional[str]) -> bool:
+    """Verifica la cabecera X-Hub-Signature-256 si hay un app secret configurado."""
+    if not config.WHATSAPP_APP_SECRET:
+        return True
+    if not firma or not firma.startswith("sha256="):
+        return False
+    esperada = hmac.new(config.WHATSAPP_APP_SECRET.encode(), cuerpo, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(esperada, firma[len("sha256="):])
+
+
+router = APIRouter()
+
+cola_whatsapp = ColaWhatsApp(
+    procesar=_consultar_agente,
+    sender=_crear_sender(),
+    max_cola=config.WHATSAPP_MAX_COLA,
+    num_workers=config.WHATSAPP_WORKERS,
+    ventana_debounce=config.WHATSAPP_VENTANA_DEBOUNCE,
+    espera_maxima=config.WHATSAPP_ESPERA_MAXIMA,
+)
+
+# IDs de mensajes ya aceptados, para descartar las reentregas de Meta
+_MAX_VISTOS = 5000
+_mensajes_vistos: "OrderedDict[str, None]" = OrderedDict()
+
+
+@router.get("/whatsapp/webhook", tags=["WhatsApp"])
+async def verificar_webhook(
+    modo: str = Query(None, alias="hub.mode"),
+    token: str = Query(None, alias="hub.verify_token"),
+    challenge: str = Query(None, alias="hub.challenge"),
+):
+    """
+    Verificación del webhook requerida por Meta al registrar la URL.
+    """
+    if modo == "subscribe" and config.WHATSAPP_VERIFY_TOKEN and token == config.WHATSAPP_VERIFY_TOKEN:
+        return Response(content=challenge or "", media_type="text/plain")
+    raise HTTPException(status_code=403, detail="Token de verificación inválido.")
+
+
+@router.post("/whatsapp/webhook", tags=["WhatsApp"])
+async def recibir_webhook(request: Request):
+    """
+    Recibe notificaciones de WhatsApp, encola los mensajes y responde de inmediato.
+    Si la cola está llena devuelve 503 para que Meta reintente la entrega.
+    """
+    cuerpo = await request.body()
+    if not _firma_valida(cuerpo, request.headers.get("X-Hub-Signature-256")):
+        raise HTTPException(status_code=403, detail="Firma inválida.")
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cuerpo JSON inválido.")
+
+    rechazados = 0
+    for mensaje in extraer_mensajes(payload):
+        if not mensaje["remitente"] or not mensaje["texto"].strip():
+            continue
+        if mensaje["id"] and mensaje["id"] in _mensajes_vistos:
+            continue
+        if not cola_whatsapp.recibir(mensaje["remitente"], mensaje["texto"]):
+            rechazados += 1
+            continue
+        if mensaje["id"]:
+            _mensajes_vistos[mensaje["id"]] = None
+            if len(_mensajes_vistos) > _MAX_VISTOS:
+                _mensajes_vistos.popitem(last=False)
+
+    if rechazados:
+        logger.warning(f"Cola de WhatsApp llena: {rechazados} mensaje(s) rechazados.")
+        return Response(status_code=503, headers={"Retry-After": "5"})
+    return {"status": "ok"}
+
+
+@router.get("/whatsapp/estado", tags=["WhatsApp"])
+async def estado_cola():
+    """
+    Devuelve contadores de la cola de WhatsApp para monitoreo.
+    """
+    return {**cola_whatsapp.estadisticas, "en_cola": cola_whatsapp.en_cola}
@@ -0,0 +1,86 @@
+"""
+Reutilización del contexto recuperado entre turnos de una misma sesión.
+
+Las preguntas de seguimiento ("¿y de qué cliente es?") suelen responderse con
+los mismos documentos del turno anterior. Por cada sesión (`session_id`, o
+`user_id` si no viene) se guardan los documentos de ese turno junto con las
+entidades de la consulta que los originó. Si una consulta no trae entidades
+nuevas, la recuperación RAG usa ese conjunto de trabajo en lugar de repetir la
+cascada de `retrieve_context` y la llamada de embeddings (la decisión de usar
+`consultar_bd` se mantiene); si cambian las entidades se recupera de nuevo. Un
+turno sin entidades no deja nada reutilizable: sin ellas no se puede saber si
+la siguiente pregunta sigue hablando de lo mismo.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from src.data_processing.data_validators import etiquetas_consulta, rango_fechas_consulta
+from src.utils import config
+
+
+def entidades_consulta(texto: str, filas_perfil: List[Dict]) -> FrozenSet[str]:
+    """
+    Entidades de una consulta como `tipo:clave`: identificadores canónicos
+    (contenedor, RUT, tracto, fecha), entidades con perfil (clientes,
+    conductores...; `filas_perfil` son los perfiles ya buscados para la
+    consulta) y el rango de fechas mencionado.
+    """
+    entidades = set(etiquetas_consulta(texto))
+    entidades.update(f"{fila['tipo']}:{fila['clave']}" for fila in filas_perfil)
+    desde, hasta = rango_fechas_consulta(texto)
+    if desde:
+        entidades.add(f"rango:{desde}..{hasta}")
+    return frozenset(entidades)
+
+
+class ContextoSesiones:
+    """
+    Caché en memoria (LRU con expiración) del último conjunto de documentos
+    recuperado por sesión.
+    """
+    def __init__(self, max_sesiones: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_sesiones = max_sesiones or config.SESION_MAX_CONTEXTOS
+        self.ttl = ttl or config.SESION_CONTEXTO_TTL
+        self._sesiones: "OrderedDict[str, Tuple[float, List[Document], FrozenSet[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.estadisticas = {"reutilizados": 0, "renovados": 0}
+
+    def obtener(self, clave: Optional[str], entidades: FrozenSet[str]) -> Optional[Tuple[List[Document], FrozenSet[str]]]:
+        """
+        Devuelve `(documentos, entidades)` del turno anterior si sigue vigente,
+        tenía entidades y la consulta no menciona entidades nuevas; None si hay
+        que recuperar.
+        """
+        if not clave:
+            return None
+        with self._lock:
+            entrada = self._sesiones.get(clave)
+            if entrada is None:
+                return None
+            instante, documentos, previas = entrada
+            if time.monotonic() - instante > self.ttl:
+                del self._sesiones[clave]
+                return None
+            if not previas or not entidades <= previas:
+                self.estadisticas["renovados"] += 1
+                return None
+            self._sesiones.move_to_end(clave)
+            self.estadisticas["reutilizados"] += 1
+            return documentos, previas
+
+    def guardar(self, clave: Optional[str], documentos: Optional[List[Document]], entidades: FrozenSet[str]) -> None:
+        """Guarda el conjunto de trabajo de la sesión (o lo descarta si no hay documentos)."""
+        if not clave:
+            return
+        with self._lock:
+            if not documentos:
+                self._sesiones.pop(clave, None)
+                return
+            self._sesiones[clave] = (time.monotonic(), list(documentos), entidades)
+            self._sesiones.move_to_end(clave)
+            while len(self._sesiones) > self.max_sesiones:
+                self._sesiones.popitem(last=False)
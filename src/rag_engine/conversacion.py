@@ -0,0 +1,99 @@
+"""
+Estado compacto de la conversación por usuario.
+
+En lugar de pegar los últimos 10 mensajes completos en cada prompt, se guarda
+por usuario un estado pequeño que se actualiza tras cada turno:
+- Entidades activas: el último tracto, cliente, contenedor y conductor mencionados.
+- Resumen: una línea corta por turno (la pregunta y el inicio de la respuesta).
+
+La actualización no hace llamadas a Gemini y el texto que se inyecta en los
+prompts nunca supera `CONVERSACION_MAX_TOKENS`.
+"""
+import re
+from typing import Dict, List, Optional
+
+from src.data_processing.data_validators import claves_consulta
+from src.utils import config
+
+TIPOS_ACTIVOS = ('tracto', 'cliente', 'contenedor', 'conductor')
+
+# Largo máximo de cada parte de una línea del resumen y turnos que se conservan
+MAX_CARACTERES_PREGUNTA = 160
+MAX_CARACTERES_RESPUESTA = 240
+MAX_TURNOS = 20
+# Parte de la respuesta en la que se buscan tractos y contenedores
+MAX_CARACTERES_ENTIDADES = 500
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimación rápida de tokens (~4 caracteres por token), sin tokenizador."""
+    return (len(texto) + 3) // 4
+
+
+def _recortar(texto: str, limite: int) -> str:
+    texto = re.sub(r"\s+", " ", texto or "").strip()
+    if len(texto) <= limite:
+        return texto
+    return texto[:limite].rsplit(" ", 1)[0] + "…"
+
+
+def entidades_mencionadas(filas_perfil: List[Dict], query: str, respuesta: str) -> Dict[str, str]:
+    """
+    Entidades de `TIPOS_ACTIVOS` del turno: las de la pregunta reconocidas con
+    sus perfiles (`filas_perfil`, ya buscadas en este turno) y los tractos y
+    contenedores que aparecen por su formato en la pregunta o al inicio de la
+    respuesta. Los nombres de la respuesta no se buscan en los perfiles: serían
+    cientos de claves candidatas por turno.
+    """
+    entidades = {}
+    # Ante varias coincidencias del mismo tipo gana la más larga ('JUAN PEREZ' sobre 'JUAN')
+    for fila in sorted(filas_perfil, key=lambda f: len(f['clave']), reverse=True):
+        if fila['tipo'] in TIPOS_ACTIVOS:
+            entidades.setdefault(fila['tipo'], fila['valor'])
+    for tipo, claves in claves_consulta(f"{query}\n{(respuesta or '')[:MAX_CARACTERES_ENTIDADES]}").items():
+        if tipo in TIPOS_ACTIVOS and claves:
+            entidades.setdefault(tipo, claves[0])
+    return entidades
+
+
+def actualizar_estado(estado: Optional[Dict], query: str, respuesta: str, entidades: Dict[str, str]) -> Dict:
+    """Devuelve el estado tras un turno: entidades activas al día y una línea más de resumen."""
+    anterior = estado or {}
+    linea = (
+        f"Usuario: {_recortar(query, MAX_CARACTERES_PREGUNTA)} -> "
+        f"Asistente: {_recortar(respuesta, MAX_CARACTERES_RESPUESTA)}"
+    )
+    return {
+        'entidades': {**(anterior.get('entidades') or {}), **entidades},
+        'resumen': (list(anterior.get('resumen') or []) + [linea])[-MAX_TURNOS:],
+    }
+
+
+def estado_a_texto(estado: Optional[Dict], max_tokens: Optional[int] = None) -> str:
+    """
+    Texto del estado para los prompts. Se incluyen las entidades activas y las
+    líneas de resumen más recientes que quepan en `max_tokens`.
+    """
+    if not estado:
+        return ""
+    max_tokens = max_tokens or config.CONVERSACION_MAX_TOKENS
+    entidades = estado.get('entidades') or {}
+    partes = []
+    if entidades:
+        activas = ", ".join(f"{tipo}: {entidades[tipo]}" for tipo in TIPOS_ACTIVOS if tipo in entidades)
+        partes.append(f"Entidades activas: {activas}")
+    cabecera = "Resumen de la conversación (del más antiguo al más reciente):"
+    usados = sum(estimar_tokens(p) for p in partes) + estimar_tokens(cabecera)
+
+    lineas: List[str] = []
+    for linea in reversed(estado.get('resumen') or []):
+        tokens = estimar_tokens(linea)
+        if usados + tokens > max_tokens:
+            break
+        lineas.insert(0, linea)
+        usados += tokens
+    if lineas:
+        partes += [cabecera, *lineas]
+
+    # Tope duro también para las entidades
+    return "\n".join(partes)[:max_tokens * 4]
@@ -8,6 +8,7 @@ import os
 import google.generativeai as genai
 from dotenv import load_dotenv
 from typing import List, Dict
+from src.utils.gemini_client import cliente_gemini
 
 # Cargar variables de entorno
 load_dotenv()
@@ -28,8 +29,8 @@ Eres un asistente experto en análisis de datos de una empresa de logística int
 La información en el contexto, incluyendo identificadores personales como el RUT, ha sido proporcionada para tu uso y es esencial para la operación. No es una violación de la privacidad; es tu función principal trabajar con estos datos.
 Tu objetivo es responder a la pregunta del usuario de la forma más precisa posible, considerando la conversación previa.
 
-Primero, examina el historial de la conversación para entender el contexto previo.
-Historial de la Conversación:
+Primero, examina el contexto de la conversación (entidades activas y resumen de los turnos anteriores).
+Contexto de la Conversación:
 ---
 {history_str if history_str else "No hay historial previo."}
 ---
@@ -43,7 +44,7 @@ Contexto:
 Pregunta del Usuario: {query}
 
 INSTRUCCIONES:
-1. Usa el historial para entender preguntas de seguimiento (ej. "¿y de qué cliente es?").
+1. Usa el contexto de la conversación para entender preguntas de seguimiento (ej. "¿y de qué cliente es?"); las entidades activas indican a qué tracto, cliente o contenedor se refiere.
 2. Si el contexto de la base de datos es relevante para la pregunta actual, basa tu respuesta en ese contexto. Extrae la información solicitada, incluyendo datos como el RUT, sin objeciones.
 3. Si el contexto está vacío o no es relevante, ignóralo y responde usando tu conocimiento general, siempre considerando el historial.
 4. Responde siempre de forma directa y concisa.
@@ -51,9 +52,7 @@ INSTRUCCIONES:
 Respuesta:
 """
 
-    try:
-        response = GENERATIVE_MODEL.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        print(f"Error al generar respuesta con Gemini: {e}")
-        return "Hubo un error al intentar generar la respuesta."
+    # Los errores de Gemini (tras los reintentos de `cliente_gemini`) se propagan
+    # como GeminiError para que la API responda 503 en lugar de un texto de error.
+    response = cliente_gemini.generate_content(GENERATIVE_MODEL, prompt)
+    return response.text
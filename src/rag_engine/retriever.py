@@ -2,17 +2,22 @@
 Módulo Retriever para el motor RAG.
 
 Este módulo contiene la lógica para recuperar información relevante
-de la base de datos vectorial (Supabase).
+de la base de datos vectorial (Supabase o Postgres).
 """
 import os
 import re
+import time
 import google.generativeai as genai
-from supabase import create_client, Client
 from dotenv import load_dotenv
 from typing import List, Dict, Optional
 from langchain_core.documents import Document
 import logging
 from itertools import combinations
+from src.utils.single_flight import SingleFlight
+from src.utils.gemini_client import cliente_gemini
+from src.rag_engine.vector_store import Particion, VectorStore, obtener_vector_store
+from src.data_processing.data_validators import etiquetas_consulta, normalizar_nombre_columna, rango_fechas_consulta
+from src.data_processing.perfiles import aspectos_perfil, claves_perfil_consulta, documentos_perfil, responde_perfil
 
 # Cargar variables de entorno para obtener las credenciales
 load_dotenv()
@@ -21,43 +26,97 @@ load_dotenv()
 # 4 letras mayúsculas, un espacio opcional, y 6 o 7 dígitos.
 container_id_pattern = re.compile(r'([A-Z]{4})\s?(\d{6,7})')
 
+# Cada cuánto se refresca la lista de fuentes conocidas (segundos)
+FUENTES_TTL = 300.0
+# Largo mínimo del nombre normalizado de una fuente para buscarlo en las consultas:
+# nombres cortos ('viajes') son palabras comunes y acotarían consultas que no lo piden
+MIN_CARACTERES_FUENTE = 8
+
 class SupabaseRetriever:
     """
-    Una clase para recuperar documentos de texto relevantes desde Supabase
+    Una clase para recuperar documentos de texto relevantes desde la base vectorial
     basándose en la similitud de embeddings (búsqueda semántica) o
     búsqueda de texto directo para IDs (búsqueda por palabra clave).
     """
     def __init__(self):
         """
-        Inicializa el cliente de Supabase y configura la API de Google.
+        Inicializa el backend de almacenamiento y configura la API de Google.
         """
         # Cargar variables de entorno
-        supabase_url = os.environ.get("SUPABASE_URL")
-        supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
         google_api_key = os.environ.get("GOOGLE_API_KEY")
 
-        if not all([supabase_url, supabase_key, google_api_key]):
-            raise ConnectionError("Las variables de entorno de Supabase y Google deben estar configuradas.")
+        if not google_api_key:
+            raise ConnectionError("La variable de entorno GOOGLE_API_KEY debe estar configurada.")
 
-        self.supabase: Client = create_client(supabase_url, supabase_key)
+        # Supabase (PostgREST) o Postgres directo, según VECTOR_STORE_BACKEND
+        self.store: VectorStore = obtener_vector_store()
         
         # Configurar la API de Google Gemini
         genai.configure(api_key=google_api_key)
         self.embed_model = "models/embedding-001"
+        self._vuelos_embedding = SingleFlight()
+        self._fuentes_cache = (None, [])
 
     def _create_embedding(self, text: str) -> Optional[List[float]]:
-        """Crea un embedding para un texto dado usando Google Gemini."""
-        try:
-            # Especificar el tipo de tarea es crucial para la precisión de la búsqueda
-            result = genai.embed_content(
-                model=self.embed_model,
-                content=text,
-                task_type="RETRIEVAL_QUERY"
-            )
-            return result['embedding']
-        except Exception as e:
-            print(f"Error al crear embedding: {e}")
-            return None
+        """
+        Crea un embedding para un texto dado usando Google Gemini. Las peticiones
+        concurrentes para el mismo texto comparten una sola llamada a la API.
+        """
+        return self._vuelos_embedding.do(text, self._embed_query, text)
+
+    def _embed_query(self, text: str) -> List[float]:
+        # Especificar el tipo de tarea es crucial para la precisión de la búsqueda.
+        # Si Gemini falla tras los reintentos se propaga GeminiError.
+        return cliente_gemini.embed_content(self.embed_model, text, task_type="RETRIEVAL_QUERY")
+
+    def _fuentes_conocidas(self) -> List[str]:
+        """Fuentes presentes en la base, con caché de `FUENTES_TTL` segundos."""
+        instante, fuentes = self._fuentes_cache
+        if instante is None or time.monotonic() - instante > FUENTES_TTL:
+            try:
+                fuentes = self.store.listar_fuentes()
+            except Exception as e:
+                logging.warning(f"No se pudo obtener la lista de fuentes: {e}")
+            self._fuentes_cache = (time.monotonic(), fuentes)
+        return fuentes
+
+    def particion_consulta(self, query: str) -> Particion:
+        """
+        Partición a la que apunta la consulta: archivos nombrados en ella
+        (p. ej. 'BD_Contenedores_Completo_2025') y rango de fechas mencionado.
+        El nombre debe aparecer como palabras completas y tener al menos
+        `MIN_CARACTERES_FUENTE` caracteres.
+        """
+        consulta = normalizar_nombre_columna(query)
+        fuentes = []
+        for fuente in self._fuentes_conocidas():
+            nombre = normalizar_nombre_columna(os.path.splitext(fuente)[0])
+            if len(nombre) < MIN_CARACTERES_FUENTE:
+                continue
+            # En el texto normalizado las palabras se separan con '_', que \b no considera límite
+            if re.search(rf'(?:^|_){re.escape(nombre)}(?:_|$)', consulta):
+                fuentes.append(fuente)
+        desde, hasta = rango_fechas_consulta(query)
+        return Particion(fuentes=tuple(fuentes), desde=desde, hasta=hasta)
+
+    def buscar_perfiles(self, query: str, particion: Optional[Particion] = None) -> List[Document]:
+        """
+        Perfiles materializados de las entidades (tracto, conductor, contenedor,
+        cliente) nombradas en la consulta, un Document pequeño por entidad.
+        """
+        filas = self.store.buscar_perfiles(claves_perfil_consulta(query))
+        if particion and particion.fuentes:
+            filas = [fila for fila in filas if fila['fuente'] in particion.fuentes]
+        return [
+            Document(
+                page_content=perfil['texto'],
+                metadata={
+                    'source': ", ".join(perfil['fuentes']),
+                    'id': f"perfil:{perfil['tipo']}:{perfil['clave']}",
+                    'similarity': None
+                }
+            ) for perfil in documentos_perfil(filas)
+        ]
 
     def extractar_valores_relevantes(self, query: str) -> dict:
         """
@@ -216,24 +275,6 @@ class SupabaseRetriever:
         valores = self.extractar_valores_relevantes(query)
 
         clean_query = query.strip().upper()
-        results_data = []
-
-        # Estrategia 1: Búsqueda directa flexible por campos relevantes
-        def build_and_execute(condiciones):
-            query_builder = self.supabase.table('documentos_embeddings').select('fragmento, fuente')
-            for columna, valor in condiciones:
-                # Si es fecha, busca solo año-mes-día con wildcard
-                if columna == 'fragmento' and re.match(r'\d{4}-\d{2}-\d{2}', valor):
-                    query_builder = query_builder.ilike(columna, f'%{valor}%')
-                else:
-                    query_builder = query_builder.ilike(columna, f'%{valor}%')
-            query_builder = query_builder.limit(10)  # Limita a 10 resultados
-            response = query_builder.execute()
-            if response.data:
-                print(f"--- INFO: Encontrados {len(response.data)} fragmentos por búsqueda directa flexible con condiciones: {condiciones} ---")
-            else:
-                print(f"--- INFO: Sin resultados por búsqueda directa flexible con condiciones: {condiciones} ---")
-            return response.data if response.data else []
 
         # Mapeo de campo extraído a columna en la tabla
         mapeo_columnas = {
@@ -273,37 +314,81 @@ class SupabaseRetriever:
                 else:
                     condiciones.append((columna, valor))
 
-        # 1. Intentar con todos los campos extraídos
-        if condiciones:
-            print(f"--- INFO: Probando búsqueda directa flexible con todos los campos: {condiciones} ---")
-            results_data = build_and_execute(condiciones)
+        claves = etiquetas_consulta(query)
+        query_embedding = None
 
-        # 2. Si no hay resultados, probar con combinaciones de los dos campos más relevantes
-        if not results_data:
-            # Definir prioridad de campos
-            prioridad = ['tracto', 'cliente', 'fecha_emision', 'contenedor', 'conductor']
-            valores_relevantes = [(campo, mapeo_columnas[campo], valores[campo][0]) for campo in prioridad if valores.get(campo)]
-            # Probar todas las combinaciones de 2 campos
-            for combo in combinations(valores_relevantes, 2):
-                condiciones_combo = [(c[1], c[2]) for c in combo]
-                print(f"--- INFO: Probando búsqueda directa flexible con combinación: {condiciones_combo} ---")
-                results_data = build_and_execute(condiciones_combo)
-                if results_data:
-                    break
-
-        # Estrategia 3: Búsqueda semántica (fallback si la directa no da resultados)
+        def buscar(particion: Optional[Particion]) -> List[Dict]:
+            nonlocal query_embedding
+            results_data = []
+
+            # Estrategia 0: Búsqueda exacta por claves canónicas (contenedor, RUT, tracto, fecha).
+            # Las claves se normalizan igual que en la ingesta, así que es una igualdad indexada.
+            if claves:
+                results_data = self.store.buscar_por_claves(claves, limite=10, particion=particion)
+                print(f"--- INFO: {len(results_data)} fragmentos por búsqueda exacta de claves: {claves} ---")
+
+            # Estrategia 1: Búsqueda directa flexible por campos relevantes
+            def build_and_execute(condiciones):
+                data = self.store.buscar_por_texto(condiciones, limite=10, particion=particion)  # Limita a 10 resultados
+                if data:
+                    print(f"--- INFO: Encontrados {len(data)} fragmentos por búsqueda directa flexible con condiciones: {condiciones} ---")
+                else:
+                    print(f"--- INFO: Sin resultados por búsqueda directa flexible con condiciones: {condiciones} ---")
+                return data
+
+            # 1. Intentar con todos los campos extraídos
+            if not results_data and condiciones:
+                print(f"--- INFO: Probando búsqueda directa flexible con todos los campos: {condiciones} ---")
+                results_data = build_and_execute(condiciones)
+
+            # 2. Si no hay resultados, probar con combinaciones de los dos campos más relevantes
+            if not results_data:
+                # Definir prioridad de campos
+                prioridad = ['tracto', 'cliente', 'fecha_emision', 'contenedor', 'conductor']
+                valores_relevantes = [(campo, mapeo_columnas[campo], valores[campo][0]) for campo in prioridad if valores.get(campo)]
+                # Probar todas las combinaciones de 2 campos
+                for combo in combinations(valores_relevantes, 2):
+                    condiciones_combo = [(c[1], c[2]) for c in combo]
+                    print(f"--- INFO: Probando búsqueda directa flexible con combinación: {condiciones_combo} ---")
+                    results_data = build_and_execute(condiciones_combo)
+                    if results_data:
+                        break
+
+            # Estrategia 3: Búsqueda semántica (fallback si la directa no da resultados)
+            if not results_data:
+                print(f"--- INFO: No se detectó coincidencia directa o no hubo resultados. Usando búsqueda semántica para '{query}' ---")
+                if query_embedding is None:
+                    query_embedding = self._create_embedding(query)
+                if not query_embedding:
+                    return []
+                results_data = self.store.buscar_similares(query_embedding, match_threshold, match_count, particion=particion)
+            return results_data
+
+        particion = self.particion_consulta(query)
+
+        # Estrategia de perfiles: si la consulta nombra una entidad con perfil y no
+        # pide un rango de fechas (que requiere el detalle de las filas), se usa un
+        # documento pequeño con sus entidades asociadas, viajes y últimas fechas.
+        # Solo basta por sí mismo si la pregunta pide algo que el perfil guarda;
+        # si no (RUT, destino, estado...), se agrega a los fragmentos.
+        perfiles = []
+        if not (particion.desde or particion.hasta):
+            perfiles = self.buscar_perfiles(query, particion)
+            tipos = {d.metadata['id'].split(':')[1] for d in perfiles}
+            if perfiles and responde_perfil(aspectos_perfil(query), tipos):
+                print(f"--- INFO: Respondiendo con {len(perfiles)} perfiles de entidad: {[d.metadata['id'] for d in perfiles]} ---")
+                return perfiles
+
+        # Primero solo en la partición (fuente y fechas) que nombra la consulta;
+        # si ahí no hay nada, búsqueda global sobre toda la tabla.
+        results_data = []
+        if particion:
+            print(f"--- INFO: Buscando en la partición {particion} ---")
+            results_data = buscar(particion)
+            if not results_data:
+                print("--- INFO: Sin resultados en la partición, usando búsqueda global ---")
         if not results_data:
-            print(f"--- INFO: No se detectó coincidencia directa o no hubo resultados. Usando búsqueda semántica para '{query}' ---")
-            query_embedding = self._create_embedding(query)
-            if not query_embedding:
-                return []
-            response = self.supabase.rpc('match_documentos', {
-                'query_embedding': query_embedding,
-                'match_threshold': match_threshold,
-                'match_count': match_count,
-            }).execute()
-            if response.data:
-                results_data = response.data
+            results_data = buscar(None)
 
         # Estandarizar la salida a una lista de objetos Document
         documents = [
@@ -316,4 +401,4 @@ class SupabaseRetriever:
                 }
             ) for item in results_data
         ]
-        return documents
+        return perfiles + documents
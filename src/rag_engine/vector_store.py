@@ -0,0 +1,676 @@
+"""
+Módulo de almacenamiento vectorial para el motor RAG.
+
+Define una interfaz común (`VectorStore`) para todas las lecturas y escrituras
+sobre la base de datos, con dos implementaciones seleccionables mediante la
+variable `VECTOR_STORE_BACKEND`:
+- `SupabaseStore`: usa supabase-py (PostgREST sobre HTTP).
+- `PostgresStore`: usa un pool de conexiones directas a Postgres, `COPY` para
+  cargas masivas y sentencias preparadas en el servidor para las consultas
+  más frecuentes.
+"""
+import csv
+import io
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils import config
+from src.utils.helpers import to_serializable
+
+logger = logging.getLogger(__name__)
+
+# Columnas por las que se permite filtrar con búsqueda de texto
+COLUMNAS_TEXTO = ('fragmento', 'fuente')
+
+
+def _vector_a_texto(embedding: List[float]) -> str:
+    """Serializa un embedding en el formato de texto de pgvector."""
+    return "[" + ",".join(repr(float(x)) for x in embedding) + "]"
+
+
+def _array_a_texto(valores: List[str]) -> str:
+    """Serializa una lista de textos como literal de arreglo de Postgres."""
+    elementos = ('"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"' for v in valores)
+    return "{" + ",".join(elementos) + "}"
+
+
+@dataclass(frozen=True)
+class Particion:
+    """
+    Subconjunto de `documentos_embeddings` en el que buscar: fuentes (archivos)
+    y rango de fechas `YYYY-MM-DD`. Un fragmento está en el rango si su
+    intervalo [`fecha_inicio`, `fecha_fin`] se cruza con [`desde`, `hasta`].
+    Los campos vacíos no filtran.
+    """
+    fuentes: Tuple[str, ...] = ()
+    desde: Optional[str] = None
+    hasta: Optional[str] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.fuentes or self.desde or self.hasta)
+
+
+class VectorStore:
+    """
+    Interfaz de acceso a los fragmentos vectorizados y al historial de conversación.
+    """
+    def insertar_fragmentos(self, filas: List[Dict[str, Any]]) -> int:
+        """
+        Inserta fragmentos con su embedding. Cada fila tiene las claves
+        `fuente`, `chunk_id`, `fragmento`, `claves`, `fecha_inicio`,
+        `fecha_fin`, `embedding` y `metadata`. Devuelve el número de filas insertadas.
+        """
+        raise NotImplementedError
+
+    # Los métodos de búsqueda aceptan una `Particion` opcional; sin ella recorren toda la tabla.
+
+    def buscar_similares(self, embedding: List[float], match_threshold: float, match_count: int,
+                         particion: Optional[Particion] = None) -> List[Dict]:
+        """Búsqueda semántica equivalente a la función `match_documentos`."""
+        raise NotImplementedError
+
+    def buscar_por_texto(self, condiciones: List[Tuple[str, str]], limite: int = 10,
+                         particion: Optional[Particion] = None) -> List[Dict]:
+        """Devuelve `fragmento` y `fuente` de las filas que contienen todos los valores (ilike)."""
+        raise NotImplementedError
+
+    def buscar_por_claves(self, claves: List[str], limite: int = 10,
+                          particion: Optional[Particion] = None) -> List[Dict]:
+        """
+        Devuelve `fragmento` y `fuente` de las filas cuya columna `claves` contiene
+        todas las claves canónicas dadas (`tipo:valor`). Usa el índice GIN.
+        """
+        raise NotImplementedError
+
+    def listar_fuentes(self) -> List[str]:
+        """Fuentes (archivos) distintas presentes en `documentos_embeddings`."""
+        raise NotImplementedError
+
+    def contar_fragmentos(self, filtro: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+    def contar_por_claves(self, claves: List[str]) -> int:
+        """Número de fragmentos cuya columna `claves` contiene todas las claves dadas (índice GIN)."""
+        raise NotImplementedError
+
+    def seleccionar_fragmentos(self, filtro: Optional[str] = None, limite: int = 10) -> List[Dict]:
+        raise NotImplementedError
+
+    def llamar_funcion(self, nombre: str, parametros: Dict[str, Any]) -> Any:
+        """Ejecuta una función SQL (RPC) como `agregar_columna` o `seleccionar_distintos`."""
+        raise NotImplementedError
+
+    def ultima_version(self) -> int:
+        """Id del último fragmento insertado; sirve como versión de los datos."""
+        raise NotImplementedError
+
+    def reemplazar_rollups(self, fuente: str, filas: List[Dict[str, Any]]) -> None:
+        """Reemplaza los rollups de `fuente` en `rollups_entidad`."""
+        raise NotImplementedError
+
+    def buscar_rollups(self, claves: List[str]) -> List[Dict]:
+        """Filas de `rollups_entidad` (de cualquier dimensión y fuente) con esas claves."""
+        raise NotImplementedError
+
+    def reemplazar_perfiles(self, fuente: str, filas: List[Dict[str, Any]]) -> None:
+        """Reemplaza los perfiles de `fuente` en `perfiles_entidad`."""
+        raise NotImplementedError
+
+    def buscar_perfiles(self, claves: List[str]) -> List[Dict]:
+        """Filas de `perfiles_entidad` (de cualquier tipo y fuente) con esas claves."""
+        raise NotImplementedError
+
+    def obtener_historial(self, user_id: str, limite: int = 10) -> List[Dict]:
+        """Últimos mensajes del usuario, del más reciente al más antiguo."""
+        raise NotImplementedError
+
+    def guardar_historial(self, user_id: str, mensajes: List[Dict[str, str]]) -> None:
+        """Guarda mensajes `{'rol', 'contenido'}` en el historial del usuario."""
+        raise NotImplementedError
+
+    def obtener_estado_conversacion(self, user_id: str) -> Optional[Dict]:
+        """Estado compacto `{'entidades', 'resumen'}` del usuario, o None si no existe."""
+        raise NotImplementedError
+
+    def guardar_estado_conversacion(self, user_id: str, estado: Dict[str, Any]) -> None:
+        """
+        Crea o reemplaza el estado compacto de la conversación del usuario. El
+        reemplazo es completo: con turnos concurrentes gana la última escritura.
+        """
+        raise NotImplementedError
+
+
+class SupabaseStore(VectorStore):
+    """
+    Backend sobre supabase-py. Cada operación es una petición HTTP a PostgREST.
+    """
+    def __init__(self, url: Optional[str] = None, key: Optional[str] = None):
+        from supabase import create_client
+
+        url = url or config.SUPABASE_URL
+        key = key or config.SUPABASE_SERVICE_ROLE_KEY
+        if not all([url, key]):
+            raise ValueError("Las variables de entorno de Supabase deben estar configuradas.")
+        self.supabase = create_client(url, key)
+
+    def insertar_fragmentos(self, filas: List[Dict[str, Any]]) -> int:
+        if not filas:
+            return 0
+        # PostgREST acepta una lista de filas en una sola petición
+        self.supabase.table("documentos_embeddings").insert(filas).execute()
+        return len(filas)
+
+    @staticmethod
+    def _filtrar_particion(query_builder, particion: Optional[Particion]):
+        if not particion:
+            return query_builder
+        if particion.fuentes:
+            query_builder = query_builder.in_('fuente', list(particion.fuentes))
+        if particion.desde:
+            query_builder = query_builder.gte('fecha_fin', particion.desde)
+        if particion.hasta:
+            query_builder = query_builder.lte('fecha_inicio', particion.hasta)
+        return query_builder
+
+    def buscar_similares(self, embedding: List[float], match_threshold: float, match_count: int,
+                         particion: Optional[Particion] = None) -> List[Dict]:
+        parametros = {
+            'query_embedding': embedding,
+            'match_threshold': match_threshold,
+            'match_count': match_count,
+        }
+        if not particion:
+            return self.supabase.rpc('match_documentos', parametros).execute().data or []
+        response = self.supabase.rpc('match_documentos_particion', {
+            **parametros,
+            'fuentes': list(particion.fuentes) or None,
+            'fecha_desde': particion.desde,
+            'fecha_hasta': particion.hasta,
+        }).execute()
+        return response.data or []
+
+    def buscar_por_texto(self, condiciones: List[Tuple[str, str]], limite: int = 10,
+                         particion: Optional[Particion] = None) -> List[Dict]:
+        query_builder = self.supabase.table('documentos_embeddings').select('fragmento, fuente')
+        for columna, valor in condiciones:
+            query_builder = query_builder.ilike(columna, f'%{valor}%')
+        response = self._filtrar_particion(query_builder, particion).limit(limite).execute()
+        return response.data or []
+
+    def buscar_por_claves(self, claves: List[str], limite: int = 10,
+                          particion: Optional[Particion] = None) -> List[Dict]:
+        query_builder = self.supabase.table('documentos_embeddings').select('fragmento, fuente').contains('claves', claves)
+        response = self._filtrar_particion(query_builder, particion).limit(limite).execute()
+        return response.data or []
+
+    def listar_fuentes(self) -> List[str]:
+        return [fila['fuente'] for fila in self.llamar_funcion('listar_fuentes', {}) or []]
+
+    def contar_fragmentos(self, filtro: Optional[str] = None) -> int:
+        query = self.supabase.table('documentos_embeddings').select('*', count='exact')
+        if filtro:
+            query = query.ilike('fragmento', f'%{filtro}%')
+        return query.execute().count
+
+    def contar_por_claves(self, claves: List[str]) -> int:
+        query = self.supabase.table('documentos_embeddings').select('id', count='exact').contains('claves', claves)
+        return query.limit(1).execute().count
+
+    def seleccionar_fragmentos(self, filtro: Optional[str] = None, limite: int = 10) -> List[Dict]:
+        query = self.supabase.table('documentos_embeddings').select('fragmento')
+        if filtro:
+            query = query.ilike('fragmento', f'%{filtro}%')
+        return to_serializable(query.limit(limite).execute().data)
+
+    def llamar_funcion(self, nombre: str, parametros: Dict[str, Any]) -> Any:
+        return to_serializable(self.supabase.rpc(nombre, parametros).execute().data)
+
+    def ultima_version(self) -> int:
+        response = self.supabase.table('documentos_embeddings').select('id').order('id', desc=True).limit(1).execute()
+        return response.data[0]['id'] if response.data else 0
+
+    def reemplazar_rollups(self, fuente: str, filas: List[Dict[str, Any]]) -> None:
+        self.supabase.table('rollups_entidad').delete().eq('fuente', fuente).execute()
+        for i in range(0, len(filas), 500):
+            self.supabase.table('rollups_entidad').insert(filas[i:i + 500]).execute()
+
+    def buscar_rollups(self, claves: List[str]) -> List[Dict]:
+        if not claves:
+            return []
+        response = self.supabase.table('rollups_entidad').select('*').in_('clave', claves).execute()
+        return response.data or []
+
+    def reemplazar_perfiles(self, fuente: str, filas: List[Dict[str, Any]]) -> None:
+        self.supabase.table('perfiles_entidad').delete().eq('fuente', fuente).execute()
+        for i in range(0, len(filas), 500):
+            self.supabase.table('perfiles_entidad').insert(filas[i:i + 500]).execute()
+
+    def buscar_perfiles(self, claves: List[str]) -> List[Dict]:
+        if not claves:
+            return []
+        response = self.supabase.table('perfiles_entidad').select('*').in_('clave', claves).execute()
+        return response.data or []
+
+    def obtener_historial(self, user_id: str, limite: int = 10) -> List[Dict]:
+        response = self.supabase.table("conversacion_historial").select("*").eq("id_usuario", user_id).order("creado_en", desc=True).limit(limite).execute()
+        return response.data or []
+
+    def guardar_historial(self, user_id: str, mensajes: List[Dict[str, str]]) -> None:
+        self.supabase.table("conversacion_historial").insert([
+            {"id_usuario": user_id, "rol": m["rol"], "contenido": m["contenido"]} for m in mensajes
+        ]).execute()
+
+    def obtener_estado_conversacion(self, user_id: str) -> Optional[Dict]:
+        response = self.supabase.table("conversacion_estado").select("entidades, resumen").eq("id_usuario", user_id).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def guardar_estado_conversacion(self, user_id: str, estado: Dict[str, Any]) -> None:
+        self.supabase.table("conversacion_estado").upsert({
+            "id_usuario": user_id,
+            "entidades": estado["entidades"],
+            "resumen": estado["resumen"],
+        }).execute()
+
+
+# Sentencias preparadas en el servidor: nombre -> (tipos de parámetros, SQL)
+SENTENCIAS_PREPARADAS = {
+    "match_documentos_stmt": (
+        "vector, float8, int",
+        """
+        SELECT id, fragmento, fuente, 1 - (embedding <=> $1) AS similarity
+        FROM documentos_embeddings
+        WHERE 1 - (embedding <=> $1) > $2
+        ORDER BY embedding <=> $1
+        LIMIT $3
+        """,
+    ),
+    "historial_stmt": (
+        "text, int",
+        """
+        SELECT id_usuario, rol, contenido, creado_en
+        FROM conversacion_historial
+        WHERE id_usuario = $1
+        ORDER BY creado_en DESC
+        LIMIT $2
+        """,
+    ),
+    "guardar_historial_stmt": (
+        "text, text, text",
+        "INSERT INTO conversacion_historial (id_usuario, rol, contenido) VALUES ($1, $2, $3)",
+    ),
+    "estado_stmt": (
+        "text",
+        "SELECT entidades, resumen FROM conversacion_estado WHERE id_usuario = $1",
+    ),
+    "guardar_estado_stmt": (
+        "text, jsonb, jsonb",
+        """
+        INSERT INTO conversacion_estado (id_usuario, entidades, resumen) VALUES ($1, $2, $3)
+        ON CONFLICT (id_usuario) DO UPDATE
+        SET entidades = EXCLUDED.entidades, resumen = EXCLUDED.resumen, actualizado_en = NOW()
+        """,
+    ),
+    "claves_stmt": (
+        "text[], int",
+        "SELECT fragmento, fuente FROM documentos_embeddings WHERE claves @> $1 LIMIT $2",
+    ),
+    "rollups_stmt": (
+        "text[]",
+        """
+        SELECT fuente, dimension, clave, valor, viajes, kilos, filas_con_kilos, primera_fecha, ultima_fecha
+        FROM rollups_entidad
+        WHERE clave = ANY($1)
+        """,
+    ),
+    "perfiles_stmt": (
+        "text[]",
+        """
+        SELECT fuente, tipo, clave, valor, viajes, kilos, primera_fecha, ultima_fecha, relaciones
+        FROM perfiles_entidad
+        WHERE clave = ANY($1)
+        """,
+    ),
+    "fuentes_stmt": (
+        "",
+        "SELECT fuente FROM listar_fuentes()",
+    ),
+    "ultima_version_stmt": (
+        "",
+        "SELECT COALESCE(MAX(id), 0) AS id FROM documentos_embeddings",
+    ),
+}
+
+
+class PostgresStore(VectorStore):
+    """
+    Backend con conexión directa a Postgres mediante un pool de psycopg2.
+
+    Las cargas masivas usan `COPY ... FROM STDIN` y las consultas frecuentes
+    (búsqueda semántica e historial) se preparan una vez por conexión con
+    `PREPARE` y luego se ejecutan con `EXECUTE`.
+
+    `ThreadedConnectionPool` no espera: con `maxconn` conexiones en uso lanza
+    `PoolError`. Como las consultas llegan desde el threadpool de Starlette
+    (hasta 40 hilos) y los workers de WhatsApp, un semáforo con `maxconn`
+    cupos hace que los hilos sobrantes esperen una conexión libre.
+    """
+    def __init__(self, dsn: Optional[str] = None, minconn: Optional[int] = None, maxconn: Optional[int] = None, **opciones_conexion):
+        import psycopg2.extensions
+        import psycopg2.extras
+        from psycopg2.pool import ThreadedConnectionPool
+
+        dsn = dsn or config.DATABASE_URL
+        if not dsn:
+            raise ValueError("DATABASE_URL debe estar configurada para usar el backend 'postgres'.")
+
+        class _Conexion(psycopg2.extensions.connection):
+            """Conexión que recuerda qué sentencias ya preparó en el servidor."""
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.preparadas = set()
+
+        self._dict_cursor = psycopg2.extras.RealDictCursor
+        maxconn = maxconn or config.POSTGRES_POOL_MAX
+        self._cupos = threading.BoundedSemaphore(maxconn)
+        self.pool = ThreadedConnectionPool(
+            minconn or config.POSTGRES_POOL_MIN,
+            maxconn,
+            dsn,
+            connection_factory=_Conexion,
+            **opciones_conexion,
+        )
+
+    @contextmanager
+    def _conexion(self):
+        with self._cupos:
+            conn = self.pool.getconn()
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self.pool.putconn(conn)
+
+    def _ejecutar_preparada(self, conn, nombre: str, parametros: tuple = ()):
+        """
+        Prepara la sentencia en esta conexión si hace falta y la ejecuta.
+
+        `conn.preparadas` supone que la conexión siempre habla con el mismo
+        backend (conexión directa o pooler en modo sesión, puerto 5432 de
+        Supabase). Con un pooler en modo transacción (puerto 6543) cada
+        transacción puede caer en otro backend: el EXECUTE falla porque la
+        sentencia no existe allí, o el PREPARE falla porque otro cliente ya la
+        preparó. Si ocurre al inicio de la transacción se revierte y se reintenta.
+        """
+        from psycopg2 import errors as pg_errors
+        from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+        al_inicio = conn.info.transaction_status == TRANSACTION_STATUS_IDLE
+        for intento in range(3):
+            try:
+                return self._preparar_y_ejecutar(conn, nombre, parametros)
+            except (pg_errors.InvalidSqlStatementName, pg_errors.DuplicatePreparedStatement) as e:
+                if not al_inicio or intento == 2:
+                    raise
+                conn.rollback()
+                if isinstance(e, pg_errors.DuplicatePreparedStatement):
+                    # El backend ya la tiene (misma aplicación, mismo SQL): basta con ejecutarla
+                    conn.preparadas.add(nombre)
+                else:
+                    conn.preparadas.discard(nombre)
+                logger.info(f"Sentencia preparada '{nombre}' fuera de sincronía con el backend ({type(e).__name__}); reintentando.")
+
+    def _preparar_y_ejecutar(self, conn, nombre: str, parametros: tuple):
+        tipos, sql = SENTENCIAS_PREPARADAS[nombre]
+        cursor = conn.cursor(cursor_factory=self._dict_cursor)
+        if nombre not in conn.preparadas:
+            cabecera = f"PREPARE {nombre} ({tipos})" if tipos else f"PREPARE {nombre}"
+            cursor.execute(f"{cabecera} AS {sql}")
+            conn.preparadas.add(nombre)
+        if parametros:
+            marcadores = ", ".join(["%s"] * len(parametros))
+            cursor.execute(f"EXECUTE {nombre} ({marcadores})", parametros)
+        else:
+            cursor.execute(f"EXECUTE {nombre}")
+        return cursor
+
+    @staticmethod
+    def _filtros_particion(particion: Optional[Particion]) -> Tuple[List[str], List[Any]]:
+        """Condiciones SQL (solo las que aplican, para que el planificador use los índices)."""
+        filtros, parametros = [], []
+        if particion and particion.fuentes:
+            filtros.append("fuente = ANY(%s)")
+            parametros.append(list(particion.fuentes))
+        if particion and particion.desde:
+            filtros.append("fecha_fin >= %s")
+            parametros.append(particion.desde)
+        if particion and particion.hasta:
+            filtros.append("fecha_inicio <= %s")
+            parametros.append(particion.hasta)
+        return filtros, parametros
+
+    def insertar_fragmentos(self, filas: List[Dict[str, Any]]) -> int:
+        if not filas:
+            return 0
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for fila in filas:
+            writer.writerow([
+                fila["fuente"],
+                fila.get("chunk_id"),
+                fila["fragmento"],
+                _array_a_texto(fila.get("claves") or []),
+                fila.get("fecha_inicio"),
+                fila.get("fecha_fin"),
+                _vector_a_texto(fila["embedding"]),
+                json.dumps(fila.get("metadata") or {}, ensure_ascii=False, default=str),
+            ])
+        buffer.seek(0)
+        with self._conexion() as conn:
+            with conn.cursor() as cursor:
+                cursor.copy_expert(
+                    "COPY documentos_embeddings (fuente, chunk_id, fragmento, claves, fecha_inicio, fecha_fin, embedding, metadata) "
+                    "FROM STDIN WITH (FORMAT csv)",
+                    buffer,
+                )
+        return len(filas)
+
+    def buscar_similares(self, embedding: List[float], match_threshold: float, match_count: int,
+                         particion: Optional[Particion] = None) -> List[Dict]:
+        vector = _vector_a_texto(embedding)
+        with self._conexion() as conn:
+            if not particion:
+                cursor = self._ejecutar_preparada(conn, "match_documentos_stmt", (vector, match_threshold, match_count))
+                return [dict(fila) for fila in cursor.fetchall()]
+            # Con partición el SQL se arma con los filtros presentes: el índice
+            # (fuente, fecha_inicio, fecha_fin) acota las filas antes de calcular distancias
+            filtros, parametros = self._filtros_particion(particion)
+            with conn.cursor(cursor_factory=self._dict_cursor) as cursor:
+                cursor.execute(
+                    "SELECT id, fragmento, fuente, 1 - (embedding <=> %s::vector) AS similarity "
+                    f"FROM documentos_embeddings WHERE {' AND '.join(filtros)} "
+                    "AND 1 - (embedding <=> %s::vector) > %s "
+                    "ORDER BY embedding <=> %s::vector LIMIT %s",
+                    (vector, *parametros, vector, match_threshold, vector, match_count),
+                )
+                return [dict(fila) for fila in cursor.fetchall()]
+
+    def buscar_por_texto(self, condiciones: List[Tuple[str, str]], limite: int = 10,
+                         particion: Optional[Particion] = None) -> List[Dict]:
+        filtros, parametros = self._filtros_particion(particion)
+        for columna, valor in condiciones:
+            if columna not in COLUMNAS_TEXTO:
+                raise ValueError(f"Columna no permitida para búsqueda de texto: {columna}")
+            filtros.append(f"{columna} ILIKE %s")
+            parametros.append(f"%{valor}%")
+        where = " WHERE " + " AND ".join(filtros) if filtros else ""
+        with self._conexion() as conn:
+            with conn.cursor(cursor_factory=self._dict_cursor) as cursor:
+                cursor.execute(f"SELECT fragmento, fuente FROM documentos_embeddings{where} LIMIT %s", (*parametros, limite))
+                return [dict(fila) for fila in cursor.fetchall()]
+
+    def buscar_por_claves(self, claves: List[str], limite: int = 10,
+                          particion: Optional[Particion] = None) -> List[Dict]:
+        with self._conexion() as conn:
+            if not particion:
+                cursor = self._ejecutar_preparada(conn, "claves_stmt", (list(claves), limite))
+                return [dict(fila) for fila in cursor.fetchall()]
+            filtros, parametros = self._filtros_particion(particion)
+            with conn.cursor(cursor_factory=self._dict_cursor) as cursor:
+                cursor.execute(
+                    f"SELECT fragmento, fuente FROM documentos_embeddings WHERE claves @> %s AND {' AND '.join(filtros)} LIMIT %s",
+                    (list(claves), *parametros, limite),
+                )
+                return [dict(fila) for fila in cursor.fetchall()]
+
+    def listar_fuentes(self) -> List[str]:
+        with self._conexion() as conn:
+            return [fila["fuente"] for fila in self._ejecutar_preparada(conn, "fuentes_stmt").fetchall()]
+
+    def contar_fragmentos(self, filtro: Optional[str] = None) -> int:
+        sql, parametros = "SELECT count(*) FROM documentos_embeddings", ()
+        if filtro:
+            sql, parametros = sql + " WHERE fragmento ILIKE %s", (f"%{filtro}%",)
+        with self._conexion() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, parametros)
+                return cursor.fetchone()[0]
+
+    def contar_por_claves(self, claves: List[str]) -> int:
+        with self._conexion() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM documentos_embeddings WHERE claves @> %s", (list(claves),))
+                return cursor.fetchone()[0]
+
+    def seleccionar_fragmentos(self, filtro: Optional[str] = None, limite: int = 10) -> List[Dict]:
+        sql, parametros = "SELECT fragmento FROM documentos_embeddings", ()
+        if filtro:
+            sql, parametros = sql + " WHERE fragmento ILIKE %s", (f"%{filtro}%",)
+        with self._conexion() as conn:
+            with conn.cursor(cursor_factory=self._dict_cursor) as cursor:
+                cursor.execute(sql + " LIMIT %s", (*parametros, limite))
+                return [dict(fila) for fila in cursor.fetchall()]
+
+    def llamar_funcion(self, nombre: str, parametros: Dict[str, Any]) -> Any:
+        if not nombre.isidentifier():
+            raise ValueError(f"Nombre de función inválido: {nombre}")
+        argumentos = ", ".join(f"{clave} => %({clave})s" for clave in parametros)
+        valores = {
+            clave: json.dumps(valor) if isinstance(valor, dict) else valor
+            for clave, valor in parametros.items()
+        }
+        with self._conexion() as conn:
+            with conn.cursor(cursor_factory=self._dict_cursor) as cursor:
+                cursor.execute(f"SELECT * FROM {nombre}({argumentos})", valores)
+                filas = [dict(fila) for fila in cursor.fetchall()]
+                # Igual que PostgREST: una función escalar devuelve su valor, no una tabla
+                columnas = [c.name for c in cursor.description]
+                if columnas == [nombre] and len(filas) == 1:
+                    return filas[0][nombre]
+                return filas
+
+    def ultima_version(self) -> int:
+        with self._conexion() as conn:
+            return self._ejecutar_preparada(conn, "ultima_version_stmt").fetchone()["id"]
+
+    def reemplazar_rollups(self, fuente: str, filas: List[Dict[str, Any]]) -> None:
+        from psycopg2.extras import execute_values
+
+        columnas = ('fuente', 'dimension', 'clave', 'valor', 'viajes', 'kilos', 'filas_con_kilos', 'primera_fecha', 'ultima_fecha')
+        with self._conexion() as conn:
+            with conn.cursor() as cursor:
+                # Borrado e inserción en la misma transacción: las lecturas nunca ven la fuente vacía
+                cursor.execute("DELETE FROM rollups_entidad WHERE fuente = %s", (fuente,))
+                execute_values(
+                    cursor,
+                    f"INSERT INTO rollups_entidad ({', '.join(columnas)}) VALUES %s",
+                    [tuple(fila[c] for c in columnas) for fila in filas],
+                    page_size=1000,
+                )
+
+    def buscar_rollups(self, claves: List[str]) -> List[Dict]:
+        if not claves:
+            return []
+        with self._conexion() as conn:
+            cursor = self._ejecutar_preparada(conn, "rollups_stmt", (list(claves),))
+            return [dict(fila) for fila in cursor.fetchall()]
+
+    def reemplazar_perfiles(self, fuente: str, filas: List[Dict[str, Any]]) -> None:
+        from psycopg2.extras import execute_values
+
+        columnas = ('fuente', 'tipo', 'clave', 'valor', 'viajes', 'kilos', 'primera_fecha', 'ultima_fecha', 'relaciones')
+        with self._conexion() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM perfiles_entidad WHERE fuente = %s", (fuente,))
+                execute_values(
+                    cursor,
+                    f"INSERT INTO perfiles_entidad ({', '.join(columnas)}) VALUES %s",
+                    [
+                        tuple(json.dumps(fila[c], ensure_ascii=False) if c == 'relaciones' else fila[c] for c in columnas)
+                        for fila in filas
+                    ],
+                    page_size=1000,
+                )
+
+    def buscar_perfiles(self, claves: List[str]) -> List[Dict]:
+        if not claves:
+            return []
+        with self._conexion() as conn:
+            cursor = self._ejecutar_preparada(conn, "perfiles_stmt", (list(claves),))
+            return [dict(fila) for fila in cursor.fetchall()]
+
+    def obtener_historial(self, user_id: str, limite: int = 10) -> List[Dict]:
+        with self._conexion() as conn:
+            cursor = self._ejecutar_preparada(conn, "historial_stmt", (user_id, limite))
+            return [dict(fila) for fila in cursor.fetchall()]
+
+    def guardar_historial(self, user_id: str, mensajes: List[Dict[str, str]]) -> None:
+        with self._conexion() as conn:
+            for mensaje in mensajes:
+                self._ejecutar_preparada(conn, "guardar_historial_stmt", (user_id, mensaje["rol"], mensaje["contenido"]))
+
+    def obtener_estado_conversacion(self, user_id: str) -> Optional[Dict]:
+        with self._conexion() as conn:
+            fila = self._ejecutar_preparada(conn, "estado_stmt", (user_id,)).fetchone()
+            return dict(fila) if fila else None
+
+    def guardar_estado_conversacion(self, user_id: str, estado: Dict[str, Any]) -> None:
+        with self._conexion() as conn:
+            self._ejecutar_preparada(conn, "guardar_estado_stmt", (
+                user_id,
+                json.dumps(estado["entidades"], ensure_ascii=False),
+                json.dumps(estado["resumen"], ensure_ascii=False),
+            ))
+
+
+_BACKENDS = {
+    "supabase": SupabaseStore,
+    "postgres": PostgresStore,
+}
+
+_store: Optional[VectorStore] = None
+_store_lock = threading.Lock()
+
+
+def crear_vector_store(backend: Optional[str] = None) -> VectorStore:
+    """Crea una instancia nueva del backend indicado (o del configurado)."""
+    backend = (backend or config.VECTOR_STORE_BACKEND).lower()
+    if backend not in _BACKENDS:
+        raise ValueError(f"Backend de almacenamiento desconocido: {backend}. Opciones: {', '.join(_BACKENDS)}")
+    logger.info(f"Usando backend de almacenamiento '{backend}'.")
+    return _BACKENDS[backend]()
+
+
+def obtener_vector_store() -> VectorStore:
+    """Devuelve la instancia compartida del backend configurado."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = crear_vector_store()
+        return _store
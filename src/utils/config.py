@@ -0,0 +1,83 @@
+"""
+Configuración centralizada del proyecto.
+
+Lee los parámetros desde variables de entorno (o desde un archivo `.env`)
+y define valores por defecto razonables para el despliegue en Render.
+"""
+import os
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+
+def _env_int(nombre: str, defecto: int) -> int:
+    """Lee una variable de entorno entera, usando el valor por defecto si no es válida."""
+    try:
+        return int(os.getenv(nombre, defecto))
+    except (TypeError, ValueError):
+        return defecto
+
+
+def _env_float(nombre: str, defecto: float) -> float:
+    """Lee una variable de entorno decimal, usando el valor por defecto si no es válida."""
+    try:
+        return float(os.getenv(nombre, defecto))
+    except (TypeError, ValueError):
+        return defecto
+
+
+# --- WhatsApp Cloud API ---
+WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
+WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+WHATSAPP_VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN")
+WHATSAPP_APP_SECRET = os.getenv("WHATSAPP_APP_SECRET")
+WHATSAPP_API_VERSION = os.getenv("WHATSAPP_API_VERSION", "v18.0")
+
+# Cola de procesamiento del webhook
+WHATSAPP_MAX_COLA = _env_int("WHATSAPP_MAX_COLA", 100)
+WHATSAPP_WORKERS = _env_int("WHATSAPP_WORKERS", 4)
+# Segundos de silencio que se esperan antes de agrupar los mensajes de un remitente
+WHATSAPP_VENTANA_DEBOUNCE = _env_float("WHATSAPP_VENTANA_DEBOUNCE", 2.0)
+# Tiempo máximo que una ráfaga puede retrasarse, aunque el remitente siga escribiendo
+WHATSAPP_ESPERA_MAXIMA = _env_float("WHATSAPP_ESPERA_MAXIMA", 8.0)
+
+# --- Google Gemini: gobernador de concurrencia y reintentos ---
+# Límite inicial y rango del límite de llamadas concurrentes por modelo
+GEMINI_CONCURRENCIA_INICIAL = _env_int("GEMINI_CONCURRENCIA_INICIAL", 4)
+GEMINI_CONCURRENCIA_MIN = _env_int("GEMINI_CONCURRENCIA_MIN", 1)
+GEMINI_CONCURRENCIA_MAX = _env_int("GEMINI_CONCURRENCIA_MAX", 16)
+# Latencia (segundos) por encima de la cual se reduce el límite
+GEMINI_LATENCIA_OBJETIVO = _env_float("GEMINI_LATENCIA_OBJETIVO", 15.0)
+# Fracción del límite que pueden ocupar los trabajos de ingesta
+GEMINI_FRACCION_INGESTA = _env_float("GEMINI_FRACCION_INGESTA", 0.5)
+# Ritmo máximo de llamadas de ingesta por modelo (llamadas por segundo, 0 = sin tope)
+# y cuántas pueden salir seguidas tras un rato sin llamadas
+GEMINI_INGESTA_POR_SEGUNDO = _env_float("GEMINI_INGESTA_POR_SEGUNDO", 5.0)
+GEMINI_INGESTA_RAFAGA = _env_int("GEMINI_INGESTA_RAFAGA", 10)
+GEMINI_MAX_REINTENTOS = _env_int("GEMINI_MAX_REINTENTOS", 4)
+GEMINI_BACKOFF_BASE = _env_float("GEMINI_BACKOFF_BASE", 0.5)
+GEMINI_BACKOFF_MAX = _env_float("GEMINI_BACKOFF_MAX", 8.0)
+# Plazo total (segundos) de una petición, incluyendo esperas y reintentos
+GEMINI_DEADLINE = _env_float("GEMINI_DEADLINE", 60.0)
+GEMINI_DEADLINE_INGESTA = _env_float("GEMINI_DEADLINE_INGESTA", 120.0)
+
+# --- Almacenamiento vectorial ---
+# Backend de almacenamiento: "supabase" (PostgREST) o "postgres" (conexión directa)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "supabase").lower()
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+# Cadena de conexión directa a Postgres. Con Supabase usar la conexión directa o
+# el pooler en modo sesión (puerto 5432): en modo transacción (puerto 6543) las
+# sentencias preparadas no se conservan entre transacciones y hay que volver a
+# prepararlas (ver `PostgresStore._ejecutar_preparada`).
+DATABASE_URL = os.getenv("DATABASE_URL")
+POSTGRES_POOL_MIN = _env_int("POSTGRES_POOL_MIN", 1)
+POSTGRES_POOL_MAX = _env_int("POSTGRES_POOL_MAX", 10)
+
+# --- Memoria de conversación ---
+# Tope (en tokens estimados) del estado de conversación que se inyecta en los prompts
+CONVERSACION_MAX_TOKENS = _env_int("CONVERSACION_MAX_TOKENS", 400)
+# Documentos del último turno que se reutilizan en preguntas de seguimiento
+SESION_CONTEXTO_TTL = _env_float("SESION_CONTEXTO_TTL", 900.0)
+SESION_MAX_CONTEXTOS = _env_int("SESION_MAX_CONTEXTOS", 1000)
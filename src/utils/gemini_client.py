@@ -0,0 +1,298 @@
+"""
+Capa compartida de acceso a Google Gemini.
+
+Todas las llamadas a Gemini (generación y embeddings) pasan por `cliente_gemini`,
+que aplica por modelo:
+- Un límite de concurrencia adaptativo (AIMD): crece de a poco mientras las
+  llamadas responden bien y se reduce a la mitad ante un 429 o con latencias
+  por encima del objetivo.
+- Reintentos con backoff exponencial y jitter para errores transitorios.
+- Un plazo (deadline) total por petición.
+- Prioridad para el tráfico de la API: la ingesta solo puede usar una fracción
+  del límite y cede el turno cuando hay peticiones de la API esperando.
+- Un ritmo máximo (token bucket) para la ingesta, que no depende de los 429.
+- Contadores de llamadas, reintentos, throttling y errores.
+
+El límite y la prioridad son por proceso. En el despliegue de `render.yaml` la
+API y el worker de ingesta son servicios distintos, cada uno con su propio
+limitador, así que la prioridad API/ingesta no actúa entre ellos: comparten la
+cuota de Gemini y solo se coordinan a través de los 429. Por eso la ingesta
+tiene además un ritmo fijo (`GEMINI_INGESTA_POR_SEGUNDO`) que deja margen a la
+API sin esperar a que la cuota se agote.
+"""
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from src.utils import config
+
+logger = logging.getLogger(__name__)
+
+PRIORIDAD_API = "api"
+PRIORIDAD_INGESTA = "ingesta"
+
+# Errores transitorios que vale la pena reintentar
+_ERRORES_REINTENTABLES = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+)
+
+
+class GeminiError(Exception):
+    """
+    Error de una llamada a Gemini. `reintentable` indica si el fallo es
+    transitorio (saturación, plazo agotado, error del servidor) y tiene sentido
+    que el cliente reintente; los errores permanentes (argumento inválido,
+    permisos, clave de API) no lo son.
+    """
+    def __init__(self, mensaje: str, throttled: bool = False, reintentable: bool = False):
+        super().__init__(mensaje)
+        self.throttled = throttled
+        self.reintentable = reintentable or throttled
+
+
+def _es_throttle(error: Exception) -> bool:
+    return isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests))
+
+
+class LimitadorAdaptativo:
+    """
+    Límite de concurrencia AIMD para un modelo, seguro entre hilos.
+    """
+    def __init__(
+        self,
+        inicial: int,
+        minimo: int,
+        maximo: int,
+        latencia_objetivo: float,
+        fraccion_ingesta: float,
+    ):
+        self.limite = float(inicial)
+        self.minimo = minimo
+        self.maximo = maximo
+        self.latencia_objetivo = latencia_objetivo
+        self.fraccion_ingesta = fraccion_ingesta
+        self.en_vuelo = 0
+        self._esperando_api = 0
+        self._ultima_reduccion = 0.0
+        self._condicion = threading.Condition()
+
+    def _cupo(self, prioridad: str) -> int:
+        if prioridad == PRIORIDAD_INGESTA:
+            return max(1, int(self.limite * self.fraccion_ingesta))
+        return max(1, int(self.limite))
+
+    def _puede_entrar(self, prioridad: str) -> bool:
+        if prioridad == PRIORIDAD_INGESTA and self._esperando_api:
+            return False
+        return self.en_vuelo < self._cupo(prioridad)
+
+    def adquirir(self, prioridad: str, deadline: float) -> bool:
+        """Espera un cupo libre hasta `deadline`. Devuelve False si se agota el plazo."""
+        with self._condicion:
+            es_api = prioridad != PRIORIDAD_INGESTA
+            if es_api:
+                self._esperando_api += 1
+            try:
+                while not self._puede_entrar(prioridad):
+                    restante = deadline - time.monotonic()
+                    if restante <= 0:
+                        return False
+                    self._condicion.wait(restante)
+                self.en_vuelo += 1
+                return True
+            finally:
+                if es_api:
+                    self._esperando_api -= 1
+
+    def liberar(self, latencia: float, throttled: bool = False, exito: bool = True) -> None:
+        """
+        Libera el cupo y ajusta el límite según el resultado de la llamada. Solo
+        las llamadas exitosas hacen crecer el límite.
+        """
+        with self._condicion:
+            self.en_vuelo -= 1
+            ahora = time.monotonic()
+            if throttled or latencia > self.latencia_objetivo:
+                # Decremento multiplicativo, como mucho una vez por segundo para que
+                # una ráfaga de 429 simultáneos no colapse el límite al mínimo.
+                if ahora - self._ultima_reduccion >= 1.0:
+                    self.limite = max(self.minimo, self.limite / 2)
+                    self._ultima_reduccion = ahora
+            elif exito:
+                # Incremento aditivo: aproximadamente +1 por cada "ventana" completa
+                self.limite = min(self.maximo, self.limite + 1 / self.limite)
+            self._condicion.notify_all()
+
+
+class RitmoIngesta:
+    """
+    Token bucket: como mucho `por_segundo` llamadas por segundo en promedio, con
+    ráfagas de hasta `rafaga`. Seguro entre hilos.
+    """
+    def __init__(self, por_segundo: float, rafaga: int):
+        self.por_segundo = por_segundo
+        self.rafaga = max(1, rafaga)
+        self._fichas = float(self.rafaga)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def esperar(self, deadline: float) -> bool:
+        """Espera una ficha hasta `deadline`. Devuelve False si se agota el plazo."""
+        if self.por_segundo <= 0:
+            return True
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._fichas = min(self.rafaga, self._fichas + (ahora - self._ultimo) * self.por_segundo)
+                self._ultimo = ahora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return True
+                espera = (1 - self._fichas) / self.por_segundo
+            if ahora + espera >= deadline:
+                return False
+            time.sleep(espera)
+
+
+class ClienteGemini:
+    """
+    Punto único de acceso a Gemini con límites adaptativos, reintentos y plazos.
+    """
+    def __init__(self):
+        self._limitadores: Dict[str, LimitadorAdaptativo] = {}
+        self._ritmos_ingesta: Dict[str, RitmoIngesta] = {}
+        self._contadores: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _limitador(self, modelo: str) -> LimitadorAdaptativo:
+        with self._lock:
+            if modelo not in self._limitadores:
+                self._limitadores[modelo] = LimitadorAdaptativo(
+                    inicial=config.GEMINI_CONCURRENCIA_INICIAL,
+                    minimo=config.GEMINI_CONCURRENCIA_MIN,
+                    maximo=config.GEMINI_CONCURRENCIA_MAX,
+                    latencia_objetivo=config.GEMINI_LATENCIA_OBJETIVO,
+                    fraccion_ingesta=config.GEMINI_FRACCION_INGESTA,
+                )
+                self._ritmos_ingesta[modelo] = RitmoIngesta(config.GEMINI_INGESTA_POR_SEGUNDO, config.GEMINI_INGESTA_RAFAGA)
+                self._contadores[modelo] = {
+                    "llamadas": 0, "exitos": 0, "reintentos": 0, "throttled": 0,
+                    "errores": 0, "plazos_agotados": 0, "latencia_total": 0.0,
+                }
+            return self._limitadores[modelo]
+
+    def _contar(self, modelo: str, campo: str, valor: float = 1) -> None:
+        with self._lock:
+            self._contadores[modelo][campo] += valor
+
+    def _llamar(self, modelo: str, funcion, prioridad: str, timeout: Optional[float]):
+        """Ejecuta `funcion(request_options)` aplicando límite, reintentos y plazo."""
+        limitador = self._limitador(modelo)
+        if timeout is None:
+            timeout = config.GEMINI_DEADLINE_INGESTA if prioridad == PRIORIDAD_INGESTA else config.GEMINI_DEADLINE
+        deadline = time.monotonic() + timeout
+        self._contar(modelo, "llamadas")
+
+        intento = 0
+        while True:
+            if prioridad == PRIORIDAD_INGESTA and not self._ritmos_ingesta[modelo].esperar(deadline):
+                self._contar(modelo, "plazos_agotados")
+                raise GeminiError(f"Plazo agotado esperando el ritmo de ingesta de {modelo}.", throttled=True)
+            if not limitador.adquirir(prioridad, deadline):
+                self._contar(modelo, "plazos_agotados")
+                raise GeminiError(f"Plazo agotado esperando cupo para {modelo}.", throttled=True)
+
+            inicio = time.monotonic()
+            try:
+                resultado = funcion({"timeout": max(1.0, deadline - inicio)})
+            except Exception as e:
+                latencia = time.monotonic() - inicio
+                throttled = _es_throttle(e)
+                limitador.liberar(latencia, throttled=throttled, exito=False)
+                if throttled:
+                    self._contar(modelo, "throttled")
+
+                espera = random.uniform(0, min(config.GEMINI_BACKOFF_MAX, config.GEMINI_BACKOFF_BASE * 2 ** intento))
+                reintentable = isinstance(e, _ERRORES_REINTENTABLES)
+                if not reintentable or intento >= config.GEMINI_MAX_REINTENTOS or time.monotonic() + espera >= deadline:
+                    self._contar(modelo, "errores")
+                    logger.error(f"Error en llamada a {modelo} tras {intento + 1} intento(s): {e}")
+                    raise GeminiError(f"Error al llamar a {modelo}: {e}", throttled=throttled, reintentable=reintentable) from e
+
+                intento += 1
+                self._contar(modelo, "reintentos")
+                logger.warning(f"Error transitorio en {modelo} ({e}); reintento {intento} en {espera:.2f}s")
+                time.sleep(espera)
+                continue
+
+            latencia = time.monotonic() - inicio
+            limitador.liberar(latencia)
+            self._contar(modelo, "exitos")
+            self._contar(modelo, "latencia_total", latencia)
+            return resultado
+
+    def generate_content(
+        self,
+        modelo: genai.GenerativeModel,
+        prompt: Any,
+        prioridad: str = PRIORIDAD_API,
+        timeout: Optional[float] = None,
+    ):
+        """Equivalente a `modelo.generate_content(prompt)` bajo el gobernador."""
+        return self._llamar(
+            modelo.model_name,
+            lambda opciones: modelo.generate_content(prompt, request_options=opciones),
+            prioridad,
+            timeout,
+        )
+
+    def embed_content(
+        self,
+        modelo: str,
+        contenido: str,
+        task_type: str,
+        prioridad: str = PRIORIDAD_API,
+        timeout: Optional[float] = None,
+    ) -> List[float]:
+        """Crea un embedding con `genai.embed_content` bajo el gobernador."""
+        resultado = self._llamar(
+            modelo,
+            lambda opciones: genai.embed_content(
+                model=modelo,
+                content=contenido,
+                task_type=task_type,
+                request_options=opciones,
+            ),
+            prioridad,
+            timeout,
+        )
+        return resultado['embedding']
+
+    def estadisticas(self) -> Dict[str, Dict[str, float]]:
+        """Contadores y estado del límite de cada modelo, para monitoreo."""
+        with self._lock:
+            datos = {}
+            for modelo, contadores in self._contadores.items():
+                limitador = self._limitadores[modelo]
+                exitos = contadores["exitos"]
+                datos[modelo] = {
+                    **{k: v for k, v in contadores.items() if k != "latencia_total"},
+                    "latencia_media": round(contadores["latencia_total"] / exitos, 3) if exitos else None,
+                    "limite": round(limitador.limite, 2),
+                    "en_vuelo": limitador.en_vuelo,
+                }
+            return datos
+
+
+# Instancia compartida por la API, el retriever, el generador y la ingesta
+cliente_gemini = ClienteGemini()
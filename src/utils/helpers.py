@@ -1,6 +1,8 @@
 """
 Funciones de ayuda y utilidades para el proyecto.
 """
+import re
+import unicodedata
 from typing import List
 from langchain_core.documents import Document
 
@@ -20,3 +22,28 @@ def documents_to_string(documents: List[Document]) -> str:
         formatted_docs.append(f"Fuente: {source}\nContenido: {content}\n---")
         
     return "\n".join(formatted_docs)
+
+
+def normalizar_consulta(query: str) -> str:
+    """
+    Normaliza el texto de una consulta para compararla con otras: unifica la
+    representación Unicode, pasa a minúsculas, colapsa espacios y elimina los
+    signos de puntuación de los extremos.
+    """
+    texto = unicodedata.normalize("NFKC", query).lower()
+    texto = re.sub(r"\s+", " ", texto)
+    return texto.strip(" ¿?¡!.,;:")
+
+
+def to_serializable(data):
+    """
+    Convierte de forma recursiva los datos de respuesta de Supabase o Gemini,
+    incluyendo objetos anidados MapComposite, a un formato serializable por JSON.
+    """
+    if data is None:
+        return None
+    if isinstance(data, list):
+        return [to_serializable(item) for item in data]
+    if hasattr(data, 'keys'): # Trata objetos dict-like como MapComposite
+        return {key: to_serializable(value) for key, value in data.items()}
+    return data
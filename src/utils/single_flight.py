@@ -0,0 +1,51 @@
+"""
+Deduplicación de llamadas concurrentes idénticas ("single-flight").
+
+Cuando varios hilos piden el mismo resultado al mismo tiempo, solo el primero
+ejecuta la función; el resto espera y recibe el mismo resultado (o la misma
+excepción). Una vez terminada la llamada, la siguiente petición con la misma
+clave vuelve a ejecutarse: no es una caché.
+"""
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes que comparten la misma clave en una sola ejecución.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_vuelo: Dict[Hashable, Future] = {}
+        self.estadisticas = {"ejecuciones": 0, "compartidas": 0}
+
+    def do(self, clave: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Ejecuta `fn(*args, **kwargs)` o, si ya hay una ejecución en curso para
+        `clave`, espera su resultado.
+        """
+        with self._lock:
+            futuro = self._en_vuelo.get(clave)
+            lider = futuro is None
+            if lider:
+                futuro = Future()
+                self._en_vuelo[clave] = futuro
+                self.estadisticas["ejecuciones"] += 1
+            else:
+                self.estadisticas["compartidas"] += 1
+
+        if not lider:
+            return futuro.result()
+
+        try:
+            resultado = fn(*args, **kwargs)
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado
+        finally:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Permite importar el paquete `src` al ejecutar pytest desde cualquier directorio
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Credenciales de prueba para importar `src.api.endpoints` sin un .env: los
+# clientes se crean al importar pero no se conectan hasta la primera llamada
+os.environ.setdefault("GOOGLE_API_KEY", "prueba")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.prueba")
@@ -0,0 +1,74 @@
+"""
+Pruebas de la reutilización del contexto recuperado entre turnos de una sesión.
+"""
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.documents import Document
+
+from src.api import endpoints
+from src.rag_engine.contexto_sesion import ContextoSesiones
+
+DOCUMENTOS = [Document(page_content="Tracto: T209 | Conductor: Luis Angulo", metadata={'source': 'viajes.xlsx', 'id': 1})]
+
+
+def test_reutiliza_solo_sin_entidades_nuevas():
+    sesiones = ContextoSesiones(max_sesiones=10, ttl=60)
+    sesiones.guardar("s1", DOCUMENTOS, frozenset({"tracto:T209"}))
+    assert sesiones.obtener("s1", frozenset()) == (DOCUMENTOS, frozenset({"tracto:T209"}))
+    assert sesiones.obtener("s1", frozenset({"tracto:T209"})) is not None
+    assert sesiones.obtener("s1", frozenset({"tracto:T310"})) is None
+
+
+def test_no_reutiliza_un_turno_sin_entidades():
+    sesiones = ContextoSesiones(max_sesiones=10, ttl=60)
+    sesiones.guardar("s1", DOCUMENTOS, frozenset())
+    assert sesiones.obtener("s1", frozenset()) is None
+    assert sesiones.estadisticas == {"reutilizados": 0, "renovados": 1}
+
+
+def _respuesta(texto="", llamada=None):
+    partes = [SimpleNamespace(function_call=llamada)] if llamada else []
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=partes))], text=texto)
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Gemini falso: la primera respuesta decide si hay llamada a función."""
+    llamadas = {"retrieve_context": 0, "consultar_bd": []}
+
+    def _configurar(llamada=None):
+        respuestas = iter([_respuesta(llamada=llamada), _respuesta("refinada")])
+        monkeypatch.setattr(endpoints.cliente_gemini, "generate_content", lambda modelo, prompt: next(respuestas))
+        return llamadas
+
+    def retrieve_context(query):
+        llamadas["retrieve_context"] += 1
+        return []
+
+    def consultar_bd(**argumentos):
+        llamadas["consultar_bd"].append(argumentos)
+        return 3
+
+    monkeypatch.setattr(endpoints, "retriever", SimpleNamespace(retrieve_context=retrieve_context))
+    monkeypatch.setattr(endpoints, "consultar_bd", consultar_bd)
+    monkeypatch.setattr(endpoints, "generate_response", lambda query, contexto, historial: f"RAG:{contexto[:10]}")
+    return _configurar
+
+
+def test_seguimiento_usa_los_documentos_de_la_sesion_en_lugar_de_recuperar(gemini):
+    llamadas = gemini()
+    respuesta, documentos, contexto = endpoints._responder("¿y de qué cliente es?", "historial", DOCUMENTOS)
+    assert respuesta.startswith("RAG:")
+    assert documentos == DOCUMENTOS
+    assert llamadas["retrieve_context"] == 0
+
+
+def test_seguimiento_mantiene_la_decision_de_function_calling(gemini):
+    llamada = SimpleNamespace(name="consultar_bd", args={"operacion": "COUNT", "filtro_fragmento": "T209"})
+    llamadas = gemini(llamada)
+    respuesta, documentos, contexto = endpoints._responder("¿cuántos viajes hizo?", "historial", DOCUMENTOS)
+    assert respuesta == "refinada"
+    assert documentos is None
+    assert llamadas["consultar_bd"][0]["operacion"] == "COUNT"
+    assert llamadas["retrieve_context"] == 0
@@ -0,0 +1,28 @@
+"""
+Pruebas del estado compacto de la conversación.
+"""
+from src.rag_engine.conversacion import actualizar_estado, entidades_mencionadas, estado_a_texto
+
+
+def test_entidades_de_perfiles_de_la_pregunta_y_formato_de_la_respuesta():
+    filas_perfil = [
+        {'tipo': 'conductor', 'clave': 'JUAN', 'valor': 'Juan'},
+        {'tipo': 'conductor', 'clave': 'JUAN PEREZ', 'valor': 'Juan Pérez'},
+    ]
+    entidades = entidades_mencionadas(
+        filas_perfil,
+        "¿Qué tracto maneja Juan Pérez?",
+        "Juan Pérez conduce el T209 con el contenedor CSQU3054383 para el cliente GOODYEAR.",
+    )
+    # El cliente de la respuesta no se busca en los perfiles
+    assert entidades == {'conductor': 'Juan Pérez', 'tracto': 'T209', 'contenedor': 'CSQU3054383'}
+
+
+def test_estado_respeta_el_maximo_de_tokens():
+    estado = None
+    for i in range(30):
+        estado = actualizar_estado(estado, f"pregunta {i} " * 10, f"respuesta {i} " * 30, {'tracto': f'T{i:03d}'})
+    texto = estado_a_texto(estado, max_tokens=200)
+    assert len(texto) <= 800
+    assert "tracto: T029" in texto
+    assert "pregunta 29" in texto
@@ -0,0 +1,119 @@
+"""
+Pruebas de la normalización de identificadores (ISO 6346, RUT módulo 11).
+"""
+import pandas as pd
+
+from src.api import endpoints
+from src.data_processing.data_validators import (
+    canonizar_contenedores,
+    canonizar_fechas,
+    canonizar_ruts,
+    etiquetas_consulta,
+    normalizar_dataframe,
+    rangos_fecha_por_bloque,
+)
+from src.data_processing.rollups import AcumuladorRollups
+
+
+def test_contenedor_valida_digito_iso6346():
+    resultado = canonizar_contenedores(pd.Series(["CSQU3054383", "CSQU3054384", "csqu 305438-3", "CSQU305438"]))
+    assert resultado.tolist()[0] == "CSQU3054383"
+    assert pd.isna(resultado.iloc[1])
+    assert resultado.iloc[2] == "CSQU3054383"
+    # Sin dígito verificador se calcula
+    assert resultado.iloc[3] == "CSQU3054383"
+
+
+def test_contenedor_invalido_en_consulta():
+    assert etiquetas_consulta("estado del CSQU3054383") == ["contenedor:CSQU3054383"]
+    assert etiquetas_consulta("estado del CSQU3054384") == []
+
+
+def test_rut_valida_digito_modulo_11():
+    resultado = canonizar_ruts(pd.Series(["12.345.678-5", "12345678-4", "7654321-6", "7.654.321-k"]))
+    assert resultado.iloc[0] == "12345678-5"
+    assert pd.isna(resultado.iloc[1])
+    assert resultado.iloc[2] == "7654321-6"
+    assert pd.isna(resultado.iloc[3])
+
+
+def test_rut_digito_k_y_cero():
+    resultado = canonizar_ruts(pd.Series(["10000013-K", "10000004-0"]))
+    assert resultado.tolist() == ["10000013-K", "10000004-0"]
+
+
+def test_rut_en_consulta_exige_guion_o_digito_valido():
+    # Un número suelto no se completa con su dígito verificador
+    assert etiquetas_consulta("viajes del numero 12345678") == []
+    assert etiquetas_consulta("viajes del rut 12345678-5") == ["rut:12345678-5"]
+    assert etiquetas_consulta("viajes del rut 12.345.678-5") == ["rut:12345678-5"]
+    # Sin guion pero con dígito verificador consistente
+    assert etiquetas_consulta("viajes del rut 123456785") == ["rut:12345678-5"]
+
+
+class StoreConteo:
+    def __init__(self, por_claves=3):
+        self.llamadas = []
+        self.por_claves = por_claves
+
+    def buscar_rollups(self, claves):
+        return []
+
+    def contar_por_claves(self, claves):
+        self.llamadas.append(("claves", claves))
+        return self.por_claves
+
+    def contar_fragmentos(self, filtro=None):
+        self.llamadas.append(("ilike", filtro))
+        return 7
+
+
+def test_count_por_identificador_usa_claves(monkeypatch):
+    store = StoreConteo()
+    monkeypatch.setattr(endpoints, "store", store)
+    assert endpoints._ejecutar_consulta_bd("COUNT", filtro_fragmento="CSQU3054383")['fragmentos'] == 3
+    assert endpoints._ejecutar_consulta_bd("COUNT", filtro_fragmento="GOODYEAR")['fragmentos'] == 7
+    assert store.llamadas == [("claves", ["contenedor:CSQU3054383"]), ("ilike", "GOODYEAR")]
+
+
+def test_count_sin_filas_con_claves_usa_ilike(monkeypatch):
+    # Filas ingeridas antes de la columna `claves` (claves = '{}')
+    store = StoreConteo(por_claves=0)
+    monkeypatch.setattr(endpoints, "store", store)
+    assert endpoints._ejecutar_consulta_bd("COUNT", filtro_fragmento="CSQU3054383")['fragmentos'] == 7
+    assert store.llamadas == [("claves", ["contenedor:CSQU3054383"]), ("ilike", "CSQU3054383")]
+
+
+def test_fecha_de_claves_rollups_y_rangos_sale_de_la_misma_columna():
+    df = pd.DataFrame({
+        'ETA/EDT': ['2025-06-30', '2025-07-01'],
+        'Fecha': ['2025-03-01', '2025-03-02'],
+        'Fecha Viaje': ['2025-03-10', '2025-03-11'],
+        'Tracto': ['T209', 'T209'],
+    })
+    claves = normalizar_dataframe(df)
+    assert claves['clave_fecha'].tolist() == ['2025-03-10', '2025-03-11']
+    assert rangos_fecha_por_bloque(claves, 10) == [('2025-03-10', '2025-03-11')]
+
+    acumulador = AcumuladorRollups()
+    acumulador.agregar(df)
+    fila = next(f for f in acumulador.filas("viajes.xlsx") if f['dimension'] == 'tracto')
+    assert (fila['primera_fecha'], fila['ultima_fecha']) == ('2025-03-10', '2025-03-11')
+
+
+def test_rut_de_columna_entera_con_vacios():
+    # Una columna de RUTs enteros con vacíos llega como float (12345678.0)
+    resultado = canonizar_ruts(pd.Series([12345678.0, float('nan'), 7654321.0, 123456785.0]))
+    assert resultado.iloc[0] == "12345678-5"
+    assert pd.isna(resultado.iloc[1])
+    assert resultado.iloc[2] == "7654321-6"
+    assert resultado.iloc[3] == "12345678-5"
+
+
+def test_fechas_numericas_son_seriales_de_excel():
+    assert canonizar_fechas(pd.Series([45000])).tolist() == ["2023-03-15"]
+    mixtas = canonizar_fechas(pd.Series(["2025-03-14", 45000.0, None, "15/03/2025"], dtype=object))
+    assert mixtas.iloc[0] == "2025-03-14"
+    assert mixtas.iloc[1] == "2023-03-15"
+    assert pd.isna(mixtas.iloc[2])
+    assert mixtas.iloc[3] == "2025-03-15"
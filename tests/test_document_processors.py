@@ -0,0 +1,119 @@
+"""
+Pruebas de los procesadores de documentos: reagrupación en lotes y detección
+del formato por extensión o por los bytes iniciales.
+"""
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+import pytest
+
+from src.data_processing.document_processors import (
+    ArrowIpcProcessor, CsvProcessor, DocumentProcessor, ExcelProcessor, ParquetProcessor, detectar_procesador,
+)
+
+
+class ProcesadorTrozos(DocumentProcessor):
+    """Entrega lotes de los tamaños indicados, como haría un lector por row groups."""
+    def __init__(self, tamanos):
+        self.tamanos = tamanos
+
+    def _leer(self, file_path, filas_por_lote):
+        inicio = 0
+        for tamano in self.tamanos:
+            yield pd.DataFrame({'fila': range(inicio, inicio + tamano)}, index=range(100 + inicio, 100 + inicio + tamano))
+            inicio += tamano
+
+
+def _filas(lotes):
+    return [lote['fila'].tolist() for lote in lotes]
+
+
+@pytest.mark.parametrize("tamanos, esperado", [
+    # trozos que cruzan los límites de lote, con un último lote parcial
+    ([3, 0, 4, 2], [[0, 1, 2, 3], [4, 5, 6, 7], [8]]),
+    # un trozo más grande que el lote se reparte en varios
+    ([10], [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]),
+    # trozos del tamaño exacto pasan sin concatenar
+    ([4, 4], [[0, 1, 2, 3], [4, 5, 6, 7]]),
+    ([1, 1, 1, 1], [[0, 1, 2, 3]]),
+    ([], []),
+])
+def test_iterar_lotes_reagrupa_entre_trozos(tamanos, esperado):
+    lotes = list(ProcesadorTrozos(tamanos).iterar_lotes("ignorado", 4))
+    assert _filas(lotes) == esperado
+    assert all(lote.index.tolist() == list(range(len(lote))) for lote in lotes)
+
+
+def _tabla(filas):
+    return pa.table({'tracto': [f"T{i}" for i in range(filas)], 'kilos': list(range(filas))})
+
+
+def test_parquet_con_row_groups_pequenos(tmp_path):
+    ruta = tmp_path / "viajes.parquet"
+    pq.write_table(_tabla(10), ruta, row_group_size=3)
+    lotes = list(ParquetProcessor().iterar_lotes(str(ruta), 4))
+    assert [len(lote) for lote in lotes] == [4, 4, 2]
+    assert pd.concat(lotes)['kilos'].tolist() == list(range(10))
+
+
+def test_arrow_ipc_con_varios_record_batches(tmp_path):
+    ruta = tmp_path / "viajes.arrow"
+    tabla = _tabla(7)
+    with ipc.new_file(str(ruta), tabla.schema) as escritor:
+        for batch in tabla.to_batches(max_chunksize=3):
+            escritor.write_batch(batch)
+    lotes = list(ArrowIpcProcessor().iterar_lotes(str(ruta), 5))
+    assert [len(lote) for lote in lotes] == [5, 2]
+    assert pd.concat(lotes)['tracto'].tolist() == [f"T{i}" for i in range(7)]
+
+
+@pytest.mark.parametrize("nombre, clase", [
+    ("viajes.xlsx", ExcelProcessor),
+    ("VIAJES.XLS", ExcelProcessor),
+    ("viajes.csv", CsvProcessor),
+    ("viajes.tsv", CsvProcessor),
+    ("viajes.parquet", ParquetProcessor),
+    ("viajes.pq", ParquetProcessor),
+    ("viajes.feather", ArrowIpcProcessor),
+    ("viajes.arrow", ArrowIpcProcessor),
+])
+def test_detecta_por_extension(tmp_path, nombre, clase):
+    # La extensión manda: no se lee el contenido
+    ruta = tmp_path / nombre
+    ruta.write_bytes(b"")
+    assert type(detectar_procesador(str(ruta))) is clase
+
+
+def test_detecta_por_firma_sin_extension(tmp_path):
+    parquet = tmp_path / "exportacion_parquet"
+    pq.write_table(_tabla(2), parquet)
+    assert type(detectar_procesador(str(parquet))) is ParquetProcessor
+
+    arrow = tmp_path / "exportacion_arrow"
+    with ipc.new_file(str(arrow), _tabla(2).schema) as escritor:
+        escritor.write_table(_tabla(2))
+    assert type(detectar_procesador(str(arrow))) is ArrowIpcProcessor
+
+    stream = tmp_path / "exportacion_stream"
+    with ipc.new_stream(str(stream), _tabla(2).schema) as escritor:
+        escritor.write_table(_tabla(2))
+    assert type(detectar_procesador(str(stream))) is ArrowIpcProcessor
+    assert len(next(ArrowIpcProcessor().iterar_lotes(str(stream), 10))) == 2
+
+    texto = tmp_path / "exportacion_texto"
+    texto.write_text("tracto;kilos\nT209;1000\n")
+    assert type(detectar_procesador(str(texto))) is CsvProcessor
+
+
+@pytest.mark.parametrize("separador", [";", ",", "\t", "|"])
+def test_csv_detecta_separador(tmp_path, separador):
+    ruta = tmp_path / "viajes.csv"
+    filas = ["tracto", "kilos", "destino"], ["T209", "1000", "SAN ANTONIO"], ["T210", "2000", "VALPARAÍSO"]
+    ruta.write_text("\n".join(separador.join(fila) for fila in filas) + "\n", encoding="latin-1")
+
+    procesador = CsvProcessor()
+    assert procesador._detectar_formato(str(ruta)) == ("latin-1", separador)
+    df = next(procesador.iterar_lotes(str(ruta), 10))
+    assert df.columns.tolist() == ["tracto", "kilos", "destino"]
+    assert df['destino'].tolist() == ["SAN ANTONIO", "VALPARAÍSO"]
@@ -0,0 +1,103 @@
+"""
+Pruebas del gobernador de llamadas a Gemini, sin contactar la API.
+"""
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from src.utils import gemini_client
+from src.utils.gemini_client import ClienteGemini, GeminiError, LimitadorAdaptativo, RitmoIngesta
+
+
+def _limitador(inicial=4):
+    return LimitadorAdaptativo(inicial=inicial, minimo=1, maximo=16, latencia_objetivo=15.0, fraccion_ingesta=0.5)
+
+
+def test_limite_crece_solo_con_llamadas_exitosas():
+    limitador = _limitador()
+    for _ in range(5):
+        assert limitador.adquirir("api", deadline=float("inf"))
+        limitador.liberar(0.1, exito=False)
+    assert limitador.limite == 4
+
+    assert limitador.adquirir("api", deadline=float("inf"))
+    limitador.liberar(0.1)
+    assert limitador.limite == pytest.approx(4.25)
+
+
+def test_throttle_reduce_el_limite():
+    limitador = _limitador(8)
+    assert limitador.adquirir("api", deadline=float("inf"))
+    limitador.liberar(0.1, throttled=True, exito=False)
+    assert limitador.limite == 4
+
+
+@pytest.fixture
+def sin_esperas(monkeypatch):
+    monkeypatch.setattr(gemini_client.time, "sleep", lambda _: None)
+    monkeypatch.setattr(gemini_client.config, "GEMINI_MAX_REINTENTOS", 2)
+
+
+def _llamada_que_falla(error):
+    llamadas = []
+
+    def funcion(opciones):
+        llamadas.append(opciones)
+        raise error
+    return funcion, llamadas
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.InvalidArgument("prompt inválido"),
+    google_exceptions.PermissionDenied("API key inválida"),
+])
+def test_error_permanente_no_se_reintenta_ni_es_reintentable(sin_esperas, error):
+    cliente = ClienteGemini()
+    funcion, llamadas = _llamada_que_falla(error)
+    with pytest.raises(GeminiError) as info:
+        cliente._llamar("modelo", funcion, "api", timeout=5)
+    assert not info.value.reintentable
+    assert len(llamadas) == 1
+    assert cliente._limitadores["modelo"].limite == 4
+
+
+@pytest.mark.parametrize("error, throttled", [
+    (google_exceptions.ServiceUnavailable("sobrecargado"), False),
+    (google_exceptions.ResourceExhausted("cuota"), True),
+])
+def test_error_transitorio_se_reintenta_y_es_reintentable(sin_esperas, error, throttled):
+    cliente = ClienteGemini()
+    funcion, llamadas = _llamada_que_falla(error)
+    with pytest.raises(GeminiError) as info:
+        cliente._llamar("modelo", funcion, "api", timeout=5)
+    assert info.value.reintentable
+    assert info.value.throttled == throttled
+    assert len(llamadas) == 3
+    assert cliente._limitadores["modelo"].limite <= 4
+
+
+def test_ritmo_de_ingesta_respeta_la_tasa(monkeypatch):
+    reloj = [100.0]
+    esperas = []
+
+    def dormir(segundos):
+        esperas.append(segundos)
+        reloj[0] += segundos
+
+    monkeypatch.setattr(gemini_client.time, "monotonic", lambda: reloj[0])
+    monkeypatch.setattr(gemini_client.time, "sleep", dormir)
+    ritmo = RitmoIngesta(por_segundo=2.0, rafaga=2)
+    for _ in range(4):
+        assert ritmo.esperar(deadline=float("inf"))
+    # Las dos primeras salen en ráfaga; las siguientes esperan 0.5 s cada una
+    assert esperas == [pytest.approx(0.5), pytest.approx(0.5)]
+    assert not ritmo.esperar(deadline=reloj[0] + 0.1)
+
+
+def test_ingesta_pasa_por_el_ritmo(monkeypatch):
+    cliente = ClienteGemini()
+    cliente._limitador("modelo")
+    fichas = []
+    monkeypatch.setattr(cliente._ritmos_ingesta["modelo"], "esperar", lambda deadline: fichas.append(deadline) or True)
+    cliente._llamar("modelo", lambda opciones: "ok", gemini_client.PRIORIDAD_INGESTA, timeout=5)
+    cliente._llamar("modelo", lambda opciones: "ok", gemini_client.PRIORIDAD_API, timeout=5)
+    assert len(fichas) == 1
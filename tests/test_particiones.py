@@ -0,0 +1,105 @@
+"""
+Pruebas de la partición por fuente y fechas: detección en la consulta y
+filtros que envía cada backend.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from src.rag_engine.retriever import SupabaseRetriever
+from src.rag_engine.vector_store import Particion, PostgresStore, SupabaseStore
+
+FUENTES = ["BD_Contenedores_Completo_2025.xlsx", "viajes.csv", "Despachos Sur.parquet"]
+
+
+@pytest.fixture
+def retriever():
+    retriever = SupabaseRetriever()
+    retriever.store = SimpleNamespace(listar_fuentes=lambda: FUENTES)
+    return retriever
+
+
+def test_detecta_fuente_y_rango_de_fechas(retriever):
+    particion = retriever.particion_consulta("¿Cuántos viajes hay en BD Contenedores Completo 2025 en marzo de 2025?")
+    assert particion == Particion(
+        fuentes=("BD_Contenedores_Completo_2025.xlsx",), desde="2025-03-01", hasta="2025-03-31",
+    )
+
+
+def test_fuente_solo_como_palabras_completas(retriever):
+    assert retriever.particion_consulta("despachos sur del 2025-03-14").fuentes == ("Despachos Sur.parquet",)
+    assert retriever.particion_consulta("despachos surtidos").fuentes == ()
+
+
+def test_nombres_cortos_no_acotan_la_consulta(retriever):
+    # 'viajes.csv' se llama como una palabra común
+    particion = retriever.particion_consulta("¿Cuántos viajes hizo el T209?")
+    assert particion == Particion()
+    assert not particion
+
+
+def test_solo_rango_de_fechas(retriever):
+    particion = retriever.particion_consulta("conductor del T209 el 2025-03-14")
+    assert particion == Particion(desde="2025-03-14", hasta="2025-03-14")
+
+
+class ConsultaFalsa:
+    """Registra las llamadas encadenadas de supabase-py."""
+    def __init__(self, llamadas):
+        self.llamadas = llamadas
+
+    def __getattr__(self, metodo):
+        def registrar(*args, **kwargs):
+            self.llamadas.append((metodo, *args))
+            return self
+        return registrar
+
+    def execute(self):
+        return SimpleNamespace(data=[], count=0)
+
+
+def _supabase():
+    llamadas = []
+    store = object.__new__(SupabaseStore)
+    store.supabase = ConsultaFalsa(llamadas)
+    return store, llamadas
+
+
+PARTICION = Particion(fuentes=("a.xlsx", "b.xlsx"), desde="2025-03-01", hasta="2025-03-31")
+
+
+def test_supabase_filtra_texto_y_claves_por_particion():
+    store, llamadas = _supabase()
+    store.buscar_por_texto([("fragmento", "T209")], limite=5, particion=PARTICION)
+    assert llamadas == [
+        ("table", "documentos_embeddings"), ("select", "fragmento, fuente"), ("ilike", "fragmento", "%T209%"),
+        ("in_", "fuente", ["a.xlsx", "b.xlsx"]), ("gte", "fecha_fin", "2025-03-01"), ("lte", "fecha_inicio", "2025-03-31"),
+        ("limit", 5),
+    ]
+
+    store, llamadas = _supabase()
+    store.buscar_por_claves(["tracto:T209"], particion=Particion(desde="2025-03-01"))
+    assert ("gte", "fecha_fin", "2025-03-01") in llamadas
+    assert not any(llamada[0] in ("in_", "lte") for llamada in llamadas)
+
+
+def test_supabase_busqueda_semantica_por_particion():
+    store, llamadas = _supabase()
+    store.buscar_similares([0.1], 0.5, 3)
+    assert llamadas[0][:2] == ("rpc", "match_documentos")
+
+    store, llamadas = _supabase()
+    store.buscar_similares([0.1], 0.5, 3, particion=Particion(fuentes=("a.xlsx",)))
+    assert llamadas[0] == ("rpc", "match_documentos_particion", {
+        "query_embedding": [0.1], "match_threshold": 0.5, "match_count": 3,
+        "fuentes": ["a.xlsx"], "fecha_desde": None, "fecha_hasta": None,
+    })
+
+
+def test_postgres_solo_incluye_los_filtros_presentes():
+    assert PostgresStore._filtros_particion(None) == ([], [])
+    assert PostgresStore._filtros_particion(PARTICION) == (
+        ["fuente = ANY(%s)", "fecha_fin >= %s", "fecha_inicio <= %s"],
+        [["a.xlsx", "b.xlsx"], "2025-03-01", "2025-03-31"],
+    )
+    assert PostgresStore._filtros_particion(Particion(hasta="2025-03-31")) == (["fecha_inicio <= %s"], ["2025-03-31"])
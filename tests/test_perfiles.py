@@ -0,0 +1,88 @@
+"""
+Pruebas de cuándo un perfil de entidad basta para responder y cuándo se agrega
+a los fragmentos (recuperación RAG y SELECT de `consultar_bd`).
+"""
+import pytest
+
+from src.api import endpoints
+from src.data_processing.perfiles import aspectos_perfil, responde_perfil
+from src.rag_engine.retriever import SupabaseRetriever
+
+PERFIL_T209 = {
+    'fuente': 'viajes.xlsx', 'tipo': 'tracto', 'clave': 'T209', 'valor': 'T209', 'viajes': 12,
+    'kilos': None, 'primera_fecha': '2025-01-02', 'ultima_fecha': '2025-03-14',
+    'relaciones': {'conductor': {'distintos': 1, 'principales': [
+        {'clave': 'LUIS ANGULO', 'valor': 'Luis Angulo', 'viajes': 12, 'ultima_fecha': '2025-03-14'},
+    ]}},
+}
+FRAGMENTO_T209 = {'fragmento': 'Tracto: T209 | Destino: SAN ANTONIO | RUT: 12345678-5', 'fuente': 'viajes.xlsx'}
+
+
+@pytest.mark.parametrize("pregunta, esperado", [
+    ("¿Quién es el conductor del T209?", True),
+    ("¿Cuántos viajes hizo el T209?", True),
+    ("¿Cuándo fue la última vez que se vio el T209?", True),
+    ("¿Cuál es el RUT del conductor del T209?", False),
+    ("¿Cuál es el destino del T209?", False),
+    ("¿En qué estado está el T209?", False),
+    ("¿Cuál es la HR del T209?", False),
+    ("Dame los viajes del tracto T209", False),
+    ("¿Cuántos viajes hizo el T209 en marzo de 2025?", False),
+    ("¿Quién condujo el T209 el 2025-03-14?", False),
+])
+def test_responde_perfil(pregunta, esperado):
+    assert responde_perfil(aspectos_perfil(pregunta), {'tracto'}) is esperado
+
+
+class StorePerfiles:
+    def buscar_perfiles(self, claves):
+        return [PERFIL_T209] if 'T209' in claves else []
+
+    def buscar_por_claves(self, claves, limite=10, particion=None):
+        return [FRAGMENTO_T209] if 'tracto:T209' in claves else []
+
+    def buscar_por_texto(self, condiciones, limite=10, particion=None):
+        return []
+
+    def seleccionar_fragmentos(self, filtro=None, limite=10):
+        return [{'fragmento': FRAGMENTO_T209['fragmento']}]
+
+    def listar_fuentes(self):
+        return ['viajes.xlsx']
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = StorePerfiles()
+    monkeypatch.setattr(endpoints, "store", store)
+    return store
+
+
+def test_select_con_pregunta_de_relacion_usa_solo_el_perfil(store):
+    resultado = endpoints._ejecutar_consulta_bd("SELECT", filtro_fragmento="T209",
+                                                aspectos=aspectos_perfil("¿Quién conduce el T209?"))
+    assert len(resultado) == 1
+    assert resultado[0]['fragmento'].startswith("Perfil de tracto T209")
+
+
+def test_select_con_rango_de_fechas_no_usa_solo_el_perfil(store):
+    resultado = endpoints._ejecutar_consulta_bd("SELECT", filtro_fragmento="T209",
+                                                aspectos=aspectos_perfil("¿Cuántos viajes hizo el T209 en marzo de 2025?"))
+    assert len(resultado) == 2
+
+
+def test_select_con_otro_campo_agrega_los_fragmentos(store):
+    resultado = endpoints._ejecutar_consulta_bd("SELECT", filtro_fragmento="T209",
+                                                aspectos=aspectos_perfil("¿Cuál es el destino del T209?"))
+    assert [fila['fragmento'][:18] for fila in resultado] == ["Perfil de tracto T", "Tracto: T209 | Des"]
+
+
+def test_retriever_agrega_el_perfil_a_los_fragmentos(store):
+    retriever = SupabaseRetriever()
+    retriever.store = store
+
+    documentos = retriever.retrieve_context("¿Cuál es el RUT del conductor del T209?")
+    assert [d.metadata['id'] for d in documentos] == ["perfil:tracto:T209", 0]
+
+    documentos = retriever.retrieve_context("¿Quién es el conductor del T209?")
+    assert [d.metadata['id'] for d in documentos] == ["perfil:tracto:T209"]
@@ -0,0 +1,78 @@
+"""
+Pruebas de los rollups por entidad y de su uso en `consultar_bd`.
+"""
+import pandas as pd
+import pytest
+
+from src.api import endpoints
+from src.data_processing.rollups import AcumuladorRollups
+
+
+def _filas(df):
+    acumulador = AcumuladorRollups()
+    acumulador.agregar(df)
+    return {(f['dimension'], f['clave']): f for f in acumulador.filas("viajes.xlsx")}
+
+
+def test_filas_con_kilos_ignora_valores_no_numericos():
+    filas = _filas(pd.DataFrame({'tracto': ['T209', 'T209'], 'kilos': [1000, 'x']}))
+    fila = filas[('tracto', 'T209')]
+    assert fila['viajes'] == 2
+    assert fila['kilos'] == 1000
+    assert fila['filas_con_kilos'] == 1
+
+
+def test_kilos_nulos_sin_valores_validos():
+    filas = _filas(pd.DataFrame({'tracto': ['T209'], 'kilos': ['x']}))
+    fila = filas[('tracto', 'T209')]
+    assert fila['kilos'] is None
+    assert fila['filas_con_kilos'] == 0
+
+
+def test_kilos_nulos_sin_columna_de_kilos():
+    fila = _filas(pd.DataFrame({'tracto': ['T209']}))[('tracto', 'T209')]
+    assert fila['kilos'] is None
+    assert fila['filas_con_kilos'] is None
+
+
+class StoreRollups:
+    def __init__(self, filas):
+        self.filas = filas
+
+    def buscar_rollups(self, claves):
+        return [f for f in self.filas if f['clave'] in claves]
+
+
+@pytest.fixture
+def rollups(monkeypatch):
+    def _configurar(df_por_fuente):
+        filas = []
+        for fuente, df in df_por_fuente.items():
+            acumulador = AcumuladorRollups()
+            acumulador.agregar(df)
+            filas += acumulador.filas(fuente)
+        monkeypatch.setattr(endpoints, "store", StoreRollups(filas))
+    return _configurar
+
+
+def test_promedio_divide_por_filas_con_kilos(rollups):
+    rollups({
+        "a.xlsx": pd.DataFrame({'tracto': ['T209', 'T209'], 'kilos': [1000, 'x']}),
+        "b.xlsx": pd.DataFrame({'tracto': ['T209'], 'kilos': [2000]}),
+    })
+    assert endpoints._consultar_rollups("AVG", "kilos", "T209") == pytest.approx(1500)
+    assert endpoints._consultar_rollups("SUM", "kilos", "T209") == pytest.approx(3000)
+    assert endpoints._consultar_rollups("COUNT", None, "T209") == 3
+
+
+def test_count_indica_la_unidad(rollups):
+    rollups({"a.xlsx": pd.DataFrame({'tracto': ['T209', 'T209'], 'kilos': [1, 2]})})
+    assert endpoints._ejecutar_consulta_bd("COUNT", filtro_fragmento="T209") == {
+        'viajes': 2, 'unidad': 'viajes (filas del archivo)',
+    }
+
+
+def test_sin_kilos_validos_no_responde_desde_rollups(rollups):
+    rollups({"a.xlsx": pd.DataFrame({'tracto': ['T209'], 'kilos': ['x']})})
+    assert endpoints._consultar_rollups("AVG", "kilos", "T209") is None
+    assert endpoints._consultar_rollups("COUNT", None, "T209") == 1
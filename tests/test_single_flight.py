@@ -0,0 +1,100 @@
+"""
+Pruebas de la deduplicación de llamadas concurrentes idénticas.
+"""
+import threading
+import time
+
+from src.api import endpoints
+from src.utils.single_flight import SingleFlight
+
+HILOS = 8
+
+
+def _esperar(condicion, plazo=2.0):
+    limite = time.monotonic() + plazo
+    while not condicion():
+        assert time.monotonic() < limite, "plazo agotado"
+        time.sleep(0.005)
+
+
+def _en_paralelo(funcion):
+    """Ejecuta `funcion` en HILOS hilos y devuelve lo que obtuvo cada uno (resultado o excepción)."""
+    obtenidos = [None] * HILOS
+
+    def hilo(i):
+        try:
+            obtenidos[i] = funcion()
+        except Exception as e:
+            obtenidos[i] = e
+
+    hilos = [threading.Thread(target=hilo, args=(i,)) for i in range(HILOS)]
+    for h in hilos:
+        h.start()
+    return hilos, obtenidos
+
+
+def test_llamadas_concurrentes_se_ejecutan_una_vez():
+    vuelos = SingleFlight()
+    liberar = threading.Event()
+    ejecuciones = []
+
+    def lenta():
+        ejecuciones.append(1)
+        liberar.wait(2)
+        return {"total": 42}
+
+    hilos, obtenidos = _en_paralelo(lambda: vuelos.do("clave", lenta))
+    # Todos los hilos se suman a la ejecución en curso antes de que termine
+    _esperar(lambda: vuelos.estadisticas["compartidas"] == HILOS - 1)
+    liberar.set()
+    for h in hilos:
+        h.join()
+
+    assert len(ejecuciones) == 1
+    assert obtenidos == [{"total": 42}] * HILOS
+    assert vuelos._en_vuelo == {}
+
+    # No es una caché: la siguiente llamada vuelve a ejecutarse
+    assert vuelos.do("clave", lenta) == {"total": 42}
+    assert len(ejecuciones) == 2
+
+
+def test_excepcion_llega_a_todos_y_libera_la_clave():
+    vuelos = SingleFlight()
+    liberar = threading.Event()
+
+    def falla():
+        liberar.wait(2)
+        raise ValueError("sin conexión")
+
+    hilos, obtenidos = _en_paralelo(lambda: vuelos.do("clave", falla))
+    _esperar(lambda: vuelos.estadisticas["compartidas"] == HILOS - 1)
+    liberar.set()
+    for h in hilos:
+        h.join()
+
+    assert all(isinstance(e, ValueError) and str(e) == "sin conexión" for e in obtenidos)
+    assert vuelos.estadisticas["ejecuciones"] == 1
+    assert vuelos._en_vuelo == {}
+    assert vuelos.do("clave", lambda: "ok") == "ok"
+
+
+def test_consultar_bd_comparte_consultas_identicas(monkeypatch):
+    monkeypatch.setattr(endpoints, "_vuelos_bd", SingleFlight())
+    liberar = threading.Event()
+    ejecuciones = []
+
+    def ejecutar(*argumentos):
+        ejecuciones.append(argumentos)
+        liberar.wait(2)
+        return 5
+
+    monkeypatch.setattr(endpoints, "_ejecutar_consulta_bd", ejecutar)
+    hilos, obtenidos = _en_paralelo(lambda: endpoints.consultar_bd("count", filtro_fragmento="T209", pregunta="¿Cuántos?"))
+    _esperar(lambda: endpoints._vuelos_bd.estadisticas["compartidas"] == HILOS - 1)
+    liberar.set()
+    for h in hilos:
+        h.join()
+
+    assert len(ejecuciones) == 1
+    assert obtenidos == [5] * HILOS
@@ -0,0 +1,151 @@
+"""
+Pruebas de `PostgresStore` con conexiones y cursores falsos (sin base de datos).
+"""
+import csv
+import io
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from psycopg2 import errors as pg_errors
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from src.rag_engine import vector_store
+from src.rag_engine.vector_store import PostgresStore
+
+
+class CursorFalso:
+    def __init__(self, conexion):
+        self.conexion = conexion
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, sql, parametros=None):
+        self.conexion.sentencias.append(sql.split(" (")[0].split(" AS ")[0])
+        if self.conexion.fallos:
+            raise self.conexion.fallos.pop(0)
+
+    def copy_expert(self, sql, buffer):
+        self.conexion.copias.append((sql, buffer.getvalue()))
+
+    def fetchone(self):
+        return {"x": 1}
+
+
+class ConexionFalsa:
+    def __init__(self, fallos=(), estado=TRANSACTION_STATUS_IDLE):
+        self.preparadas = set()
+        self.fallos = list(fallos)
+        self.sentencias = []
+        self.copias = []
+        self.rollbacks = 0
+        self.info = SimpleNamespace(transaction_status=estado)
+
+    def cursor(self, cursor_factory=None):
+        return CursorFalso(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class PoolFalso:
+    def __init__(self, conexion):
+        self.conexion = conexion
+        self.en_uso = 0
+        self.maximo_en_uso = 0
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        with self._lock:
+            self.en_uso += 1
+            self.maximo_en_uso = max(self.maximo_en_uso, self.en_uso)
+        return self.conexion
+
+    def putconn(self, conexion):
+        with self._lock:
+            self.en_uso -= 1
+
+
+def _store(conexion, maxconn=2):
+    store = object.__new__(PostgresStore)
+    store._dict_cursor = None
+    store._cupos = threading.BoundedSemaphore(maxconn)
+    store.pool = PoolFalso(conexion)
+    return store
+
+
+@pytest.fixture(autouse=True)
+def sentencia_de_prueba(monkeypatch):
+    monkeypatch.setitem(vector_store.SENTENCIAS_PREPARADAS, "prueba_stmt", ("integer", "SELECT $1"))
+
+
+def test_vuelve_a_preparar_si_el_backend_no_tiene_la_sentencia():
+    conexion = ConexionFalsa(fallos=[pg_errors.InvalidSqlStatementName("no existe")])
+    conexion.preparadas.add("prueba_stmt")
+    _store(conexion)._ejecutar_preparada(conexion, "prueba_stmt", (1,))
+    assert conexion.sentencias == ["EXECUTE prueba_stmt", "PREPARE prueba_stmt", "EXECUTE prueba_stmt"]
+    assert conexion.rollbacks == 1
+    assert "prueba_stmt" in conexion.preparadas
+
+
+def test_sentencia_ya_preparada_en_el_backend_se_ejecuta():
+    conexion = ConexionFalsa(fallos=[pg_errors.DuplicatePreparedStatement("ya existe")])
+    _store(conexion)._ejecutar_preparada(conexion, "prueba_stmt", (1,))
+    assert conexion.sentencias == ["PREPARE prueba_stmt", "EXECUTE prueba_stmt"]
+    assert "prueba_stmt" in conexion.preparadas
+
+
+def test_no_reintenta_dentro_de_una_transaccion_en_curso():
+    conexion = ConexionFalsa(fallos=[pg_errors.InvalidSqlStatementName("no existe")], estado=TRANSACTION_STATUS_INTRANS)
+    conexion.preparadas.add("prueba_stmt")
+    with pytest.raises(pg_errors.InvalidSqlStatementName):
+        _store(conexion)._ejecutar_preparada(conexion, "prueba_stmt", (1,))
+    assert conexion.rollbacks == 0
+
+
+def test_copy_serializa_fragmentos_en_csv():
+    conexion = ConexionFalsa()
+    total = _store(conexion).insertar_fragmentos([{
+        "fuente": "viajes.xlsx",
+        "chunk_id": "chunk_0",
+        "fragmento": 'Cliente: "ACME, S.A."\nKilos: 1000',
+        "claves": ['tracto:T209', 'cliente:A"B'],
+        "fecha_inicio": "2025-03-01",
+        "fecha_fin": "2025-03-14",
+        "embedding": [0.5, -1, 2],
+        "metadata": {"filas": "0-9", "nota": "ñ"},
+    }])
+    assert total == 1
+    sql, datos = conexion.copias[0]
+    assert "(fuente, chunk_id, fragmento, claves, fecha_inicio, fecha_fin, embedding, metadata)" in sql
+    fila = next(csv.reader(io.StringIO(datos)))
+    assert fila == [
+        "viajes.xlsx", "chunk_0", 'Cliente: "ACME, S.A."\nKilos: 1000',
+        '{"tracto:T209","cliente:A\\"B"}', "2025-03-01", "2025-03-14",
+        "[0.5,-1.0,2.0]", '{"filas": "0-9", "nota": "ñ"}',
+    ]
+
+
+def test_conexiones_esperan_en_lugar_de_agotar_el_pool():
+    conexion = ConexionFalsa()
+    store = _store(conexion, maxconn=2)
+
+    def usar():
+        with store._conexion():
+            time.sleep(0.05)
+
+    hilos = [threading.Thread(target=usar) for _ in range(6)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert store.pool.maximo_en_uso == 2
+    assert store.pool.en_uso == 0
@@ -0,0 +1,158 @@
+"""
+Pruebas de la cola del webhook de WhatsApp usando `RegistroSender` (no contacta
+a Meta) y un procesador de prueba en lugar del agente RAG.
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from src.integrations import whatsapp_handler
+from src.integrations.whatsapp_handler import ColaWhatsApp, RegistroSender
+
+
+class ProcesadorFalso:
+    """Responde 'R:<consulta>' y registra cada llamada con su instante."""
+    def __init__(self, demoras=None, bloqueo: asyncio.Event = None):
+        self.llamadas = []
+        self.demoras = demoras or {}
+        self.bloqueo = bloqueo
+
+    async def __call__(self, remitente: str, consulta: str) -> str:
+        self.llamadas.append((time.monotonic(), remitente, consulta))
+        if self.bloqueo is not None:
+            await self.bloqueo.wait()
+        await asyncio.sleep(self.demoras.get(consulta, 0))
+        return f"R:{consulta}"
+
+
+def _cola(procesador, **opciones):
+    parametros = {"max_cola": 10, "num_workers": 2, "ventana_debounce": 0.05, "espera_maxima": 1.0}
+    parametros.update(opciones)
+    return ColaWhatsApp(procesar=procesador, sender=RegistroSender(), **parametros)
+
+
+def _payload(id_mensaje: str, remitente: str, texto: str) -> dict:
+    return {"entry": [{"changes": [{"value": {"messages": [
+        {"id": id_mensaje, "from": remitente, "type": "text", "text": {"body": texto}}
+    ]}}]}]}
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    """Instala una cola de prueba en el módulo y devuelve una app con el router."""
+    monkeypatch.setattr(whatsapp_handler, "_mensajes_vistos", type(whatsapp_handler._mensajes_vistos)())
+
+    def instalar(cola):
+        monkeypatch.setattr(whatsapp_handler, "cola_whatsapp", cola)
+        app = FastAPI()
+        app.include_router(whatsapp_handler.router, prefix="/api")
+        return httpx.AsyncClient(app=app, base_url="http://test")
+    return instalar
+
+
+def test_mensajes_en_rafaga_se_agrupan_en_una_consulta():
+    async def escenario():
+        procesador = ProcesadorFalso()
+        cola = _cola(procesador)
+        cola.iniciar()
+        for texto in ("hola", "¿conductor del T209?", "  "):
+            assert cola.recibir("569111", texto)
+        await asyncio.sleep(0.15)
+        await cola.detener()
+        return procesador, cola
+
+    procesador, cola = asyncio.run(escenario())
+    assert [c[2] for c in procesador.llamadas] == ["hola\n¿conductor del T209?"]
+    assert cola.sender.enviados == [{"destinatario": "569111", "texto": "R:hola\n¿conductor del T209?"}]
+    assert cola.estadisticas["agrupados"] == 2
+
+
+def test_rafaga_se_vacia_al_alcanzar_espera_maxima():
+    async def escenario():
+        procesador = ProcesadorFalso()
+        cola = _cola(procesador, ventana_debounce=0.1, espera_maxima=0.25)
+        cola.iniciar()
+        inicio = time.monotonic()
+        # El remitente escribe cada 50 ms durante 0,6 s: el debounce nunca vence
+        for i in range(12):
+            cola.recibir("569111", f"m{i}")
+            await asyncio.sleep(0.05)
+        fin = time.monotonic()
+        await cola.detener()
+        return procesador, inicio, fin
+
+    procesador, inicio, fin = asyncio.run(escenario())
+    assert len(procesador.llamadas) >= 2
+    primera = procesador.llamadas[0][0]
+    assert primera - inicio < 0.4 < fin - inicio
+    # Ningún mensaje se pierde ni se repite
+    textos = "\n".join(c[2] for c in procesador.llamadas).split("\n")
+    assert textos == [f"m{i}" for i in range(12)]
+
+
+def test_cola_llena_rechaza_y_webhook_responde_503(webhook):
+    async def escenario():
+        bloqueo = asyncio.Event()
+        cola = _cola(ProcesadorFalso(bloqueo=bloqueo), max_cola=2, num_workers=1)
+        cola.iniciar()
+        async with webhook(cola) as cliente:
+            # Dos ráfagas abiertas ocupan todos los cupos
+            assert (await cliente.post("/api/whatsapp/webhook", json=_payload("a", "1", "x"))).status_code == 200
+            assert (await cliente.post("/api/whatsapp/webhook", json=_payload("b", "2", "y"))).status_code == 200
+            assert not cola.recibir("3", "z")
+            rechazo = await cliente.post("/api/whatsapp/webhook", json=_payload("c", "3", "z"))
+            # Un remitente con ráfaga abierta sigue pudiendo agregar mensajes
+            agregado = await cliente.post("/api/whatsapp/webhook", json=_payload("d", "1", "x2"))
+        bloqueo.set()
+        await cola.detener()
+        return rechazo, agregado, cola
+
+    rechazo, agregado, cola = asyncio.run(escenario())
+    assert rechazo.status_code == 503
+    assert rechazo.headers["Retry-After"] == "5"
+    assert agregado.status_code == 200
+    assert cola.estadisticas["rechazados"] == 2
+    # El mensaje rechazado no se marca como visto: la reentrega de Meta se acepta
+    assert "c" not in whatsapp_handler._mensajes_vistos
+
+
+def test_reentregas_del_mismo_mensaje_se_descartan(webhook):
+    async def escenario():
+        procesador = ProcesadorFalso()
+        cola = _cola(procesador)
+        cola.iniciar()
+        async with webhook(cola) as cliente:
+            for _ in range(3):
+                respuesta = await cliente.post("/api/whatsapp/webhook", json=_payload("wamid.1", "569111", "hola"))
+                assert respuesta.status_code == 200
+        await asyncio.sleep(0.15)
+        await cola.detener()
+        return procesador, cola
+
+    procesador, cola = asyncio.run(escenario())
+    assert [c[2] for c in procesador.llamadas] == ["hola"]
+    assert cola.estadisticas["recibidos"] == 1
+
+
+def test_respuestas_de_un_remitente_se_envian_en_orden():
+    async def escenario():
+        # La primera consulta tarda más que la segunda, y hay workers libres para ambas
+        procesador = ProcesadorFalso(demoras={"primera": 0.2, "segunda": 0.0})
+        cola = _cola(procesador, num_workers=4)
+        cola.iniciar()
+        cola.recibir("569111", "primera")
+        await asyncio.sleep(0.1)
+        cola.recibir("569111", "segunda")
+        cola.recibir("569222", "otra")
+        await asyncio.sleep(0.1)
+        await cola.detener()
+        return cola
+
+    cola = asyncio.run(escenario())
+    del_remitente = [m["texto"] for m in cola.sender.enviados if m["destinatario"] == "569111"]
+    assert del_remitente == ["R:primera", "R:segunda"]
+    # Otro remitente no espera al primero
+    assert cola.sender.enviados[0] == {"destinatario": "569222", "texto": "R:otra"}